@@ -0,0 +1,179 @@
+import os
+import errno
+import shutil
+import logging
+from typing import Optional, Set, Tuple
+
+from .fdpool import DirFdPool
+from .paths import temp_name
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20
+
+# errors meaning a zero-copy syscall cannot be used for this pair of files
+_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF}
+
+
+def _copy_file_range(infd: int, outfd: int) -> None:
+    while os.copy_file_range(infd, outfd, 1 << 30) > 0:
+        pass
+
+
+def _sendfile(infd: int, outfd: int) -> None:
+    offset = os.lseek(infd, 0, os.SEEK_CUR)
+
+    while True:
+        sent = os.sendfile(outfd, infd, offset, CHUNK_SIZE)
+
+        if sent == 0:
+            break
+
+        offset += sent
+
+    os.lseek(infd, offset, os.SEEK_SET)
+
+
+def _read_write(infd: int, outfd: int) -> None:
+    while True:
+        data = os.read(infd, CHUNK_SIZE)
+
+        if not data:
+            break
+
+        view = memoryview(data)
+
+        while view:
+            view = view[os.write(outfd, view) :]
+
+
+def copy_data(infd: int, outfd: int) -> None:
+    """
+    Copy the rest of a file to another one, in the kernel if possible.
+
+    ``copy_file_range`` is tried first, then ``sendfile``, then a plain read
+    and write loop. A method that turns out not to work for the two files
+    hands over at the current offset, so nothing is copied twice.
+
+    :param infd: The descriptor to read from.
+    :param outfd: The descriptor to write to.
+    """
+    methods = []
+
+    if hasattr(os, "copy_file_range"):
+        methods.append(_copy_file_range)
+
+    if hasattr(os, "sendfile"):
+        methods.append(_sendfile)
+
+    for method in methods:
+        try:
+            method(infd, outfd)
+            return
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+
+            log.debug("%s not supported: %s", method.__name__, e)
+
+    _read_write(infd, outfd)
+
+
+def copy_file(source: str, dest: str) -> None:
+    """
+    Copy a file with its permission bits and timestamps.
+
+    The copy is written next to ``dest`` and renamed into place, so ``dest``
+    never holds a partial copy.
+
+    :param source: The file to copy.
+    :param dest: The path of the copy.
+    """
+    parent, name = os.path.split(dest)
+    temp = os.path.join(parent, temp_name(name))
+
+    try:
+        with open(source, "rb") as fsrc, open(temp, "wb") as fdst:
+            copy_data(fsrc.fileno(), fdst.fileno())
+
+        shutil.copystat(source, temp)
+        os.replace(temp, dest)
+    except BaseException:
+        if os.path.lexists(temp):
+            os.unlink(temp)
+        raise
+
+
+class Adopter:
+    """
+    Move files from the target into the stow directory.
+
+    Files are renamed where possible. When a rename between two directories
+    fails because they are on different devices, the pair of directories is
+    remembered and the remaining files between them are copied straight
+    away, without another failing rename per file. Copies use zero-copy
+    syscalls (see :func:`copy_data`) and keep the file metadata.
+
+    With a :class:`stowng.fdpool.DirFdPool`, renames are done relative to
+    the cached descriptors of both directories, so the files of one
+    directory share a single lookup of each parent.
+
+    :param pool: The descriptor pool, if tasks are processed through one.
+    """
+
+    def __init__(self, pool: Optional[DirFdPool] = None) -> None:
+        self._pool = pool
+        self._cross_device: Set[Tuple[str, str]] = set()
+
+    def move(self, source: str, dest: str) -> None:
+        """
+        Move a file, replacing ``dest``.
+
+        :param source: The file to move.
+        :param dest: The new path of the file.
+        """
+        source_dir, source_name = os.path.split(source)
+        dest_dir, dest_name = os.path.split(dest)
+        pair = (source_dir, dest_dir)
+
+        if pair not in self._cross_device:
+            try:
+                self._rename(source_dir, source_name, dest_dir, dest_name)
+                return
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+
+            log.debug("%s and %s are on different devices", source_dir, dest_dir)
+            self._cross_device.add(pair)
+
+        if os.path.islink(source) or not os.path.isfile(source):
+            shutil.move(source, dest)
+            return
+
+        copy_file(source, dest)
+        os.unlink(source)
+
+    def _rename(
+        self, source_dir: str, source_name: str, dest_dir: str, dest_name: str
+    ) -> None:
+        if self._pool is None:
+            os.rename(
+                os.path.join(source_dir, source_name),
+                os.path.join(dest_dir, dest_name),
+            )
+            return
+
+        source_fd = self._pool.acquire(source_dir)
+
+        try:
+            dest_fd = self._pool.acquire(dest_dir)
+
+            try:
+                os.rename(
+                    source_name, dest_name, src_dir_fd=source_fd, dst_dir_fd=dest_fd
+                )
+            finally:
+                self._pool.release(dest_dir, dest_fd)
+        finally:
+            self._pool.release(source_dir, source_fd)
@@ -21,8 +21,8 @@ class CurrentWorkingDirectory:
     def __enter__(self):
         self.old_cwd = os.getcwd()
         os.chdir(self.path)
-        log.debug(f"cwd now {os.getcwd()}")
+        log.debug("cwd now %s", os.getcwd())
 
     def __exit__(self, type, value, tb):
         os.chdir(self.old_cwd)
-        log.debug(f"cwd restored to {os.getcwd()}")
+        log.debug("cwd restored to %s", os.getcwd())
@@ -0,0 +1,386 @@
+import os
+import time
+import heapq
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from .adopt import Adopter
+from .fdpool import DirFdPool, dir_fd_supported
+from .paths import parts
+from .materialize import LinkMode
+from .task import Action, NodeType, Task
+from .throttle import RateLimiter
+
+log = logging.getLogger(__name__)
+
+MAX_SYNC_JOBS = 16
+PARALLEL_CHUNK = 1 << 16
+
+
+def task_paths(task: Task) -> Tuple[str, ...]:
+    """
+    Get the paths a task modifies.
+
+    :param task: The task.
+
+    :returns: The paths.
+    """
+    if task.action == Action.MOVE:
+        return (task.source, task.dest)
+
+    return (task.path,)
+
+
+def sync_paths(
+    paths: Iterable[str],
+    jobs: int = MAX_SYNC_JOBS,
+    limiter: Optional[RateLimiter] = None,
+) -> None:
+    """
+    Flush files and directories to disk.
+
+    Syncing a directory persists the entries created, removed or renamed in
+    it. The paths are independent, so they are synced concurrently. Paths
+    that no longer exist are skipped, their removal is persisted by syncing
+    their parent.
+
+    :param paths: The paths to sync.
+    :param jobs: The maximum number of paths synced at the same time.
+    :param limiter: Limits the number of paths synced per second.
+    """
+
+    def sync(path: str) -> None:
+        if limiter is not None:
+            limiter.acquire()
+
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return
+
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    paths = list(paths)
+
+    if len(paths) < 2 or jobs == 1:
+        for path in paths:
+            sync(path)
+        return
+
+    with ThreadPoolExecutor(max_workers=min(jobs, len(paths))) as pool:
+        for _ in pool.map(sync, paths):
+            pass
+
+
+def build_dependencies(tasks: Sequence[Task]) -> List[List[int]]:
+    """
+    Compute which tasks have to wait for which.
+
+    A task depends on every earlier task that modifies the same path, one of
+    its parents or one of its children. This covers removes before creates
+    on the same path, parent mkdirs before their children, unlinking the
+    children before an rmdir and moves before the link replacing the moved
+    file, while tasks on unrelated paths stay independent.
+
+    Only the latest task per path and the tasks below a path since then are
+    recorded, earlier ones are ordered transitively.
+
+    :param tasks: The tasks, in plan order.
+
+    :returns: For every task, the indices of the earlier tasks it depends on.
+
+    :Example:
+    >>> from .task import NodeType
+    >>> deps = build_dependencies([
+    ...     Task(Action.REMOVE, NodeType.LINK, path="a"),
+    ...     Task(Action.CREATE, NodeType.DIR, path="a"),
+    ...     Task(Action.CREATE, NodeType.LINK, path="a/x"),
+    ...     Task(Action.CREATE, NodeType.LINK, path="b"),
+    ...     Task(Action.REMOVE, NodeType.DIR, path="a"),
+    ... ])
+    >>> [sorted(d) for d in deps]
+    [[], [0], [1], [], [1, 2]]
+    """
+    last: Dict[Tuple[str, ...], int] = {}
+    below: Dict[Tuple[str, ...], List[int]] = {}
+    dependencies: List[List[int]] = []
+
+    for index, task in enumerate(tasks):
+        deps = set()
+
+        for path in task_paths(task):
+            components = parts(path)
+
+            for depth in range(1, len(components)):
+                ancestor = components[:depth]
+
+                if ancestor in last:
+                    deps.add(last[ancestor])
+
+            if components in last:
+                deps.add(last[components])
+
+            deps.update(below.pop(components, ()))
+
+            last[components] = index
+
+            for depth in range(1, len(components)):
+                below.setdefault(components[:depth], []).append(index)
+
+        deps.discard(index)
+        dependencies.append(sorted(deps))
+
+    return dependencies
+
+
+class Executor:
+    """
+    Process planned tasks, optionally on several threads.
+
+    With more than one job, tasks only wait for the earlier tasks they
+    depend on (see :func:`build_dependencies`); independent tasks run
+    concurrently. The filesystem ends up in the same state as after
+    processing the tasks one by one in plan order.
+
+    With ``dir_fd``, every directory containing a planned path is opened
+    once and the tasks use the ``*at()`` variants of the syscalls relative to
+    it, so the kernel does not walk the full path again for every operation
+    and a change of the working directory has no effect.
+
+    With ``durable``, the parent directories of all changed paths are
+    recorded and each of them is synced once after the last task, instead
+    of syncing after every single task. Moved files are synced as well.
+
+    Moves of adopted files go through an :class:`stowng.adopt.Adopter`.
+
+    ``max_rate`` limits the operations started per second, including the
+    syncs of ``durable``, and ``max_inflight`` the operations running at the
+    same time. Tasks are still started in plan order as far as their
+    dependencies allow, so throttling only stretches the run out in time.
+
+    The tasks are consumed as a stream. With more than one job they are
+    scheduled in chunks of ``PARALLEL_CHUNK``, each chunk finishing before
+    the next one starts, so the dependency graph of a large plan is never
+    held in memory as a whole.
+
+    :param jobs: The number of tasks processed at the same time.
+    :param dir_fd: Process tasks relative to open directory descriptors.
+    :param max_open_dirs: The maximum number of cached descriptors.
+    :param durable: Sync the changes to disk before returning.
+    :param link_mode: How links are created.
+    :param max_rate: The maximum number of operations per second.
+    :param max_inflight: The maximum number of operations at the same time.
+    """
+
+    def __init__(
+        self,
+        jobs: int = 1,
+        dir_fd: bool = False,
+        max_open_dirs: int = 64,
+        durable: bool = False,
+        link_mode: LinkMode = LinkMode.SYMLINK,
+        max_rate: Optional[float] = None,
+        max_inflight: Optional[int] = None,
+    ) -> None:
+        if jobs < 1:
+            raise ValueError(f"invalid number of jobs: {jobs}")
+
+        if max_inflight is not None:
+            if max_inflight < 1:
+                raise ValueError(f"invalid number of operations: {max_inflight}")
+
+            jobs = min(jobs, max_inflight)
+
+        if dir_fd and not dir_fd_supported():
+            log.warning("dir_fd operations are not supported here, using paths")
+            dir_fd = False
+
+        self._jobs = jobs
+        self._dir_fd = dir_fd
+        self._max_open_dirs = max_open_dirs
+        self._pool: Optional[DirFdPool] = None
+        self._adopter = Adopter()
+        self._durable = durable
+        self._dirty: Set[str] = set()
+        self._link_mode = link_mode
+        self._max_inflight = max_inflight
+        self._limiter = RateLimiter(max_rate) if max_rate is not None else None
+        self._on_done: Optional[Callable[[int, Task], None]] = None
+        self.sync_time = 0.0
+
+    def run(
+        self,
+        tasks: Iterable[Task],
+        on_done: Optional[Callable[[int, Task], None]] = None,
+    ) -> None:
+        """
+        Process the tasks.
+
+        :param tasks: The tasks, in plan order.
+        :param on_done: Called with the position in the plan and the task for
+            every task that was processed successfully.
+
+        :raises Exception: The error of the first failing task. No further
+            tasks are started once a task has failed.
+        """
+        if self._dir_fd:
+            self._pool = DirFdPool(self._max_open_dirs)
+
+        self._adopter = Adopter(self._pool)
+
+        self._on_done = on_done
+
+        try:
+            if self._jobs == 1:
+                for index, task in enumerate(tasks):
+                    self._throttle()
+                    self._process(index, task)
+            else:
+                self._run_chunked(tasks)
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+
+            # also persist the tasks done before a failure
+            if self._durable:
+                self._sync()
+
+            if self._limiter is not None:
+                log.debug("Throttled for %.3f seconds", self._limiter.waited)
+
+    def _throttle(self) -> None:
+        """
+        Wait until the next operation may start.
+        """
+        if self._limiter is not None:
+            self._limiter.acquire()
+
+    def _sync(self) -> None:
+        """
+        Sync everything recorded as changed by the processed tasks.
+        """
+        start = time.monotonic()
+        paths = sorted(self._dirty)
+        self._dirty.clear()
+
+        jobs = self._max_inflight or max(self._jobs, MAX_SYNC_JOBS)
+        sync_paths(paths, jobs, self._limiter)
+
+        self.sync_time = time.monotonic() - start
+        log.debug("Synced %d paths in %.3f seconds", len(paths), self.sync_time)
+
+    def _record(self, task: Task) -> None:
+        """
+        Remember the directories, and moved or copied files, a task changed.
+
+        :param task: The processed task.
+        """
+        for path in task_paths(task):
+            self._dirty.add(os.path.dirname(path) or ".")
+
+        if task.action == Action.MOVE:
+            self._dirty.add(task.dest)
+        elif (
+            self._link_mode in (LinkMode.COPY, LinkMode.REFLINK)
+            and task.type_ == NodeType.LINK
+            and task.action != Action.REMOVE
+        ):
+            self._dirty.add(task.path)
+
+    def _process(self, index: int, task: Task) -> None:
+        """
+        Process a single task.
+
+        :param index: The position of the task in the plan.
+        :param task: The task.
+        """
+        if task.action == Action.MOVE:
+            self._adopter.move(task.source, task.dest)
+        elif self._pool is None:
+            task.process(self._link_mode)
+        else:
+            parent, name = os.path.split(task.path)
+            fd = self._pool.acquire(parent)
+
+            try:
+                task.process_at(fd, name, self._link_mode)
+            finally:
+                self._pool.release(parent, fd)
+
+        if self._pool is not None:
+            for path in task_paths(task):
+                self._pool.invalidate(path)
+
+        if self._durable:
+            self._record(task)
+
+        if self._on_done is not None:
+            self._on_done(index, task)
+
+    def _run_chunked(self, tasks: Iterable[Task]) -> None:
+        chunk: List[Task] = []
+        offset = 0
+
+        for task in tasks:
+            chunk.append(task)
+
+            if len(chunk) >= PARALLEL_CHUNK:
+                self._run_parallel(chunk, offset)
+                offset += len(chunk)
+                chunk = []
+
+        if len(chunk) > 1:
+            self._run_parallel(chunk, offset)
+        elif chunk:
+            self._throttle()
+            self._process(offset, chunk[0])
+
+    def _run_parallel(self, tasks: Sequence[Task], offset: int = 0) -> None:
+        dependencies = build_dependencies(tasks)
+        waiting = [len(deps) for deps in dependencies]
+        dependents: List[List[int]] = [[] for _ in tasks]
+
+        for index, deps in enumerate(dependencies):
+            for dep in deps:
+                dependents[dep].append(index)
+
+        ready = [index for index, count in enumerate(waiting) if count == 0]
+        heapq.heapify(ready)
+
+        running: Dict[Future, int] = {}
+        failed: Optional[Tuple[int, BaseException]] = None
+
+        log.debug("Processing %d tasks with %d jobs", len(tasks), self._jobs)
+
+        with ThreadPoolExecutor(max_workers=self._jobs) as pool:
+            while running or (ready and failed is None):
+                while ready and failed is None and len(running) < self._jobs:
+                    self._throttle()
+                    index = heapq.heappop(ready)
+                    future = pool.submit(self._process, offset + index, tasks[index])
+                    running[future] = index
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    index = running.pop(future)
+                    error = future.exception()
+
+                    if error is not None:
+                        if failed is None or index < failed[0]:
+                            failed = (index, error)
+                        continue
+
+                    for dependent in dependents[index]:
+                        waiting[dependent] -= 1
+
+                        if waiting[dependent] == 0:
+                            heapq.heappush(ready, dependent)
+
+        if failed is not None:
+            raise failed[1]
@@ -7,9 +7,15 @@ from typing import Dict, List, Optional
 
 from .stow import Stow
 from .unstow import Unstow
+from .restow import Restow
 from .tasks import Tasks
 from .filesystem import Filesystem
 from .ignore import Ignore
+from .fingerprint import DirPrint
+from .journal import JOURNAL_NAME
+from .manifest import MANIFEST_NAME, Manifest
+from .materialize import LinkMode
+from .utils import internal_error, join
 
 log = logging.getLogger(__name__)
 
@@ -29,12 +35,41 @@ class Farmer:
         no_folding: bool = False,
         paranoid: bool = False,
         test_mode: bool = False,
+        jobs: int = 1,
+        dir_fd: bool = False,
+        durable: bool = False,
+        journal: bool = False,
+        link_mode: LinkMode = LinkMode.SYMLINK,
+        max_rate: Optional[float] = None,
+        max_inflight: Optional[int] = None,
+        manifest: bool = False,
     ) -> None:
         self._action_count = 0
+        self._jobs = jobs
+        self._dir_fd = dir_fd
+        self._durable = durable
+        self._journal: Optional[str] = None
+        self._link_mode = link_mode
+        self._max_rate = max_rate
+        self._max_inflight = max_inflight
 
         stow_path = os.path.relpath(dir, target)
-        log.debug(f"stow dir is {dir}")
-        log.debug(f"stow dir path relative to target {target} is {stow_path}")
+        log.debug("stow dir is %s", dir)
+        log.debug("stow dir path relative to target %s is %s", target, stow_path)
+
+        if journal:
+            self._journal = join(stow_path, JOURNAL_NAME)
+
+        # the manifest is opened once the target is the working directory
+        self._manifest_path = join(stow_path, MANIFEST_NAME)
+        self._manifest: Optional[Manifest] = None
+        self._use_manifest = manifest
+        self._planned: List[str] = []
+        self._fingerprints: Dict[str, Dict[str, DirPrint]] = {}
+
+        if link_mode != LinkMode.SYMLINK:
+            # only files can be hard linked or copied, not whole directories
+            no_folding = True
 
         self._tasks = Tasks()
         filesystem = Filesystem(
@@ -46,6 +81,7 @@ class Farmer:
         )
         ignore_manager = Ignore(ignore)
 
+        self._filesystem = filesystem
         self._tasks.set_filesystem(filesystem)
         self._stow = Stow(
             self._tasks,
@@ -63,8 +99,30 @@ class Farmer:
             stow_path,
             dotfiles,
             adopt,
+            no_folding,
             compat,
         )
+        self._restow = Restow(
+            self._tasks,
+            filesystem,
+            ignore_manager,
+            stow_path,
+            self._unstow,
+            dotfiles,
+            adopt,
+            no_folding,
+            compat,
+        )
+        self._restow.set_options(
+            [
+                f"dotfiles={dotfiles}",
+                f"no_folding={no_folding}",
+                f"link_mode={link_mode}",
+                *(f"ignore={p.pattern}" for p in ignore or []),
+                *(f"defer={p.pattern}" for p in defer or []),
+                *(f"override={p.pattern}" for p in override or []),
+            ]
+        )
 
     def plan_stow(self, pkgs_to_stow: List[str]) -> None:
         """
@@ -72,7 +130,9 @@ class Farmer:
 
         :param pkgs_to_stow: The packages to stow.
         """
+        self._open_manifest()
         self._stow.plan_stow(pkgs_to_stow)
+        self._planned.extend(pkgs_to_stow)
 
     def plan_unstow(self, pkgs_to_delete: List[str]) -> None:
         """
@@ -80,13 +140,102 @@ class Farmer:
 
         :param pkgs_to_delete: The packages to unstow.
         """
+        self._open_manifest()
         self._unstow.plan_unstow(pkgs_to_delete)
+        self._planned.extend(pkgs_to_delete)
+
+        # a restow of an unstowed package must not be skipped
+        for package in pkgs_to_delete:
+            self._fingerprints[package] = {}
+
+    def plan_restow(self, pkgs_to_restow: List[str]) -> None:
+        """
+        Plan the restow operation.
+
+        :param pkgs_to_restow: The packages to restow.
+        """
+        self._open_manifest()
+        self._fingerprints.update(self._restow.plan_restow(pkgs_to_restow))
+        self._planned.extend(pkgs_to_restow)
+
+    def plan_restow_dirs(self, package: str, dirs: List[str]) -> None:
+        """
+        Plan the restow of some directories of a package.
+
+        :param package: The package.
+        :param dirs: The directories, relative to the package.
+        """
+        self._open_manifest()
+        self._restow.plan_restow_dirs(package, dirs)
 
     def process_tasks(self) -> None:
         """
         Process the tasks.
+
+        Afterwards the links of all planned packages are recorded in the
+        manifest, if there is one, and the packages are tracked along with
+        the fingerprints of the restowed ones.
+        """
+        self._open_manifest()
+        self._tasks.process_tasks(
+            self._jobs,
+            self._dir_fd,
+            self._durable,
+            self._journal,
+            self._link_mode,
+            self._manifest,
+            self._max_rate,
+            self._max_inflight,
+        )
+
+        if self._manifest is not None:
+            self._manifest.track(self._planned)
+
+            for package, prints in self._fingerprints.items():
+                self._manifest.set_fingerprints(
+                    package, prints, self._restow.options_digest(package)
+                )
+
+    def resume_tasks(self) -> None:
         """
-        self._tasks.process_tasks()
+        Continue processing the tasks of an interrupted run from the journal.
+        """
+        if self._journal is None:
+            internal_error("resume_tasks() called without a journal")
+
+        self._open_manifest()
+        self._tasks.resume_tasks(
+            self._journal,
+            self._jobs,
+            self._dir_fd,
+            self._durable,
+            self._manifest,
+            self._max_rate,
+            self._max_inflight,
+        )
+
+    def _open_manifest(self) -> None:
+        """
+        Open the manifest of the stow directory.
+
+        It is only needed if it was requested or files are created instead
+        of symlinks, or if either was the case in an earlier run.
+        """
+        if self._manifest is not None:
+            return
+
+        if (
+            not self._use_manifest
+            and self._link_mode == LinkMode.SYMLINK
+            and not os.path.exists(self._manifest_path)
+        ):
+            return
+
+        log.debug("Using manifest %s", self._manifest_path)
+        self._manifest = Manifest(self._manifest_path, os.getcwd())
+        self._filesystem.set_materialized(self._manifest.links())
+        self._unstow.set_manifest(self._manifest)
+        self._restow.set_manifest(self._manifest)
 
     def get_conflicts(self) -> Dict:
         """
@@ -0,0 +1,152 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict
+
+log = logging.getLogger(__name__)
+
+MAX_OPEN_DIRS = 64
+
+_DIR_FLAGS = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_CLOEXEC", 0)
+
+
+def dir_fd_supported() -> bool:
+    """
+    Determine if the ``dir_fd`` variants of the syscalls used by tasks exist.
+
+    :returns: True if they are supported, False otherwise.
+    """
+    functions = (os.open, os.mkdir, os.rmdir, os.unlink, os.symlink, os.rename)
+
+    return hasattr(os, "O_DIRECTORY") and all(
+        f in os.supports_dir_fd for f in functions
+    )
+
+
+class DirFdPool:
+    """
+    A bounded pool of open directory descriptors.
+
+    All directories are opened relative to the working directory at the time
+    the pool is created, so later changes of the working directory do not
+    affect where tasks end up. At most ``max_open`` descriptors besides the
+    root are kept open; the least recently used unused ones are closed first.
+
+    :param max_open: The maximum number of cached descriptors.
+    """
+
+    def __init__(self, max_open: int = MAX_OPEN_DIRS) -> None:
+        self._max_open = max_open
+        self._lock = threading.Lock()
+        self._root = os.open(".", _DIR_FLAGS)
+        self._fds: "OrderedDict[str, int]" = OrderedDict()
+        self._users: Dict[str, int] = {}
+        self._stale: Dict[int, int] = {}  # invalidated but still in use
+
+    def __enter__(self) -> "DirFdPool":
+        return self
+
+    def __exit__(self, type, value, tb) -> None:
+        self.close()
+
+    def acquire(self, path: str) -> int:
+        """
+        Get a descriptor for a directory; must be paired with :meth:`release`.
+
+        :param path: The directory, relative to the root of the pool.
+
+        :returns: The descriptor.
+        """
+        if path in ("", "."):
+            return self._root
+
+        with self._lock:
+            fd = self._fds.get(path)
+
+            if fd is None:
+                fd = os.open(path, _DIR_FLAGS, dir_fd=self._root)
+                self._fds[path] = fd
+                self._evict()
+            else:
+                self._fds.move_to_end(path)
+
+            self._users[path] = self._users.get(path, 0) + 1
+            return fd
+
+    def release(self, path: str, fd: int) -> None:
+        """
+        Return a descriptor obtained from :meth:`acquire`.
+
+        :param path: The directory passed to :meth:`acquire`.
+        :param fd: The descriptor returned by :meth:`acquire`.
+        """
+        if fd == self._root:
+            return
+
+        with self._lock:
+            if fd in self._stale:
+                self._stale[fd] -= 1
+
+                if self._stale[fd] == 0:
+                    del self._stale[fd]
+                    os.close(fd)
+                return
+
+            self._users[path] -= 1
+
+            if self._users[path] == 0:
+                del self._users[path]
+
+            self._evict()
+
+    def invalidate(self, path: str) -> None:
+        """
+        Forget the descriptors of a path and everything below it.
+
+        Must be called whenever the node at path has been created, removed or
+        replaced, as a cached descriptor would still refer to the old node.
+
+        :param path: The path that changed.
+        """
+        prefix = path + "/"
+
+        with self._lock:
+            for cached in [p for p in self._fds if p == path or p.startswith(prefix)]:
+                fd = self._fds.pop(cached)
+                users = self._users.pop(cached, 0)
+
+                if users > 0:
+                    self._stale[fd] = users
+                else:
+                    os.close(fd)
+
+    def close(self) -> None:
+        """
+        Close all descriptors.
+        """
+        with self._lock:
+            for fd in self._fds.values():
+                os.close(fd)
+
+            for fd in self._stale:
+                os.close(fd)
+
+            self._fds.clear()
+            self._users.clear()
+            self._stale.clear()
+
+            if self._root >= 0:
+                os.close(self._root)
+                self._root = -1
+
+    def _evict(self) -> None:
+        if len(self._fds) <= self._max_open:
+            return
+
+        for path in list(self._fds):
+            if len(self._fds) <= self._max_open:
+                break
+
+            if self._users.get(path, 0) == 0:
+                os.close(self._fds.pop(path))
@@ -1,9 +1,14 @@
 import os
 import re
+import stat
 import logging
-from typing import List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 
+from .matcher import Matcher
+from .materialize import LinkMode
+from .task import Action
 from .tasks import Tasks
+from .paths import child, parts
 from .utils import join
 
 log = logging.getLogger(__name__)
@@ -22,8 +27,221 @@ class Filesystem:
 
         self._stow_path = stow_path
         self._no_folding = no_folding
-        self._defer = defer if defer is not None else []
-        self._override = override if override is not None else []
+        self._defer = Matcher(defer if defer is not None else [])
+        self._override = Matcher(override if override is not None else [])
+
+        self._lmode_cache: Dict[str, Optional[int]] = {}
+        self._mode_cache: Dict[str, Optional[int]] = {}
+        self._readlink_cache: Dict[str, str] = {}
+        self._marked_cache: Dict[str, bool] = {}
+        self._stowed_path_cache: Dict[Tuple[str, str], Tuple[str, str, str]] = {}
+        self._materialized: Dict[str, Tuple[str, LinkMode]] = {}
+
+    def set_materialized(self, links: Dict[str, Tuple[str, LinkMode]]) -> None:
+        """
+        Set the files stowng created instead of symlinks.
+
+        These files are treated as symlinks with the recorded text, so they
+        are owned by their package like a symlink would be.
+
+        :param links: The source of every file and how it was created, by
+            path.
+        """
+        self._materialized = links
+
+    def clear_cache(self) -> None:
+        """
+        Forget all cached stat and readlink results.
+
+        Must be called whenever the filesystem has been modified, e.g. after
+        the planned tasks have been processed.
+        """
+        self._lmode_cache.clear()
+        self._mode_cache.clear()
+        self._readlink_cache.clear()
+        self._marked_cache.clear()
+        self._stowed_path_cache.clear()
+
+    def _lmode(self, path: str) -> Optional[int]:
+        """
+        Get the file type of a path without following symlinks.
+
+        :param path: The path to check.
+
+        :returns: The ``S_IFMT`` bits of the path, or None if it does not exist.
+        """
+        try:
+            return self._lmode_cache[path]
+        except KeyError:
+            pass
+
+        try:
+            mode = stat.S_IFMT(os.lstat(path).st_mode)
+        except (OSError, ValueError):
+            mode = None
+
+        self._lmode_cache[path] = mode
+        return mode
+
+    def _mode(self, path: str) -> Optional[int]:
+        """
+        Get the file type of a path, following symlinks.
+
+        :param path: The path to check.
+
+        :returns: The ``S_IFMT`` bits of the path, or None if it does not exist.
+        """
+        lmode = self._lmode(path)
+
+        if lmode != stat.S_IFLNK:
+            return lmode
+
+        try:
+            return self._mode_cache[path]
+        except KeyError:
+            pass
+
+        try:
+            mode = stat.S_IFMT(os.stat(path).st_mode)
+        except (OSError, ValueError):
+            mode = None
+
+        self._mode_cache[path] = mode
+        return mode
+
+    def _prime(self, path: str, entry: os.DirEntry) -> None:
+        """
+        Seed the lstat cache from the type information of a directory entry.
+
+        On most filesystems the type is part of the directory listing itself,
+        so this does not cost an additional syscall.
+
+        :param path: The path of the entry.
+        :param entry: The entry as returned by :func:`os.scandir`.
+        """
+        try:
+            if entry.is_symlink():
+                mode = stat.S_IFLNK
+            elif entry.is_dir(follow_symlinks=False):
+                mode = stat.S_IFDIR
+            elif entry.is_file(follow_symlinks=False):
+                mode = stat.S_IFREG
+            else:
+                return
+        except OSError:
+            return
+
+        self._lmode_cache.setdefault(path, mode)
+
+    def scandir(self, path: str) -> Iterator[str]:
+        """
+        Iterate over the names in a directory.
+
+        The entries are streamed from :func:`os.scandir` and their types are
+        remembered, so that subsequent checks on the children are free.
+
+        :param path: The directory to list.
+
+        :returns: An iterator over the names of the entries.
+        """
+        with os.scandir(path) as entries:
+            for entry in entries:
+                self._prime(child(path, entry.name), entry)
+                yield entry.name
+
+    def exists(self, path: str) -> bool:
+        """
+        Cached equivalent of :func:`os.path.exists`.
+
+        :param path: The path to check.
+
+        :returns: True if the path exists, False otherwise.
+        """
+        return self._mode(path) is not None
+
+    def isdir(self, path: str) -> bool:
+        """
+        Cached equivalent of :func:`os.path.isdir`.
+
+        :param path: The path to check.
+
+        :returns: True if the path is a directory, False otherwise.
+        """
+        return self._mode(path) == stat.S_IFDIR
+
+    def islink(self, path: str) -> bool:
+        """
+        Cached equivalent of :func:`os.path.islink`.
+
+        Files created instead of symlinks count as symlinks.
+
+        :param path: The path to check.
+
+        :returns: True if the path is a symlink, False otherwise.
+        """
+        mode = self._lmode(path)
+
+        if mode == stat.S_IFREG:
+            return path in self._materialized
+
+        return mode == stat.S_IFLNK
+
+    def readlink(self, path: str) -> str:
+        """
+        Cached equivalent of :func:`os.readlink`.
+
+        For files created instead of symlinks, the recorded text is returned.
+
+        :param path: The link to read.
+
+        :returns: The target of the link.
+
+        :raises OSError: If the path is not a link.
+        """
+        try:
+            return self._readlink_cache[path]
+        except KeyError:
+            pass
+
+        if path in self._materialized and self._lmode(path) == stat.S_IFREG:
+            return self._materialized[path][0]
+
+        target = os.readlink(path)
+        self._readlink_cache[path] = target
+        return target
+
+    def stale(self, path: str) -> bool:
+        """
+        Determine if a file created instead of a symlink no longer matches
+        the package file, e.g. because that was edited since.
+
+        A hard link has to be the package file itself. Copies and clones
+        keep the size and modification time of the package file, so they
+        have to match.
+
+        :param path: The path to check.
+
+        :returns: True if the file has to be created again, False if it is
+            up to date or not such a file.
+        """
+        if path not in self._materialized or self._lmode(path) != stat.S_IFREG:
+            return False
+
+        source, mode = self._materialized[path]
+
+        try:
+            node = os.stat(path)
+            package = os.stat(join(os.path.dirname(path), source))
+        except OSError:
+            return True
+
+        if mode == LinkMode.HARDLINK:
+            return not os.path.samestat(node, package)
+
+        return (node.st_size, node.st_mtime_ns) != (
+            package.st_size,
+            package.st_mtime_ns,
+        )
 
     def is_a_node(self, path: str) -> bool:
         """
@@ -33,41 +251,41 @@ class Filesystem:
 
         :returns: True if the path is a node, False otherwise.
         """
-        log.debug(f"  is_a_node({path})")
+        log.debug("  is_a_node(%s)", path)
 
         laction = self._tasks.link_task_action(path)
         daction = self._tasks.dir_task_action(path)
 
-        if laction == "remove":
-            if daction == "remove":
+        if laction == Action.REMOVE:
+            if daction == Action.REMOVE:
                 log.error(f"removing link and dir: {path}")
                 return False
-            elif daction == "create":
+            elif daction == Action.CREATE:
                 return True
             else:
                 return False
-        elif laction == "create":
-            if daction == "remove":
+        elif laction == Action.CREATE:
+            if daction == Action.REMOVE:
                 return True
-            elif daction == "create":
+            elif daction == Action.CREATE:
                 log.error(f"creating link and dir: {path}")
                 return True  # TODO: sus?
             else:
                 return True
         else:
-            if daction == "remove":
+            if daction == Action.REMOVE:
                 return False
-            elif daction == "create":
+            elif daction == Action.CREATE:
                 return True
 
         if self._tasks.parent_link_scheduled_for_removal(path):
             return False
 
-        if os.path.exists(path):
-            log.debug(f"  is_a_node({path}): really exists")
+        if self.exists(path):
+            log.debug("  is_a_node(%s): really exists", path)
             return True
 
-        log.debug(f"  is_a_node({path}): returning false")
+        log.debug("  is_a_node(%s): returning false", path)
         return False
 
     def is_a_link(self, path: str) -> bool:
@@ -78,23 +296,23 @@ class Filesystem:
 
         :returns: True if the path is a link, False otherwise.
         """
-        log.debug(f"  is_a_link({path})")
+        log.debug("  is_a_link(%s)", path)
 
         action = self._tasks.link_task_action(path)
 
         if action is not None:
-            if action == "create":
-                log.debug(f"  is_a_link({path}): returning 1 (create action found)")
+            if action == Action.CREATE:
+                log.debug("  is_a_link(%s): returning 1 (create action found)", path)
                 return True
-            elif action == "remove":
-                log.debug(f"  is_a_link({path}): returning 0 (remove action found)")
+            elif action == Action.REMOVE:
+                log.debug("  is_a_link(%s): returning 0 (remove action found)", path)
                 return False
 
-        if os.path.islink(path):
-            log.debug(f"  is_a_link({path}): is a real link")
+        if self.islink(path):
+            log.debug("  is_a_link(%s): is a real link", path)
             return not self._tasks.parent_link_scheduled_for_removal(path)
 
-        log.debug(f"  is_a_link({path}): returning 0")
+        log.debug("  is_a_link(%s): returning 0", path)
         return False
 
     def is_a_dir(self, path: str) -> bool:
@@ -105,24 +323,24 @@ class Filesystem:
 
         :returns: True if the path is a directory, False otherwise.
         """
-        log.debug(f"  is_a_dir({path})")
+        log.debug("  is_a_dir(%s)", path)
 
         action = self._tasks.dir_task_action(path)
 
         if action is not None:
-            if action == "create":
+            if action == Action.CREATE:
                 return True
-            elif action == "remove":
+            elif action == Action.REMOVE:
                 return False
 
         if self._tasks.parent_link_scheduled_for_removal(path):
             return False
 
-        if os.path.isdir(path):
-            log.debug(f"  is_a_dir({path}): real dir")
+        if self.isdir(path):
+            log.debug("  is_a_dir(%s): real dir", path)
             return True
 
-        log.debug(f"  is_a_dir({path}): returning false")
+        log.debug("  is_a_dir(%s): returning false", path)
         return False
 
     def foldable(self, target: str) -> Optional[str]:
@@ -133,7 +351,7 @@ class Filesystem:
 
         :returns: The parent if the target is foldable, None otherwise.
         """
-        log.debug(f"--- Is {target} foldable?")
+        log.debug("--- Is %s foldable?", target)
 
         if self._no_folding:
             log.debug("--- no because --no-folding enabled")
@@ -143,13 +361,13 @@ class Filesystem:
 
         parent = ""
 
-        for node in os.listdir(target):
-            path = join(target, node)
+        for node in self.scandir(target):
+            path = child(target, node)
 
-            if self.is_a_node(path):
+            if not self.is_a_node(path):
                 continue
 
-            if self.is_a_link(path):
+            if not self.is_a_link(path):
                 return None
 
             source = self._tasks.read_a_link(path)
@@ -165,10 +383,10 @@ class Filesystem:
         if parent == "":
             return None
 
-        parent = re.sub("^\\.\\.", "", parent)
+        parent = re.sub("^\\.\\./", "", parent)
 
         if self.path_owned_by_package(target, parent):
-            log.debug(f"--- {target} is foldable")
+            log.debug("--- %s is foldable", target)
             return parent
 
         return None
@@ -180,17 +398,17 @@ class Filesystem:
         :param target: The target to fold.
         :param source: The source to fold.
         """
-        log.debug(
-            "--- Folding tree:riables that are created outside of a function (as in"
-            f" all of the examples above) are known as global vari {target} => {source}"
-        )
+        log.debug("--- Folding tree: %s => %s", target, source)
 
         # TODO: check if target is readable
 
-        for node in os.listdir(target):
-            if not self.is_a_node(join(target, node)):
+        for node in self.scandir(target):
+            path = child(target, node)
+
+            if not self.is_a_node(path):
                 continue
-            self._tasks.do_unlink(join(target, node))
+
+            self._tasks.do_unlink(path)
 
         self._tasks.do_rmdir(target)
         self._tasks.do_link(source, target)
@@ -213,19 +431,45 @@ class Filesystem:
         return True
 
     def find_stowed_path(self, target: str, source: str) -> Tuple[str, str, str]:
-        path = join(os.path.dirname(target), source)
-        log.debug(f"  is path {path} owned by stow?")
+        """
+        Determine if a link target points into a stow package.
+
+        The result only depends on the directory of the link and on the link
+        text, and is memoized on those.
+
+        :param target: The path of the link.
+        :param source: The text of the link.
+
+        :returns: The path the link points to, the stow directory and the
+            package, or three empty strings if the link is not owned by stow.
+        """
+        key = (os.path.dirname(target), source)
+
+        try:
+            return self._stowed_path_cache[key]
+        except KeyError:
+            pass
+
+        result = self._find_stowed_path(*key)
+        self._stowed_path_cache[key] = result
+        return result
+
+    def _find_stowed_path(self, link_dir: str, source: str) -> Tuple[str, str, str]:
+        path = join(link_dir, source)
+        log.debug("  is path %s owned by stow?", path)
 
         dir = ""
-        split_path = path.split("/")
+        split_path = parts(path)
+
+        for i, part in enumerate(split_path):
+            dir = part if i == 0 else f"{dir}/{part}"
 
-        for i in range(len(split_path)):
-            if self._marked_stow_dir(dir):
+            if dir != "" and self._marked_stow_dir(dir):
                 if i == len(split_path) - 1:
                     log.error("find_stowd_path() called directly on stow dir")
                     raise Exception("find_stowd_path() called directly on stow dir")
 
-                log.debug(f"    yes - {dir} was marked as a stow dir")
+                log.debug("    yes - %s was marked as a stow dir", dir)
                 package = split_path[i + 1]
                 return path, dir, package
 
@@ -235,7 +479,7 @@ class Filesystem:
                 f" {self._stow_path} and path {path}"
             )
 
-        split_stow_path = self._stow_path.split("/")
+        split_stow_path = parts(self._stow_path)
         ipath = 0
         istow = 0
 
@@ -245,26 +489,38 @@ class Filesystem:
                 istow += 1
             else:
                 log.debug(
-                    f"    no - either {path} not under {self._stow_path} or vice-versa"
+                    "    no - either %s not under %s or vice-versa",
+                    path,
+                    self._stow_path,
                 )
                 return "", "", ""
 
         if istow < len(split_stow_path):
-            log.debug(f"    no - {path} is not under {self._stow_path}")
+            log.debug("    no - %s is not under %s", path, self._stow_path)
             return "", "", ""
 
         package = split_path[ipath]
         ipath += 1
 
-        log.debug(f"    yes - by {package} in {'/'.join(split_path[ipath:])}")
+        log.debug("    yes - by %s in %s", package, "/".join(split_path[ipath:]))
         return path, self._stow_path, package
 
     def _marked_stow_dir(self, target: str) -> bool:
+        try:
+            return self._marked_cache[target]
+        except KeyError:
+            pass
+
+        marked = False
+
         for f in [".stow", ".nonstow"]:
-            if os.path.isfile(join(target, f)):
-                log.debug(f"{target} contained {f}")
-                return True
-        return False
+            if os.path.isfile(child(target, f)):
+                log.debug("%s contained %s", target, f)
+                marked = True
+                break
+
+        self._marked_cache[target] = marked
+        return marked
 
     def should_skip_target_which_is_stow_dir(self, target: str) -> bool:
         """
@@ -284,7 +540,7 @@ class Filesystem:
             log.warn(f"WARNING: skipping protected directory {target}")
             return True
 
-        log.debug(f"{target} not protected")
+        log.debug("%s not protected", target)
         return False
 
     def defer(self, path: str) -> bool:
@@ -295,10 +551,7 @@ class Filesystem:
 
         :returns: True if the path should be deferred, False otherwise.
         """
-        for prefix in self._defer:
-            if prefix.match(path):
-                return True
-        return False
+        return self._defer.match(path)
 
     def override(self, path: str) -> bool:
         """
@@ -308,7 +561,4 @@ class Filesystem:
 
         :returns: True if the path should be overridden, False otherwise.
         """
-        for prefix in self._override:
-            if prefix.match(path):
-                return True
-        return False
+        return self._override.match(path)
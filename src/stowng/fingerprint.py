@@ -0,0 +1,223 @@
+import os
+import hashlib
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from .paths import child
+
+log = logging.getLogger(__name__)
+
+
+class DirPrint(NamedTuple):
+    """
+    The fingerprint of a package directory.
+
+    ``mtime``, ``inode`` and ``entries`` describe the directory itself; any
+    entry added, removed or renamed in it changes at least one of them.
+    ``digest`` rolls them up with the digests of all subdirectories, so it
+    changes whenever anything in the subtree does.
+    """
+
+    mtime: int
+    inode: int
+    entries: int
+    digest: str
+
+    def same_dir(self, other: "DirPrint") -> bool:
+        """
+        Determine if the directory itself is unchanged, ignoring its
+        subdirectories.
+
+        :param other: The other fingerprint.
+
+        :returns: True if the entries of the directory are unchanged.
+        """
+        return (self.mtime, self.inode, self.entries) == (
+            other.mtime,
+            other.inode,
+            other.entries,
+        )
+
+
+def _parent(path: str) -> str:
+    return os.path.dirname(path) or "."
+
+
+def join_root(root: str, path: str) -> str:
+    """
+    Get the path of a package directory.
+
+    :param root: The path of the package.
+    :param path: The directory, relative to the package.
+
+    :returns: The path.
+
+    :Example:
+    >>> join_root("../stow/pkg", ".")
+    '../stow/pkg'
+    >>> join_root("../stow/pkg", "a/b")
+    '../stow/pkg/a/b'
+    """
+    return root if path == "." else root + "/" + path
+
+
+def fingerprint_tree(
+    root: str, known: Optional[Dict[str, DirPrint]] = None
+) -> Dict[str, DirPrint]:
+    """
+    Fingerprint every directory of a package tree.
+
+    A directory whose mtime and inode match its known fingerprint has the
+    same entries as back then, so it is not listed again; its known entry
+    count and subdirectories are reused. An unchanged tree therefore costs
+    one ``stat()`` per directory.
+
+    :param root: The path of the package.
+    :param known: The fingerprints of an earlier run, by path relative to
+        the package.
+
+    :returns: The fingerprints, by path relative to the package (``.`` for
+        the package itself).
+    """
+    known = known or {}
+    subdirs_of: Dict[str, List[str]] = {}
+
+    for path in known:
+        if path != ".":
+            subdirs_of.setdefault(_parent(path), []).append(os.path.basename(path))
+
+    prints: Dict[str, DirPrint] = {}
+    stats: Dict[str, os.stat_result] = {}
+    entries: Dict[str, int] = {}
+    subdirs: Dict[str, List[str]] = {}
+
+    stack = ["."]
+    order = []
+
+    while stack:
+        path = stack.pop()
+        order.append(path)
+
+        full = join_root(root, path)
+        stat = os.stat(full) if path == "." else os.lstat(full)
+        stats[path] = stat
+
+        old = known.get(path)
+
+        if old is not None and (old.mtime, old.inode) == (
+            stat.st_mtime_ns,
+            stat.st_ino,
+        ):
+            entries[path] = old.entries
+            subdirs[path] = sorted(subdirs_of.get(path, []))
+        else:
+            names = []
+            count = 0
+
+            with os.scandir(full) as it:
+                for entry in it:
+                    count += 1
+
+                    if entry.is_dir(follow_symlinks=False):
+                        names.append(entry.name)
+
+            entries[path] = count
+            subdirs[path] = sorted(names)
+
+        stack.extend(child(path, name) for name in subdirs[path])
+
+    # children before their parents
+    for path in reversed(order):
+        stat = stats[path]
+        digest = hashlib.sha1(
+            f"{stat.st_mtime_ns}:{stat.st_ino}:{entries[path]}".encode()
+        )
+
+        for name in subdirs[path]:
+            digest.update(f"/{name}:{prints[child(path, name)].digest}".encode())
+
+        prints[path] = DirPrint(
+            stat.st_mtime_ns, stat.st_ino, entries[path], digest.hexdigest()
+        )
+
+    return prints
+
+
+def options_digest(options: Iterable[str], files: Iterable[str]) -> str:
+    """
+    Digest the options a package was planned with.
+
+    Fingerprints only describe the package tree, but the links planned for
+    it also depend on the options and on the ignore files, which may be
+    edited in place.
+
+    :param options: The options, each as a string.
+    :param files: The ignore files; missing ones are digested as such.
+
+    :returns: The digest.
+    """
+    digest = hashlib.sha1()
+
+    for option in options:
+        digest.update(f"{option}\n".encode())
+
+    for file in files:
+        try:
+            with open(file, "rb") as f:
+                content = hashlib.sha1(f.read()).hexdigest()
+        except OSError:
+            content = "-"
+
+        digest.update(f"{file}:{content}\n".encode())
+
+    return digest.hexdigest()
+
+
+def changed_dirs(old: Dict[str, DirPrint], new: Dict[str, DirPrint]) -> List[str]:
+    """
+    Find the topmost directories whose entries changed between two
+    fingerprints of a package tree.
+
+    Subtrees with an unchanged digest are skipped as a whole. Directories
+    that were added or removed change the entries of their parent, so the
+    parent is reported instead.
+
+    :param old: The earlier fingerprints.
+    :param new: The current fingerprints.
+
+    :returns: The changed directories, relative to the package.
+
+    :Example:
+    >>> old = {".": DirPrint(1, 1, 1, "r"), "a": DirPrint(1, 2, 1, "a"),
+    ...        "a/b": DirPrint(1, 3, 0, "b"), "c": DirPrint(1, 4, 0, "c")}
+    >>> new = {".": DirPrint(1, 1, 1, "R"), "a": DirPrint(1, 2, 1, "A"),
+    ...        "a/b": DirPrint(2, 3, 1, "B"), "c": DirPrint(1, 4, 0, "c")}
+    >>> changed_dirs(old, new)
+    ['a/b']
+    >>> changed_dirs(old, old)
+    []
+    """
+    subdirs_of: Dict[str, List[str]] = {}
+
+    for path in new:
+        if path != ".":
+            subdirs_of.setdefault(_parent(path), []).append(path)
+
+    changed = []
+    stack = ["."]
+
+    while stack:
+        path = stack.pop()
+        before = old.get(path)
+        after = new[path]
+
+        if before is not None and before.digest == after.digest:
+            continue
+
+        if before is None or not before.same_dir(after):
+            changed.append(path)
+            continue
+
+        stack.extend(subdirs_of.get(path, []))
+
+    return sorted(changed)
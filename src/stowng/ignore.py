@@ -1,19 +1,77 @@
 import os
 import re
 import logging
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 from importlib.resources import files
 
+from .matcher import Matcher
 from .utils import join
 from . import LOCAL_IGNORE_FILE, GLOBAL_IGNORE_FILE
 
 log = logging.getLogger(__name__)
 
 
+class PackageIgnore:
+    """
+    The resolved ignore rules of a single package.
+
+    Instances are created once per package by :meth:`Ignore.for_package` and
+    handed down the planner traversal, so checking a node does not touch the
+    filesystem.
+
+    :param path_matcher: Matches the whole target path (``--ignore`` and the
+        path entries of the ignore list).
+    :param segment_matcher: Matches the basename of the target.
+    """
+
+    def __init__(self, path_matcher: Matcher, segment_matcher: Matcher) -> None:
+        self._path_matcher = path_matcher
+        self._segment_matcher = segment_matcher
+
+    def scope(self, directory: str) -> "PackageIgnore":
+        """
+        Restrict the rules to the targets below a directory.
+
+        :param directory: The target directory.
+
+        :returns: Rules equivalent to these ones for targets below directory.
+        """
+        path_matcher = self._path_matcher.scope(directory)
+
+        if path_matcher is self._path_matcher:
+            return self
+
+        return PackageIgnore(path_matcher, self._segment_matcher)
+
+    def ignore(self, target: str) -> bool:
+        """
+        Determine if a target should be ignored.
+
+        :param target: The target to check.
+
+        :returns: True if the target should be ignored, False otherwise.
+        """
+        if len(target) < 1:
+            log.error("::ignore() called with empty target")
+            raise Exception("::ignore() called with empty target")
+
+        if self._path_matcher.match(target):
+            log.debug("  Ignoring path %s", target)
+            return True
+
+        if self._segment_matcher.match(os.path.basename(target)):
+            log.debug("  Ignoring path segment %s", target)
+            return True
+
+        log.debug("  Not ignoring %s", target)
+        return False
+
+
 class Ignore:
     def __init__(self, ignore: Optional[List[re.Pattern]]) -> None:
         self._ignore = ignore if ignore is not None else []
         self.ignore_file_regexps = {}
+        self.package_ignores: Dict[str, PackageIgnore] = {}
         self.default_global_ignore_regexps = self._get_default_global_ignore_regexps()
 
     def ignore(self, stow_path: str, package: str, target: str) -> bool:
@@ -26,33 +84,51 @@ class Ignore:
 
         :returns: True if the target should be ignored, False otherwise.
         """
+        return self.for_package(stow_path, package).ignore(target)
 
-        if len(target) < 1:
-            log.error("::ignore() called with empty target")
-            raise Exception("::ignore() called with empty target")
+    def for_package(self, stow_path: str, package: str) -> PackageIgnore:
+        """
+        Get the ignore rules of a package.
+
+        The ignore files are only looked up the first time a package is seen,
+        later calls return the memoized result.
 
-        for suffix in self._ignore:
-            if suffix.match(target):
-                log.debug(f"  Ignoring path {target} due to --ignore={suffix}")
-                return True
+        :param stow_path: The path to the stow directory.
+        :param package: The name of the package.
 
+        :returns: The ignore rules of the package.
+        """
         package_dir = join(stow_path, package)
+
+        if package_dir in self.package_ignores:
+            return self.package_ignores[package_dir]
+
         path_regexp, segment_regexp = self.get_ignore_regexps(package_dir)
-        log.debug(f"    Ignore list regexp for paths: {path_regexp}")
-        log.debug(f"    Ignore list regexp for segments: {segment_regexp}")
+        log.debug("    Ignore list regexp for paths: %s", path_regexp)
+        log.debug("    Ignore list regexp for segments: %s", segment_regexp)
 
-        if path_regexp is not None and path_regexp.match(target):
-            log.debug(f"  Ignoring path {target}")
-            return True
+        package_ignore = PackageIgnore(
+            Matcher(self._ignore + [path_regexp]), Matcher([segment_regexp])
+        )
+        self.package_ignores[package_dir] = package_ignore
+        return package_ignore
 
-        basename = os.path.basename(target)
+    def files(self, dir: str) -> List[str]:
+        """
+        Get the ignore files that apply to a package, in order of precedence,
+        whether they exist or not.
 
-        if segment_regexp is not None and segment_regexp.match(basename):
-            log.debug(f"  Ignoring path segment {target}")
-            return True
+        :param dir: The directory of the package.
 
-        log.debug(f"  Not ignoring {target}")
-        return False
+        :returns: The paths of the ignore files.
+        """
+        home = os.environ.get("HOME")
+        paths = [join(dir, LOCAL_IGNORE_FILE)]
+
+        if home is not None:
+            paths.append(join(home, GLOBAL_IGNORE_FILE))
+
+        return paths
 
     def get_ignore_regexps(self, dir: str) -> Tuple[re.Pattern, re.Pattern]:
         """
@@ -62,16 +138,12 @@ class Ignore:
 
         :returns: The ignore regexps.
         """
-        home = os.environ.get("HOME")
-        path_regexp = join(dir, LOCAL_IGNORE_FILE)
-        segment_regexp = join(home, GLOBAL_IGNORE_FILE) if home is not None else None
-
-        for file in (path_regexp, segment_regexp):
-            if file is not None and os.path.exists(file):
-                log.debug(f"  Using ignore file: {file}")
+        for file in self.files(dir):
+            if os.path.exists(file):
+                log.debug("  Using ignore file: %s", file)
                 return self.get_ignore_regexps_from_file(file)
             else:
-                log.debug(f"  {file} didn't exist")
+                log.debug("  %s didn't exist", file)
 
         log.debug("  Using built-in ignore list")
         return self.default_global_ignore_regexps
@@ -86,7 +158,7 @@ class Ignore:
         """
 
         if file in self.ignore_file_regexps:
-            log.debug(f"   Using memoized regexps from {file}")
+            log.debug("   Using memoized regexps from %s", file)
             return self.ignore_file_regexps[file]
 
         regexps = self.get_ignore_regexps_from_filename(file)
@@ -135,7 +207,7 @@ class Ignore:
 
     def compile_ignore_regexps(
         self, regexps: List[str]
-    ) -> Tuple[re.Pattern, re.Pattern]:
+    ) -> Tuple[Optional[re.Pattern], Optional[re.Pattern]]:
         """
         Compile ignore regexps.
 
@@ -152,8 +224,11 @@ class Ignore:
             else:
                 segment_regexps.append(regexp)
 
-        path_regexp = re.compile("|".join(path_regexps))
-        segment_regexp = re.compile("|".join(segment_regexps))
+        # an empty alternation would match everything
+        path_regexp = re.compile("|".join(path_regexps)) if path_regexps else None
+        segment_regexp = (
+            re.compile("|".join(segment_regexps)) if segment_regexps else None
+        )
 
         return path_regexp, segment_regexp
 
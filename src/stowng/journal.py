@@ -0,0 +1,176 @@
+import os
+import json
+import logging
+import threading
+from typing import IO, Iterable, List, Optional, Set, Tuple
+
+from .materialize import LinkMode
+from .task import Action, NodeType, Task
+
+log = logging.getLogger(__name__)
+
+JOURNAL_NAME = ".stowng-journal"
+JOURNAL_VERSION = 1
+FLUSH_EVERY = 64
+
+
+def encode_task(task: Task) -> list:
+    """
+    Convert a task into a JSON compatible list.
+
+    :param task: The task.
+
+    :returns: The encoded task.
+
+    :Example:
+    >>> encode_task(Task(Action.CREATE, NodeType.LINK, path="a", source="../s/a"))
+    [1, 2, 'a', '../s/a', '']
+    """
+    return [int(task.action), int(task.type_), task.path, task.source, task.dest]
+
+
+def decode_task(data: list) -> Task:
+    """
+    Convert a list created by :func:`encode_task` back into a task.
+
+    :param data: The encoded task.
+
+    :returns: The task.
+
+    :Example:
+    >>> decode_task([1, 2, 'a', '../s/a', ''])
+    Task(create, link, path='a', source='../s/a', dest='')
+    """
+    action, type_, path, source, dest = data
+    return Task(Action(action), NodeType(type_), path=path, source=source, dest=dest)
+
+
+class Journal:
+    """
+    An append-only record of a plan and of the tasks already processed.
+
+    The first line holds the plan as JSON, every further line the index of
+    a processed task. The header is written to a temporary file and renamed
+    into place, so a journal either has the complete plan or does not exist.
+    Indices are flushed in batches; losing the last few on a crash only
+    means :meth:`stowng.task.Task.is_applied` has to check those tasks again.
+
+    :param path: The path of the journal file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file: Optional[IO[str]] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.link_mode = LinkMode.SYMLINK
+
+    def start(
+        self, tasks: Iterable[Task], link_mode: LinkMode = LinkMode.SYMLINK
+    ) -> None:
+        """
+        Write a new journal for a plan.
+
+        The tasks are written one by one, so the plan does not have to be
+        held in memory as a whole.
+
+        :param tasks: The tasks, in plan order.
+        :param link_mode: How links are created.
+        """
+        self.link_mode = link_mode
+        header = {
+            "version": JOURNAL_VERSION,
+            "target": os.getcwd(),
+            "link_mode": int(link_mode),
+        }
+        temp = self.path + ".tmp"
+
+        with open(temp, "w") as f:
+            f.write(json.dumps(header, separators=(",", ":"))[:-1])
+            f.write(',"tasks":[')
+
+            for index, task in enumerate(tasks):
+                if index > 0:
+                    f.write(",")
+                f.write(json.dumps(encode_task(task), separators=(",", ":")))
+
+            f.write("]}\n")
+
+        os.replace(temp, self.path)
+        self._open()
+
+    def resume(self) -> Tuple[List[Task], Set[int]]:
+        """
+        Read an existing journal and continue appending to it.
+
+        :returns: The planned tasks and the indices of the processed ones.
+
+        :raises Exception: If the journal is missing, damaged or belongs to a
+            different target directory.
+        """
+        try:
+            with open(self.path) as f:
+                header = json.loads(f.readline())
+                lines = f.read().split("\n")
+        except (OSError, ValueError) as e:
+            log.error(f"could not read journal {self.path}: {e}")
+            raise Exception(f"could not read journal {self.path}: {e}")
+
+        if header.get("version") != JOURNAL_VERSION:
+            log.error(f"unsupported journal version: {header.get('version')}")
+            raise Exception(f"unsupported journal version: {header.get('version')}")
+
+        if header["target"] != os.getcwd():
+            log.error(f"journal {self.path} belongs to target {header['target']}")
+            raise Exception(f"journal {self.path} belongs to target {header['target']}")
+
+        tasks = [decode_task(data) for data in header["tasks"]]
+        self.link_mode = LinkMode(header.get("link_mode", LinkMode.SYMLINK))
+
+        # the last line may have been cut off by the interruption; it is
+        # dropped, so the next index is not appended to it
+        done = {int(line) for line in lines[:-1]}
+
+        if lines[-1]:
+            size = os.path.getsize(self.path) - len(lines[-1].encode())
+            os.truncate(self.path, size)
+
+        self._open()
+        return tasks, done
+
+    def record(self, index: int) -> None:
+        """
+        Record a task as processed.
+
+        :param index: The index of the task in the plan.
+        """
+        with self._lock:
+            if self._file is None:
+                return
+
+            self._file.write(f"{index}\n")
+            self._pending += 1
+
+            if self._pending >= FLUSH_EVERY:
+                self._file.flush()
+                self._pending = 0
+
+    def close(self) -> None:
+        """
+        Flush and close the journal, keeping it for a later resume.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def finish(self) -> None:
+        """
+        Close and delete the journal after all tasks were processed.
+        """
+        self.close()
+        os.unlink(self.path)
+
+    def _open(self) -> None:
+        self._file = open(self.path, "a")
+        self._pending = 0
@@ -0,0 +1,305 @@
+import sqlite3
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .fingerprint import DirPrint
+from .materialize import LinkMode
+from .task import Action, NodeType, Task
+
+log = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".stowng-manifest"
+MANIFEST_VERSION = 1
+
+
+class Manifest:
+    """
+    The links and directories stowng created in target directories, and the
+    package owning every link.
+
+    The nodes are recorded in a SQLite database inside the stow directory,
+    keyed by the absolute path of the target directory and the path of the
+    node relative to it. For every link the link text is stored; for files
+    created instead of symlinks (hard links and copies, which look like any
+    other file) it is the text a symlink would have had, which lets the
+    planners treat the file like that symlink.
+
+    A package is *tracked* once all of its links in a target were planned
+    and processed with the manifest open. The recorded links of a tracked
+    package are complete, so it can be unstowed without scanning it. The
+    fingerprints of its directories (see :mod:`stowng.fingerprint`) as of
+    that run are recorded as well, along with a digest of the options it
+    was planned with.
+
+    :param path: The path of the database.
+    :param target: The absolute path of the target directory.
+    """
+
+    def __init__(self, path: str, target: str) -> None:
+        self.path = path
+        self._target = target
+        self._db = sqlite3.connect(path)
+
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS nodes ("
+                " target TEXT NOT NULL,"
+                " path TEXT NOT NULL,"
+                " type INTEGER NOT NULL,"
+                " package TEXT,"
+                " source TEXT NOT NULL,"
+                " mode INTEGER NOT NULL,"
+                " PRIMARY KEY (target, path))"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS nodes_package ON nodes (target, package)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS packages ("
+                " target TEXT NOT NULL,"
+                " package TEXT NOT NULL,"
+                " PRIMARY KEY (target, package))"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                " target TEXT NOT NULL,"
+                " package TEXT NOT NULL,"
+                " path TEXT NOT NULL,"
+                " mtime INTEGER NOT NULL,"
+                " inode INTEGER NOT NULL,"
+                " entries INTEGER NOT NULL,"
+                " digest TEXT NOT NULL,"
+                " PRIMARY KEY (target, package, path))"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS options ("
+                " target TEXT NOT NULL,"
+                " package TEXT NOT NULL,"
+                " digest TEXT NOT NULL,"
+                " PRIMARY KEY (target, package))"
+            )
+            self._migrate()
+
+    def _migrate(self) -> None:
+        (version,) = self._db.execute("PRAGMA user_version").fetchone()
+
+        if version >= MANIFEST_VERSION:
+            return
+
+        (old,) = self._db.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'links'"
+        ).fetchone()
+
+        if old:
+            # manifests of earlier versions only had the materialized files,
+            # without their package
+            log.debug("Migrating manifest %s", self.path)
+            self._db.execute(
+                "INSERT OR IGNORE INTO nodes"
+                " SELECT target, path, ?, NULL, source, mode FROM links",
+                (int(NodeType.LINK),),
+            )
+            self._db.execute("DROP TABLE links")
+
+        self._db.execute(f"PRAGMA user_version = {MANIFEST_VERSION}")
+
+    def links(self) -> Dict[str, Tuple[str, LinkMode]]:
+        """
+        Get the files created instead of symlinks in the target directory.
+
+        :returns: The source of every file and how it was created, by path.
+        """
+        rows = self._db.execute(
+            "SELECT path, source, mode FROM nodes"
+            " WHERE target = ? AND type = ? AND mode != ?",
+            (self._target, int(NodeType.LINK), int(LinkMode.SYMLINK)),
+        )
+        return {path: (source, LinkMode(mode)) for path, source, mode in rows}
+
+    def materialized(self, package: str) -> bool:
+        """
+        Determine if files were created instead of symlinks for a package.
+
+        :param package: The package.
+
+        :returns: True if the package owns such a file, False otherwise.
+        """
+        row = self._db.execute(
+            "SELECT 1 FROM nodes WHERE target = ? AND package = ? AND type = ?"
+            " AND mode != ? LIMIT 1",
+            (self._target, package, int(NodeType.LINK), int(LinkMode.SYMLINK)),
+        ).fetchone()
+        return row is not None
+
+    def tracked(self, package: str) -> bool:
+        """
+        Determine if the links of a package are completely recorded.
+
+        :param package: The package.
+
+        :returns: True if the package is tracked, False otherwise.
+        """
+        row = self._db.execute(
+            "SELECT 1 FROM packages WHERE target = ? AND package = ?",
+            (self._target, package),
+        ).fetchone()
+        return row is not None
+
+    def owned(self, package: str) -> List[Tuple[str, str]]:
+        """
+        Get the links owned by a package.
+
+        :param package: The package.
+
+        :returns: The path and source of every link, sorted by path.
+        """
+        rows = self._db.execute(
+            "SELECT path, source FROM nodes"
+            " WHERE target = ? AND package = ? AND type = ? ORDER BY path",
+            (self._target, package, int(NodeType.LINK)),
+        )
+        return rows.fetchall()
+
+    def update(
+        self,
+        tasks: Iterable[Task],
+        mode: LinkMode,
+        owner: Callable[[str, str], Optional[str]],
+        kept: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """
+        Record the effect of processed tasks.
+
+        :param tasks: The processed tasks.
+        :param mode: How the links of the tasks were created.
+        :param owner: Returns the package owning a link, given its path and
+            source.
+        :param kept: Links found in place while planning, which were left
+            untouched, by path.
+        """
+        state: Dict[str, Optional[Tuple[NodeType, str]]] = {}
+
+        for task in tasks:
+            if task.type_ not in (NodeType.LINK, NodeType.DIR):
+                continue
+
+            if task.action == Action.REMOVE:
+                state[task.path] = None
+            else:
+                state[task.path] = (task.type_, task.source)
+
+        removed = [(self._target, p) for p, s in state.items() if s is None]
+        added = [
+            (
+                self._target,
+                p,
+                int(s[0]),
+                owner(p, s[1]) if s[0] == NodeType.LINK else None,
+                s[1],
+                int(mode) if s[0] == NodeType.LINK else int(LinkMode.SYMLINK),
+            )
+            for p, s in state.items()
+            if s is not None
+        ]
+        found = [
+            (self._target, p, int(NodeType.LINK), owner(p, s), s, int(LinkMode.SYMLINK))
+            for p, s in (kept or {}).items()
+            if p not in state
+        ]
+
+        log.debug(
+            "Manifest: %d nodes added, %d removed, %d kept",
+            len(added),
+            len(removed),
+            len(found),
+        )
+
+        with self._db:
+            self._db.executemany(
+                "DELETE FROM nodes WHERE target = ? AND path = ?", removed
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?, ?)", added
+            )
+            # kept files may have been materialized, so only their package
+            # is updated if they are already recorded
+            self._db.executemany(
+                "UPDATE nodes SET package = ? WHERE target = ? AND path = ?",
+                [(package, target, p) for target, p, _, package, _, _ in found],
+            )
+            self._db.executemany(
+                "INSERT OR IGNORE INTO nodes VALUES (?, ?, ?, ?, ?, ?)", found
+            )
+
+    def track(self, packages: Iterable[str]) -> None:
+        """
+        Mark packages as completely recorded.
+
+        :param packages: The packages.
+        """
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO packages VALUES (?, ?)",
+                [(self._target, package) for package in packages],
+            )
+
+    def fingerprints(self, package: str) -> Dict[str, DirPrint]:
+        """
+        Get the recorded fingerprints of the directories of a package.
+
+        :param package: The package.
+
+        :returns: The fingerprints, by path relative to the package.
+        """
+        rows = self._db.execute(
+            "SELECT path, mtime, inode, entries, digest FROM fingerprints"
+            " WHERE target = ? AND package = ?",
+            (self._target, package),
+        )
+        return {row[0]: DirPrint(*row[1:]) for row in rows}
+
+    def options(self, package: str) -> Optional[str]:
+        """
+        Get the digest of the options the fingerprints of a package were
+        recorded with.
+
+        :param package: The package.
+
+        :returns: The digest, or None if there is none.
+        """
+        row = self._db.execute(
+            "SELECT digest FROM options WHERE target = ? AND package = ?",
+            (self._target, package),
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def set_fingerprints(
+        self, package: str, prints: Dict[str, DirPrint], options: str
+    ) -> None:
+        """
+        Replace the recorded fingerprints of the directories of a package.
+
+        :param package: The package.
+        :param prints: The fingerprints, by path relative to the package.
+        :param options: The digest of the options the package was planned
+            with (see :func:`stowng.fingerprint.options_digest`).
+        """
+        with self._db:
+            self._db.execute(
+                "DELETE FROM fingerprints WHERE target = ? AND package = ?",
+                (self._target, package),
+            )
+            self._db.executemany(
+                "INSERT INTO fingerprints VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(self._target, package, path, *p) for path, p in prints.items()],
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO options VALUES (?, ?, ?)",
+                (self._target, package, options),
+            )
+
+    def close(self) -> None:
+        """
+        Close the database.
+        """
+        self._db.close()
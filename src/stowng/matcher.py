@@ -0,0 +1,189 @@
+import re
+import logging
+from typing import Dict, Iterable, List, Optional
+
+log = logging.getLogger(__name__)
+
+_META = set(".^$*+?{}[]\\|()")
+_BACKREF = re.compile(r"\\[1-9]|\(\?P=")
+
+
+def literal_prefix(pattern: re.Pattern) -> str:
+    """
+    Get the literal text every match of a pattern has to start with.
+
+    The result is conservative: it may be shorter than the real prefix, but
+    every string matched by ``pattern.match()`` starts with it.
+
+    :param pattern: The pattern to inspect.
+
+    :returns: The literal prefix, possibly empty.
+
+    :Example:
+    >>> literal_prefix(re.compile('bin/foo'))
+    'bin/foo'
+    >>> literal_prefix(re.compile('^lib/.*\\\\.so'))
+    'lib/'
+    >>> literal_prefix(re.compile('share/man?'))
+    'share/ma'
+    >>> literal_prefix(re.compile('etc\\\\.d/x+'))
+    'etc.d/x'
+    >>> literal_prefix(re.compile('a|b'))
+    ''
+    >>> literal_prefix(re.compile('bin', re.IGNORECASE))
+    ''
+    """
+    if pattern.flags & (re.IGNORECASE | re.VERBOSE):
+        return ""
+
+    source = pattern.pattern
+
+    if "|" in source:
+        return ""
+
+    prefix = []
+    i = 1 if source.startswith("^") else 0
+
+    while i < len(source):
+        c = source[i]
+
+        if c == "\\":
+            if i + 1 < len(source) and not source[i + 1].isalnum():
+                literal, step = source[i + 1], 2
+            else:
+                break
+        elif c in _META:
+            break
+        else:
+            literal, step = c, 1
+
+        following = source[i + step : i + step + 1]
+
+        if following in ("*", "?", "{"):
+            break
+
+        prefix.append(literal)
+
+        if following == "+":
+            break
+
+        i += step
+
+    return "".join(prefix)
+
+
+class Matcher:
+    """
+    A set of regexps that is matched like one.
+
+    The patterns are compiled into a single alternation where possible, the
+    result for each string is memoized and :meth:`scope` narrows the set down
+    to the patterns that can match anything below a given directory.
+
+    :param patterns: The patterns, matched with :meth:`re.Pattern.match`.
+
+    :Example:
+    >>> m = Matcher([re.compile('bin/'), re.compile('lib/.*\\\\.a')])
+    >>> m.match('bin/ls'), m.match('lib/libc.a'), m.match('share/x')
+    (True, True, False)
+    >>> m.scope('share').match('share/bin/ls')
+    False
+    >>> m.scope('lib').match('lib/libm.a')
+    True
+    >>> Matcher([]).match('anything')
+    False
+    """
+
+    def __init__(self, patterns: Iterable[Optional[re.Pattern]]) -> None:
+        self._patterns: List[re.Pattern] = [p for p in patterns if p is not None]
+        self._regexp = self._combine(self._patterns)
+        self._prefixes = [literal_prefix(p) for p in self._patterns]
+        self._results: Dict[str, bool] = {}
+        self._scopes: Dict[str, Matcher] = {}
+
+    @staticmethod
+    def _combine(patterns: List[re.Pattern]) -> Optional[re.Pattern]:
+        """
+        Compile the patterns into a single alternation.
+
+        :param patterns: The patterns to combine.
+
+        :returns: The combined pattern, or None if they cannot be combined.
+        """
+        if len(patterns) == 1:
+            return patterns[0]
+
+        if len(patterns) == 0 or len({p.flags for p in patterns}) != 1:
+            return None
+
+        if any(_BACKREF.search(p.pattern) for p in patterns):
+            return None
+
+        try:
+            return re.compile(
+                "|".join(f"(?:{p.pattern})" for p in patterns), patterns[0].flags
+            )
+        except re.error:
+            return None
+
+    def __bool__(self) -> bool:
+        return len(self._patterns) > 0
+
+    def match(self, string: str) -> bool:
+        """
+        Determine if any of the patterns matches the start of a string.
+
+        :param string: The string to check.
+
+        :returns: True if one of the patterns matches, False otherwise.
+        """
+        if not self._patterns:
+            return False
+
+        try:
+            return self._results[string]
+        except KeyError:
+            pass
+
+        if self._regexp is not None:
+            result = self._regexp.match(string) is not None
+        else:
+            result = any(p.match(string) for p in self._patterns)
+
+        self._results[string] = result
+        return result
+
+    def scope(self, directory: str) -> "Matcher":
+        """
+        Restrict the matcher to the paths below a directory.
+
+        Patterns whose literal prefix rules out every path below the
+        directory are dropped, so whole subtrees can be checked without
+        running any regexp.
+
+        :param directory: The directory, relative like the matched paths.
+
+        :returns: A matcher equivalent to this one for paths below directory.
+        """
+        if not self._patterns or directory in ("", "."):
+            return self
+
+        try:
+            return self._scopes[directory]
+        except KeyError:
+            pass
+
+        dir_prefix = directory + "/"
+        patterns = [
+            pattern
+            for pattern, prefix in zip(self._patterns, self._prefixes)
+            if prefix.startswith(dir_prefix) or dir_prefix.startswith(prefix)
+        ]
+
+        if len(patterns) == len(self._patterns):
+            scoped = self
+        else:
+            scoped = Matcher(patterns)
+
+        self._scopes[directory] = scoped
+        return scoped
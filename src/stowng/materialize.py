@@ -0,0 +1,83 @@
+import os
+import errno
+import fcntl
+import shutil
+import logging
+from enum import IntEnum
+
+from .adopt import copy_file
+
+log = logging.getLogger(__name__)
+
+FICLONE = 0x40049409
+
+_NO_REFLINK = {errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.ENOSYS}
+
+
+class LinkMode(IntEnum):
+    """
+    How a package file is made available in the target.
+    """
+
+    SYMLINK = 1
+    HARDLINK = 2
+    REFLINK = 3
+    COPY = 4
+
+    def __str__(self) -> str:
+        return self.name.lower()
+
+
+def reflink(source: str, dest: str) -> None:
+    """
+    Create a copy-on-write clone of a file.
+
+    :param source: The file to clone.
+    :param dest: The path of the clone, which must not exist.
+
+    :raises OSError: If the filesystem cannot clone the file.
+    """
+    with open(source, "rb") as fsrc:
+        fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+
+        try:
+            fcntl.ioctl(fd, FICLONE, fsrc.fileno())
+        except BaseException:
+            os.close(fd)
+            os.unlink(dest)
+            raise
+
+        os.close(fd)
+
+    shutil.copystat(source, dest)
+
+
+def materialize(source: str, dest: str, mode: LinkMode) -> None:
+    """
+    Make a package file available at a path without a symlink.
+
+    Reflinks fall back to a plain copy where the filesystem cannot clone
+    files, e.g. across devices.
+
+    :param source: The package file.
+    :param dest: The path to create.
+    :param mode: How to create it; must not be :attr:`LinkMode.SYMLINK`.
+    """
+    if mode == LinkMode.HARDLINK:
+        os.link(source, dest)
+
+    elif mode == LinkMode.REFLINK:
+        try:
+            reflink(source, dest)
+        except OSError as e:
+            if e.errno not in _NO_REFLINK:
+                raise
+
+            log.debug("cannot reflink %s, copying: %s", source, e)
+            copy_file(source, dest)
+
+    elif mode == LinkMode.COPY:
+        copy_file(source, dest)
+
+    else:
+        raise ValueError(f"cannot materialize a node as {mode}")
@@ -210,6 +210,59 @@ def parse_arguments(arguments: List[str], ignore_pkgs: bool) -> Tuple[Dict, List
         action="store_true",
         help="",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=int,
+        action="store",
+        help="process up to N independent filesystem operations in parallel",
+    )
+    parser.add_argument(
+        "--dir-fd",
+        action="store_true",
+        help="apply changes relative to open directory descriptors",
+    )
+    parser.add_argument(
+        "--durable",
+        action="store_true",
+        help="sync all changed directories to disk before exiting",
+    )
+    parser.add_argument(
+        "--max-rate",
+        metavar="N",
+        type=float,
+        action="store",
+        help="start at most N filesystem operations per second",
+    )
+    parser.add_argument(
+        "--max-inflight",
+        metavar="N",
+        type=int,
+        action="store",
+        help="run at most N filesystem operations at the same time",
+    )
+    parser.add_argument(
+        "--manifest",
+        action="store_true",
+        help="record the created links in the stow directory to unstow faster",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and restow the packages whenever they change",
+    )
+    parser.add_argument(
+        "--link-mode",
+        choices=["symlink", "hardlink", "reflink", "copy"],
+        action="store",
+        help="create symlinks (default), hard links, reflinks or copies",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue an interrupted run from its journal",
+    )
     parser.add_argument(
         "-p", "--compat", action="store_true", help="use legacy algorithm for unstowing"
     )
@@ -263,10 +316,22 @@ def parse_arguments(arguments: List[str], ignore_pkgs: bool) -> Tuple[Dict, List
 
     args = parser.parse_args(arguments)
 
-    if not ignore_pkgs:
+    if not ignore_pkgs and not args.resume:
         if not (args.stow or args.delete or args.restow or any(args.packages)):
             parser.error("no packages to stow or unstow")
 
+    if args.watch and args.resume:
+        parser.error("--watch cannot be combined with --resume")
+
+    if args.jobs is not None and args.jobs < 1:
+        parser.error(f"invalid number of jobs: {args.jobs}")
+
+    if args.max_rate is not None and args.max_rate <= 0:
+        parser.error(f"invalid rate: {args.max_rate}")
+
+    if args.max_inflight is not None and args.max_inflight < 1:
+        parser.error(f"invalid number of operations: {args.max_inflight}")
+
     if args.verbose:
         try:
             verbosity = set_verbosity(args.verbose)
@@ -288,6 +353,9 @@ def parse_arguments(arguments: List[str], ignore_pkgs: bool) -> Tuple[Dict, List
         if "/" in pkg:
             parser.error(f"slashes are not permited in package names: {pkg}")
 
+    if args.watch and not stow:
+        parser.error("--watch needs packages to stow")
+
     options = {
         "dir": args.dir,
         "target": args.target,
@@ -302,6 +370,15 @@ def parse_arguments(arguments: List[str], ignore_pkgs: bool) -> Tuple[Dict, List
         "no_folding": args.no_folding,
         "paranoid": args.paranoid,
         "test_mode": args.test_mode,
+        "jobs": args.jobs,
+        "dir_fd": args.dir_fd,
+        "durable": args.durable,
+        "resume": args.resume,
+        "link_mode": args.link_mode,
+        "max_rate": args.max_rate,
+        "max_inflight": args.max_inflight,
+        "manifest": args.manifest,
+        "watch": args.watch,
     }
 
     return options, delete, stow
@@ -354,11 +431,10 @@ def process_options(args: List[str]):
     rc_options, _, _ = get_config_file_options()
 
     for opt in options:
-        if not options[opt] and rc_options[opt]:
+        if not options[opt] and rc_options.get(opt):
             options[opt] = rc_options[opt]
 
     options = sanitize_path_options(options)
-    print(options)
     # no check, since already checked in parse_options()
 
     return options, delete, stow
@@ -0,0 +1,139 @@
+"""
+Cheap path arithmetic for the planner internals.
+
+All paths handled by the planners are kept in normalised form (as produced
+by :func:`stowng.utils.join`). Building on that invariant, the helpers here
+combine paths by plain string concatenation and split them into interned
+component tuples, instead of running :func:`os.path.normpath` at every step.
+Paths that come from outside, e.g. the text of an existing symlink, still
+have to go through :func:`stowng.utils.join` first.
+"""
+import os
+import sys
+from functools import lru_cache
+from typing import Tuple
+
+from .utils import join
+
+Parts = Tuple[str, ...]
+
+
+def child(parent: str, name: str) -> str:
+    """
+    Get the path of an entry in a directory.
+
+    :param parent: The normalised path of the directory.
+    :param name: The name of the entry, as returned by a directory listing.
+
+    :returns: The normalised path of the entry.
+
+    :Example:
+    >>> child(".", "bin")
+    'bin'
+    >>> child("../stow/pkg", "bin")
+    '../stow/pkg/bin'
+    >>> child("/", "etc")
+    '/etc'
+    """
+    if parent == "." or parent == "":
+        return name
+
+    if parent == "/":
+        return "/" + name
+
+    return parent + "/" + name
+
+
+def up(path: str) -> str:
+    """
+    Get a relative path as seen from one directory further down.
+
+    Equivalent to ``join("..", path)`` for a normalised path.
+
+    :param path: The normalised path.
+
+    :returns: The normalised path prefixed with ``..``.
+
+    :Example:
+    >>> up("../stow/pkg/bin")
+    '../../stow/pkg/bin'
+    >>> up(".")
+    '..'
+    >>> up("/abs")
+    '/abs'
+    """
+    if path.startswith("/"):
+        return path
+
+    if path == ".":
+        return ".."
+
+    return "../" + path
+
+
+def package_path(stow_path: str, package: str, target: str) -> str:
+    """
+    Get the path of a target inside a package.
+
+    Equivalent to ``join(stow_path, package, target)`` for normalised
+    arguments.
+
+    :param stow_path: The normalised path of the stow directory.
+    :param package: The name of the package.
+    :param target: The normalised target.
+
+    :returns: The normalised path inside the package.
+
+    :Example:
+    >>> package_path("../stow", "pkg", ".")
+    '../stow/pkg'
+    >>> package_path("../stow", "pkg", "bin/ls")
+    '../stow/pkg/bin/ls'
+    """
+    if package in (".", "..") or "/" in package:
+        return join(stow_path, package, target)
+
+    path = child(stow_path, package)
+
+    if target == ".":
+        return path
+
+    return child(path, target)
+
+
+def temp_name(name: str) -> str:
+    """
+    Get the name of the temporary node used to replace a node atomically.
+
+    :param name: The name of the node to replace.
+
+    :returns: A name in the same directory.
+
+    :Example:
+    >>> temp_name("bin").startswith(".bin.stowng-")
+    True
+    """
+    return f".{name[:200]}.stowng-{os.getpid()}"
+
+
+@lru_cache(maxsize=1 << 16)
+def parts(path: str) -> Parts:
+    """
+    Split a normalised path into its components.
+
+    The tuples and their components are interned, so splitting the same
+    path again costs a cache lookup and equal components share memory.
+
+    :param path: The normalised path.
+
+    :returns: The components of the path.
+
+    :Example:
+    >>> parts("../stow/pkg")
+    ('..', 'stow', 'pkg')
+    >>> parts("/etc")
+    ('', 'etc')
+    >>> parts("../stow/pkg") is parts("../stow/pkg")
+    True
+    """
+    return tuple(sys.intern(part) for part in path.split("/"))
@@ -0,0 +1,242 @@
+import os
+import sqlite3
+import logging
+import tempfile
+import weakref
+from typing import Dict, Iterator, Optional, Tuple
+
+from .task import Action, NodeType, Task
+
+log = logging.getLogger(__name__)
+
+SPILL_THRESHOLD = 1 << 20
+STREAM_BATCH = 4096
+
+_KINDS = {NodeType.LINK: 1, NodeType.DIR: 2}
+
+
+def _close(db: sqlite3.Connection, path: str) -> None:
+    try:
+        db.close()
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class PlanStore:
+    """
+    The planned tasks, in plan order, with the link and directory task of
+    every path.
+
+    Tasks are kept in memory until there are more than ``spill_threshold``
+    of them. From then on they live in a temporary SQLite database with an
+    index on the paths, so memory use no longer grows with the plan and the
+    tasks are streamed back in order for processing.
+
+    :param spill_threshold: The number of tasks kept in memory, or None to
+        never spill.
+    :param spill_dir: The directory for the database, by default the
+        system's temporary directory.
+
+    :Example:
+    >>> store = PlanStore(spill_threshold=1)
+    >>> store.add(Task(Action.CREATE, NodeType.DIR, path="a"))
+    >>> store.add(Task(Action.CREATE, NodeType.LINK, path="a/b", source="../s"))
+    >>> store.spilled
+    True
+    >>> store.link_task("a/b")
+    Task(create, link, path='a/b', source='../s', dest='')
+    >>> store.remove(store.dir_task("a"))
+    >>> list(store)
+    [Task(create, link, path='a/b', source='../s', dest='')]
+    """
+
+    def __init__(
+        self,
+        spill_threshold: Optional[int] = SPILL_THRESHOLD,
+        spill_dir: Optional[str] = None,
+    ) -> None:
+        self._threshold = spill_threshold
+        self._spill_dir = spill_dir
+
+        self._order: Dict[Task, None] = {}
+        self._for: Dict[int, Dict[str, Task]] = {kind: {} for kind in _KINDS.values()}
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._finalizer: Optional[weakref.finalize] = None
+        self._count = 0
+        self._seq = 0
+
+    @property
+    def spilled(self) -> bool:
+        """
+        Whether the tasks have been moved to disk.
+        """
+        return self._db is not None
+
+    def __len__(self) -> int:
+        return self._count if self._db is not None else len(self._order)
+
+    def __iter__(self) -> Iterator[Task]:
+        if self._db is None:
+            yield from self._order
+            return
+
+        cursor = self._db.execute(
+            "SELECT action, type, path, source, dest FROM tasks ORDER BY seq"
+        )
+
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH)
+
+            if not rows:
+                break
+
+            for row in rows:
+                yield self._task(row)
+
+    def close(self) -> None:
+        """
+        Discard the plan, deleting the database if it was spilled.
+        """
+        self._order.clear()
+
+        for tasks in self._for.values():
+            tasks.clear()
+
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+
+        self._db = None
+        self._count = 0
+
+    def add(self, task: Task) -> None:
+        """
+        Append a task to the plan.
+
+        It becomes the link or directory task of its path.
+
+        :param task: The task.
+        """
+        kind = _KINDS.get(task.type_, 0)
+
+        if self._db is not None:
+            self._insert(kind, task)
+            return
+
+        self._order[task] = None
+
+        if kind:
+            self._for[kind][task.path] = task
+
+        if self._threshold is not None and len(self._order) > self._threshold:
+            self._spill()
+
+    def remove(self, task: Task) -> None:
+        """
+        Cancel the link or directory task of a path.
+
+        :param task: The task, as returned by :meth:`link_task` or
+            :meth:`dir_task`.
+        """
+        kind = _KINDS[task.type_]
+
+        if self._db is None:
+            del self._order[self._for[kind].pop(task.path)]
+            return
+
+        self._db.execute(
+            "DELETE FROM tasks WHERE seq = (SELECT MAX(seq) FROM tasks"
+            " WHERE kind = ? AND path = ?)",
+            (kind, task.path),
+        )
+        self._count -= 1
+
+    def link_task(self, path: str) -> Optional[Task]:
+        """
+        Get the link task of a path.
+
+        :param path: The path.
+
+        :returns: The task, or None if there is none.
+        """
+        return self._lookup(_KINDS[NodeType.LINK], path)
+
+    def dir_task(self, path: str) -> Optional[Task]:
+        """
+        Get the directory task of a path.
+
+        :param path: The path.
+
+        :returns: The task, or None if there is none.
+        """
+        return self._lookup(_KINDS[NodeType.DIR], path)
+
+    def _lookup(self, kind: int, path: str) -> Optional[Task]:
+        if self._db is None:
+            return self._for[kind].get(path)
+
+        row = self._db.execute(
+            "SELECT action, type, path, source, dest FROM tasks"
+            " WHERE kind = ? AND path = ? ORDER BY seq DESC LIMIT 1",
+            (kind, path),
+        ).fetchone()
+
+        return self._task(row) if row is not None else None
+
+    def _spill(self) -> None:
+        fd, path = tempfile.mkstemp(
+            prefix="stowng-plan-", suffix=".db", dir=self._spill_dir
+        )
+        os.close(fd)
+
+        log.debug("Spilling %d planned tasks to %s", len(self._order), path)
+
+        # the store may be closed or collected on an executor thread
+        db = sqlite3.connect(path, check_same_thread=False)
+        self._finalizer = weakref.finalize(self, _close, db, path)
+
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute(
+            "CREATE TABLE tasks (seq INTEGER PRIMARY KEY, kind INTEGER,"
+            " action INTEGER, type INTEGER, path TEXT, source TEXT, dest TEXT)"
+        )
+        db.execute("CREATE INDEX tasks_path ON tasks (kind, path)")
+
+        self._db = db
+
+        # the database is private and temporary, so changes are never
+        # committed; the connection sees its own uncommitted rows
+        for task in self._order:
+            self._insert(_KINDS.get(task.type_, 0), task)
+
+        self._order.clear()
+
+        for tasks in self._for.values():
+            tasks.clear()
+
+    def _insert(self, kind: int, task: Task) -> None:
+        row: Tuple = (
+            self._seq,
+            kind,
+            int(task.action),
+            int(task.type_),
+            task.path,
+            task.source,
+            task.dest,
+        )
+        self._seq += 1
+        self._count += 1
+
+        self._db.execute("INSERT INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+
+    @staticmethod
+    def _task(row: Tuple) -> Task:
+        action, type_, path, source, dest = row
+        return Task(
+            Action(action), NodeType(type_), path=path, source=source, dest=dest
+        )
@@ -0,0 +1,399 @@
+import os
+import logging
+from typing import Dict, List, Optional
+
+from .stow import Stow
+from .unstow import Unstow
+from .tasks import Tasks
+from .filesystem import Filesystem
+from .fingerprint import DirPrint, changed_dirs, fingerprint_tree, options_digest
+from .ignore import Ignore, PackageIgnore
+from .manifest import Manifest
+from .paths import child, package_path, up
+from .utils import adjust_dotfile, join
+
+log = logging.getLogger(__name__)
+
+
+class Restow(Stow):
+    """
+    Plan restows as the difference between a package and its links.
+
+    Instead of unstowing a package and stowing it again, which probes every
+    node twice and unfolds and refolds directories on the way, the package
+    is walked once and compared to the target:
+
+    * links that already point to the right node are kept;
+    * links into the same package that point elsewhere or nowhere are
+      replaced;
+    * directories are descended into, and invalid links into the stow
+      directory are removed from them afterwards, as an unstow would;
+    * everything else is stowed as usual.
+
+    Folded and unfolded directories are left as they are, so only links
+    that have to change are touched. In compat mode, restows are still
+    planned as an unstow followed by a stow.
+
+    With a manifest, the directories of every tracked package are
+    fingerprinted (see :mod:`stowng.fingerprint`) and compared to the
+    fingerprints recorded by the last restow. Unchanged packages are skipped
+    entirely; for the others only the topmost changed directories are
+    restowed. The target itself is not checked then, so a restow does not
+    repair links of an unchanged package that were removed by hand.
+    Packages with files created instead of symlinks are always restowed
+    whole, so copies of package files that changed are created again. If the
+    options or ignore files changed since (see :meth:`options_digest`), the
+    links recorded for the package are removed and it is stowed again, as
+    the links planned with the new options may differ from the recorded
+    ones anywhere.
+
+    :param unstow: The planner for unstowing, used in compat mode.
+    :param compat: Whether to plan restows as an unstow and a stow.
+    """
+
+    def __init__(
+        self,
+        tasks: Tasks,
+        filesystem: Filesystem,
+        ignore: Ignore,
+        stow_path: str,
+        unstow: Unstow,
+        dotfiles: bool = False,
+        adopt: bool = False,
+        no_folding: bool = False,
+        compat: bool = False,
+    ) -> None:
+        super().__init__(
+            tasks, filesystem, ignore, stow_path, dotfiles, adopt, no_folding
+        )
+        self._unstow = unstow
+        self._compat = compat
+        self._manifest: Optional[Manifest] = None
+        self._options: List[str] = []
+
+    def set_options(self, options: List[str]) -> None:
+        """
+        Set the options packages are planned with, other than the ignore
+        files, to tell if they changed since the last restow.
+
+        :param options: The options, each as a string.
+        """
+        self._options = options
+
+    def options_digest(self, package: str) -> str:
+        """
+        Digest the options and ignore files a package is planned with.
+
+        :param package: The name of the package.
+
+        :returns: The digest.
+        """
+        return options_digest(
+            self._options, self._ignore.files(join(self._stow_path, package))
+        )
+
+    def set_manifest(self, manifest: Optional[Manifest]) -> None:
+        """
+        Set the manifest to read the fingerprints of earlier restows from.
+
+        :param manifest: The manifest, or None to always restow everything.
+        """
+        self._manifest = manifest
+
+    def plan_restow(self, packages: List[str]) -> Dict[str, Dict[str, DirPrint]]:
+        """
+        Plan the restow operation.
+
+        :param packages: The packages to restow.
+
+        :returns: The current fingerprints of the packages, to be recorded
+            once the tasks are processed.
+
+        :raises Exception: If the stow directory does not contain a package
+            named like one of the packages.
+        """
+        if self._compat:
+            self._unstow.plan_unstow(packages)
+            self.plan_stow(packages)
+            return {}
+
+        prints: Dict[str, Dict[str, DirPrint]] = {}
+
+        for package in packages:
+            path = join(self._stow_path, package)
+
+            if not self._filesystem.isdir(path):
+                log.error(
+                    f"The stow directory {self._stow_path} does not contain package"
+                    f" {package}"
+                )
+                raise Exception(
+                    f"the stow directory {self._stow_path} does not contain package"
+                    f" {package}"
+                )
+
+            if self._manifest is None:
+                self._restow_package(package)
+                continue
+
+            known = self._manifest.fingerprints(package)
+            prints[package] = fingerprint_tree(path, known)
+
+            # copies of changed files do not show in the fingerprints
+            if (
+                not known
+                or not self._manifest.tracked(package)
+                or self._manifest.materialized(package)
+            ):
+                self._restow_package(package)
+                continue
+
+            if self._manifest.options(package) != self.options_digest(package):
+                log.debug("Options of package %s changed, restowing it", package)
+                self._unstow.plan_unstow([package])
+                self.plan_stow([package])
+                continue
+
+            changed = changed_dirs(known, prints[package])
+
+            if not changed:
+                log.debug("Package %s is unchanged, skipping it", package)
+            else:
+                self.plan_restow_dirs(package, changed)
+
+        return prints
+
+    def plan_restow_dirs(self, package: str, dirs: List[str]) -> None:
+        """
+        Plan the restow of the directories of a package that changed.
+
+        The whole package is restowed if the package directory itself is one
+        of them or a parent of one of them is missing from the target.
+
+        :param package: The name of the package.
+        :param dirs: The directories, relative to the package (``.`` for the
+            package itself), none of them below another one.
+        """
+        if "." in dirs or not self._restowable(dirs):
+            self._restow_package(package)
+            return
+
+        log.debug("Restowing %s in package %s", ", ".join(dirs), package)
+
+        for dir in dirs:
+            if not self._folded(dir):
+                self.plan_restow_node(package, dir)
+
+    def plan_restow_node(self, package: str, path: str) -> None:
+        """
+        Plan the restow of a single node of a package, e.g. a directory that
+        changed since the package was stowed.
+
+        :param package: The name of the package.
+        :param path: The node, relative to the package.
+        """
+        target = self._target(path)
+        ignore = self._ignore.for_package(self._stow_path, package)
+
+        if ignore.ignore(target):
+            return
+
+        node_path = package_path(self._stow_path, package, path)
+
+        if not self._filesystem.isdir(node_path):
+            log.debug("%s is gone from package %s", path, package)
+            return
+
+        source = node_path
+
+        for _ in range(path.count("/")):
+            source = up(source)
+
+        log.debug("Planning restow of %s in package %s...", path, package)
+
+        self._restow_node(package, target, source, node_path, ignore)
+        self.worklist.run()
+
+    def _restow_package(self, package: str) -> None:
+        """
+        Plan the restow of a whole package.
+
+        :param package: The name of the package.
+        """
+        path = join(self._stow_path, package)
+
+        log.debug("Planning restow of package %s...", package)
+
+        self._restow_contents(
+            package,
+            ".",
+            path,
+            path,
+            self._ignore.for_package(self._stow_path, package),
+        )
+        self.worklist.run()
+
+        log.debug("Planning restow of package %s... done", package)
+        self._action_count += 1
+
+    def _restow_contents(
+        self,
+        package: str,
+        target: str,
+        source: str,
+        path: str,
+        ignore: PackageIgnore,
+    ) -> None:
+        """
+        Plan the restow of the contents of a package directory.
+
+        :param package: The name of the package.
+        :param target: The target directory.
+        :param source: The source of the directory, relative to the target.
+        :param path: The directory inside the package.
+        :param ignore: The ignore rules of the package.
+        """
+        ignore = ignore.scope(target)
+
+        if self._filesystem.should_skip_target_which_is_stow_dir(target):
+            return
+
+        log.debug("Restowing contents of %s", path)
+        log.debug("  => %s", source)
+
+        def visit(node: str) -> None:
+            node_target = child(target, node)
+
+            if ignore.ignore(node_target):
+                return
+
+            if self._dotfiles:
+                node_target = adjust_dotfile(node_target)
+
+            self._restow_node(
+                package,
+                node_target,
+                child(source, node),
+                child(path, node),
+                ignore,
+            )
+
+        def finish() -> None:
+            if self._filesystem.is_a_dir(target):
+                self._tasks.cleanup_invalid_links(target)
+
+        self.worklist.push(self._filesystem.scandir(path), visit).after(finish)
+
+    def _restow_node(
+        self,
+        package: str,
+        target: str,
+        source: str,
+        path: str,
+        ignore: PackageIgnore,
+    ) -> None:
+        """
+        Plan the restow of a node.
+
+        :param package: The name of the package.
+        :param target: The target of the node.
+        :param source: The source of the node, relative to the parent of the
+            target.
+        :param path: The node inside the package.
+        :param ignore: The ignore rules of the package.
+        """
+        if not self._filesystem.islink(path):
+            if self._filesystem.is_a_link(target):
+                existing_source = self._tasks.read_a_link(target)
+
+                if existing_source == source:
+                    if self._filesystem.stale(target):
+                        log.debug("--- Refreshing %s from %s", target, source)
+                        self._tasks.do_refresh(source, target)
+                        return
+
+                    log.debug("--- Keeping %s as it points to %s", target, source)
+                    self._tasks.keep_link(target, source)
+                    return
+
+                if existing_source is not None and not existing_source.startswith("/"):
+                    _, _, existing_package = self._filesystem.find_stowed_path(
+                        target, existing_source
+                    )
+
+                    if existing_package == package:
+                        log.debug("--- Replacing %s => %s", target, existing_source)
+                        self._tasks.do_unlink(target)
+
+            elif self._existing_dir(target) and self._filesystem.isdir(path):
+                self._restow_contents(package, target, up(source), path, ignore)
+                return
+
+        self._stow_node(self._stow_path, package, target, source, path, ignore)
+
+    def _existing_dir(self, target: str) -> bool:
+        """
+        Determine if a target is a directory that already exists, as opposed
+        to one that is only planned, e.g. when unfolding a link.
+
+        Planned directories have no links to keep or replace yet, so their
+        contents are stowed as usual.
+
+        :param target: The path to check.
+
+        :returns: True if the directory exists and no task is planned for it.
+        """
+        return (
+            self._filesystem.is_a_dir(target)
+            and self._tasks.dir_task_action(target) is None
+            and not self._filesystem.islink(target)
+        )
+
+    def _target(self, path: str) -> str:
+        return adjust_dotfile(path) if self._dotfiles else path
+
+    def _restowable(self, dirs: List[str]) -> bool:
+        """
+        Determine if directories can be restowed on their own.
+
+        That is the case if each of their parents in the target is either a
+        directory or a link folding one of its parents into the package.
+
+        :param dirs: The directories, relative to the package.
+
+        :returns: False if a parent is missing or not a directory, so the
+            whole package has to be restowed.
+        """
+        for dir in dirs:
+            parent = os.path.dirname(self._target(dir))
+
+            while parent != "":
+                if self._filesystem.is_a_link(parent):
+                    break
+
+                if not self._filesystem.is_a_dir(parent):
+                    log.debug("  %s is not a directory, restowing everything", parent)
+                    return False
+
+                parent = os.path.dirname(parent)
+
+        return True
+
+    def _folded(self, path: str) -> bool:
+        """
+        Determine if a package directory is reachable in the target through a
+        link to one of its parents, which makes any change to it visible.
+
+        :param path: The directory, relative to the package.
+
+        :returns: True if one of the parents in the target is a link.
+        """
+        parent = os.path.dirname(self._target(path))
+
+        while parent != "":
+            if self._filesystem.is_a_link(parent):
+                return True
+
+            parent = os.path.dirname(parent)
+
+        return False
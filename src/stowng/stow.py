@@ -1,11 +1,13 @@
 import os
 import logging
-from typing import List
+from typing import List, Optional
 
-from .ignore import Ignore
+from .ignore import Ignore, PackageIgnore
 from .filesystem import Filesystem
 from .tasks import Tasks
+from .paths import child, package_path, up
 from .utils import adjust_dotfile, join
+from .worklist import Worklist
 
 log = logging.getLogger(__name__)
 
@@ -31,6 +33,8 @@ class Stow:
 
         self._action_count = 0
 
+        self.worklist = Worklist()
+
     def plan_stow(self, packages: List[str]) -> None:
         """
         Plan the stow operation.
@@ -44,7 +48,7 @@ class Stow:
         for package in packages:
             path = join(self._stow_path, package)
 
-            if not os.path.isdir(path):
+            if not self._filesystem.isdir(path):
                 log.error(
                     f"The stow directory {self._stow_path} does not contain a package"
                     f" named {package}"
@@ -54,35 +58,59 @@ class Stow:
                     f" named {package}"
                 )
 
-            log.debug(f"Planning stow of package {package}...")
+            log.debug("Planning stow of package %s...", package)
 
-            self._stow_contents(self._stow_path, package, ".", path)
+            self._stow_contents(
+                self._stow_path,
+                package,
+                ".",
+                path,
+                path,
+                self._ignore.for_package(self._stow_path, package),
+            )
+            self.worklist.run()
 
-            log.debug(f"Planning stow of package {package}... done")
+            log.debug("Planning stow of package %s... done", package)
             self._action_count += 1
 
     def _stow_contents(
-        self, stow_path: str, package: str, target: str, source: str
+        self,
+        stow_path: str,
+        package: str,
+        target: str,
+        source: str,
+        path: Optional[str] = None,
+        ignore: Optional[PackageIgnore] = None,
     ) -> None:
         """
         Plan the stow of the contents of a package.
 
+        The checks happen immediately, the entries are pushed onto the
+        worklist and visited when it is run.
+
         :param stow_path: The path to the stow directory.
         :param package: The name of the package to stow.
         :param target: The target to stow.
         :param source: The source to stow.
+        :param path: The directory inside the package, if already known.
+        :param ignore: The ignore rules of the package, if already known.
         """
-        path = join(stow_path, package, target)
+        if path is None:
+            path = package_path(stow_path, package, target)
+
+        if ignore is None:
+            ignore = self._ignore.for_package(stow_path, package)
+
+        ignore = ignore.scope(target)
 
         if self._filesystem.should_skip_target_which_is_stow_dir(target):
             return
 
-        cwd = os.getcwd()
-
-        log.debug(f"Stowing contents of {path} (cwd={cwd})")
-        log.debug(f"  => {source}")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Stowing contents of %s (cwd=%s)", path, os.getcwd())
+            log.debug("  => %s", source)
 
-        if not os.path.isdir(path):
+        if not self._filesystem.isdir(path):
             log.error(f"stow_contents() called with non-directory path: {path}")
             raise Exception(f"stow_contents() called with non-directory path: {path}")
 
@@ -92,26 +120,36 @@ class Stow:
 
         # TODO: check if dir is readable
 
-        for node in os.listdir(path):
-            node_target = join(target, node)
+        def visit(node: str) -> None:
+            node_target = child(target, node)
 
-            if self._ignore.ignore(stow_path, package, node_target):
-                continue
+            if ignore.ignore(node_target):
+                return
 
             if self._dotfiles:
                 adj_node_target = adjust_dotfile(node_target)
-                log.debug(f"  Adjusting: {node_target} => {adj_node_target}")
+                log.debug("  Adjusting: %s => %s", node_target, adj_node_target)
                 node_target = adj_node_target
 
             self._stow_node(
                 stow_path,
                 package,
                 node_target,
-                join(source, node),
+                child(source, node),
+                child(path, node),
+                ignore,
             )
 
+        self.worklist.push(self._filesystem.scandir(path), visit)
+
     def _stow_node(
-        self, stow_path: str, package: str, target: str, source: str
+        self,
+        stow_path: str,
+        package: str,
+        target: str,
+        source: str,
+        path: Optional[str] = None,
+        ignore: Optional[PackageIgnore] = None,
     ) -> None:
         """
         Stow a node.
@@ -120,25 +158,27 @@ class Stow:
         :param package: The name of the package.
         :param target: The target to stow.
         :param source: The source to stow.
+        :param path: The node inside the package, if already known.
+        :param ignore: The ignore rules of the package, if already known.
         """
+        if path is None:
+            path = package_path(stow_path, package, target)
 
-        path = join(stow_path, package, target)
+        log.debug("Stowing %s / %s / %s", stow_path, package, target)
+        log.debug("  => %s", source)
 
-        log.debug(f"Stowing {stow_path} / {package} / {target}")
-        log.debug(f"  => {source}")
-
-        if os.path.islink(source):
-            second_source = self._tasks.read_a_link(source)
+        if self._filesystem.islink(path):
+            second_source = self._filesystem.readlink(path)
 
             if second_source is None:
-                log.error(f"link {source} does not exist, but should")
-                raise Exception(f"link {source} does not exist, but should")
+                log.error(f"link {path} does not exist, but should")
+                raise Exception(f"link {path} does not exist, but should")
 
             if second_source.startswith("/"):
                 self._tasks.conflict(
                     "stow",
                     package,
-                    f"source is an absolute symlink {source} => {second_source}",
+                    f"source is an absolute symlink {path} => {second_source}",
                 )
                 log.debug("Absolute symlink cannot be unstowed")
                 return
@@ -150,7 +190,7 @@ class Stow:
                 log.error(f"Could not read link: {target}")
                 raise Exception(f"Could not read link: {target}")
 
-            log.debug(f"  Evaluate existing link: {target} => {existing_source}")
+            log.debug("  Evaluate existing link: %s => %s", target, existing_source)
 
             (
                 existing_path,
@@ -166,11 +206,14 @@ class Stow:
 
             if self._filesystem.is_a_node(existing_path):
                 if existing_source == source:
-                    log.debug(f"--- Skipping {target} as it already points to {source}")
+                    log.debug(
+                        "--- Skipping %s as it already points to %s", target, source
+                    )
+                    self._tasks.keep_link(target, source)
                 elif self._filesystem.defer(target):
-                    log.debug(f"--- Deferring installation of: {target}")
+                    log.debug("--- Deferring installation of: %s", target)
                 elif self._filesystem.override(target):
-                    log.debug(f"--- Overriding installation of: {target}")
+                    log.debug("--- Overriding installation of: %s", target)
                     self._tasks.do_unlink(target)
                     self._tasks.do_link(source, target)
                 elif self._filesystem.is_a_dir(
@@ -179,8 +222,9 @@ class Stow:
                     )
                 ) and self._filesystem.is_a_dir(join(os.path.dirname(target), source)):
                     log.debug(
-                        f"--- Unfolding {target} which was already owned by"
-                        f" {existing_package}"
+                        "--- Unfolding %s which was already owned by %s",
+                        target,
+                        existing_package,
                     )
                     self._tasks.do_unlink(target)
                     self._tasks.do_mkdir(target)
@@ -194,7 +238,9 @@ class Stow:
                         stow_path,
                         package,
                         target,
-                        join("..", source),
+                        up(source),
+                        path,
+                        ignore,
                     )
                 else:
                     self._tasks.conflict(
@@ -204,18 +250,20 @@ class Stow:
                         f" {existing_source}",
                     )
             else:
-                log.debug(f"--- replacing invalid link: {path}")
+                log.debug("--- replacing invalid link: %s", path)
                 self._tasks.do_unlink(target)
                 self._tasks.do_link(source, target)
         elif self._filesystem.is_a_node(target):
-            log.debug(f"  Evaluate existing node: {target}")
+            log.debug("  Evaluate existing node: %s", target)
 
             if self._filesystem.is_a_dir(target):
                 self._stow_contents(
                     self._stow_path,
                     package,
                     target,
-                    join("..", source),
+                    up(source),
+                    path,
+                    ignore,
                 )
             else:
                 if self._adopt:
@@ -227,13 +275,75 @@ class Stow:
                         package,
                         f"existing target is neither a link nor a directory: {target}",
                     )
-        elif self._no_folding and os.path.isdir(path) and not os.path.islink(path):
-            self._tasks.do_mkdir(target)
-            self._stow_contents(
-                self._stow_path,
-                package,
-                target,
-                join("..", source),
-            )
+        elif (
+            self._no_folding
+            and self._filesystem.isdir(path)
+            and not self._filesystem.islink(path)
+        ):
+            if ignore is None:
+                ignore = self._ignore.for_package(stow_path, package)
+
+            self._stow_absent(package, target, source, path, ignore)
         else:
             self._tasks.do_link(source, target)
+
+    def _stow_absent(
+        self,
+        package: str,
+        target: str,
+        source: str,
+        path: str,
+        ignore: PackageIgnore,
+    ) -> None:
+        """
+        Plan the stow of a package directory to a target which does not exist.
+
+        Nothing below such a target can exist or be owned by another
+        package, so the whole subtree is planned from the package side alone,
+        without probing the target for every node.
+
+        :param package: The name of the package.
+        :param target: The target directory to create.
+        :param source: The source of the directory, relative to the parent
+            of the target.
+        :param path: The directory inside the package.
+        :param ignore: The ignore rules of the package.
+        """
+        log.debug("Stowing %s to absent target %s", path, target)
+
+        self._tasks.do_mkdir(target)
+
+        ignore = ignore.scope(target)
+        source = up(source)
+
+        def visit(node: str) -> None:
+            node_target = child(target, node)
+
+            if ignore.ignore(node_target):
+                return
+
+            if self._dotfiles:
+                node_target = adjust_dotfile(node_target)
+
+            node_source = child(source, node)
+            node_path = child(path, node)
+
+            if self._filesystem.islink(node_path):
+                if self._filesystem.readlink(node_path).startswith("/"):
+                    # let the regular path report the conflict
+                    self._stow_node(
+                        self._stow_path,
+                        package,
+                        node_target,
+                        node_source,
+                        node_path,
+                        ignore,
+                    )
+                    return
+            elif self._filesystem.isdir(node_path):
+                self._stow_absent(package, node_target, node_source, node_path, ignore)
+                return
+
+            self._tasks.do_link(node_source, node_target)
+
+        self.worklist.push(self._filesystem.scandir(path), visit)
@@ -1,31 +1,25 @@
+import os
 import logging
-from typing import List
+from typing import Dict, List
 
 from .parser import process_options
 from .farmer import Farmer
 from .cwd import change_cwd
+from .materialize import LinkMode
+from .watch import Watcher
 
-logging.basicConfig(level=logging.INFO, format="%(message)s")
 log = logging.getLogger(__name__)
 
 
-def main(arguments: List[str]):
-    """
-    The main function.
-
-    .. todo:: testing
-    .. todo:: documentation
-    .. todo:: logging levels correct?
+def new_farmer(options: Dict) -> Farmer:
     """
-    options, pkgs_to_delete, pkgs_to_stow = process_options(arguments)
+    Create a farmer for the options.
 
-    logging.getLogger().setLevel(10 * options["verbosity"])
+    :param options: The options.
 
-    # log.debug(f"Options:")
-    # for key, value in options.items():
-    #     log.debug(f"    {key}: {value}")
-
-    farmer = Farmer(
+    :returns: The farmer.
+    """
+    return Farmer(
         options["dir"],
         options["target"],
         options["ignore"],
@@ -38,30 +32,124 @@ def main(arguments: List[str]):
         options["no_folding"],
         options["paranoid"],
         options["test_mode"],
+        options["jobs"] or 1,
+        options["dir_fd"],
+        options["durable"],
+        journal=True,
+        link_mode=LinkMode[(options["link_mode"] or "symlink").upper()],
+        max_rate=options["max_rate"],
+        max_inflight=options["max_inflight"],
+        manifest=options["manifest"],
     )
 
-    with change_cwd(options["target"]):
-        farmer.plan_unstow(pkgs_to_delete)
-        farmer.plan_stow(pkgs_to_stow)
+
+def report_conflicts(conflicts: Dict) -> None:
+    """
+    Log the planned conflicts.
+
+    :param conflicts: The conflicts, by action and package.
+    """
+    for action in ("stow", "unstow"):
+        if action in conflicts:
+            for package in conflicts[action]:
+                log.warn(f"WARNING! {action}ing {package} would cause conflicts:")
+
+                for message in conflicts[action][package]:
+                    log.warn(f"  * {message}")
+
+
+def watch(options: Dict, packages: List[str]) -> None:
+    """
+    Keep the target in sync with packages until interrupted.
+
+    Every batch of changes is planned and processed with a new farmer, so
+    nothing is cached across batches. Batches with conflicts are skipped.
+
+    :param options: The options.
+    :param packages: The packages to watch.
+    """
+
+    def apply(changes: Dict[str, List[str]]) -> None:
+        farmer = new_farmer(options)
+
+        for package, dirs in changes.items():
+            farmer.plan_restow_dirs(package, dirs)
 
         conflicts = farmer.get_conflicts()
 
         if len(conflicts) > 0:
-            for action in ("stow", "unstow"):
-                if action in conflicts:
-                    for package in conflicts[action]:
-                        log.warn(
-                            f"WARNING! {action}ing {package} would cause conflicts:"
-                        )
+            report_conflicts(conflicts)
+            log.warn("Changes skipped.")
+        elif options["simulate"]:
+            log.info("WARNING: in simulation mode so not modifying filesystem.")
+        else:
+            farmer.process_tasks()
 
-                        for message in conflicts[action][package]:
-                            log.warn(f"  * {message}")
+    watcher = Watcher(
+        os.path.abspath(options["dir"]),
+        packages,
+        apply,
+        contents=(options["link_mode"] or "symlink") != "symlink",
+    )
 
-            log.warn("All operations aborted.")
-            raise Exception("conflicts detected")
-        else:
+    with change_cwd(options["target"]):
+        log.info("Watching %s, press Ctrl-C to stop", ", ".join(packages))
+
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+
+
+def main(arguments: List[str]):
+    """
+    The main function.
+
+    .. todo:: testing
+    .. todo:: documentation
+    .. todo:: logging levels correct?
+    """
+    options, pkgs_to_delete, pkgs_to_stow = process_options(arguments)
+
+    logging.basicConfig(
+        level=logging.DEBUG if options["verbosity"] else logging.INFO,
+        format="%(message)s",
+    )
+
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Options:")
+        for key, value in options.items():
+            log.debug("    %s: %s", key, value)
+
+    farmer = new_farmer(options)
+
+    with change_cwd(options["target"]):
+        if options["resume"]:
             if options["simulate"]:
                 log.info("WARNING: in simulation mode so not modifying filesystem.")
                 return
 
+            farmer.resume_tasks()
+            return
+
+        pkgs_to_restow = [pkg for pkg in pkgs_to_stow if pkg in pkgs_to_delete]
+
+        farmer.plan_unstow([pkg for pkg in pkgs_to_delete if pkg not in pkgs_to_restow])
+        farmer.plan_restow(pkgs_to_restow)
+        farmer.plan_stow([pkg for pkg in pkgs_to_stow if pkg not in pkgs_to_restow])
+
+        conflicts = farmer.get_conflicts()
+
+        if len(conflicts) > 0:
+            report_conflicts(conflicts)
+            log.warn("All operations aborted.")
+            raise Exception("conflicts detected")
+        elif options["simulate"]:
+            log.info("WARNING: in simulation mode so not modifying filesystem.")
+        else:
             farmer.process_tasks()
+
+    if options["watch"]:
+        watch(options, pkgs_to_stow)
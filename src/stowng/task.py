@@ -1,44 +1,208 @@
 import os
 import shutil
 import logging
+from enum import IntEnum
+from typing import Callable
 
-from .utils import internal_error
+from .materialize import LinkMode, materialize
+from .paths import temp_name
+from .utils import internal_error, join
 
 log = logging.getLogger(__name__)
 
 
+class Action(IntEnum):
+    CREATE = 1
+    REMOVE = 2
+    MOVE = 3
+    REPLACE = 4
+
+    def __str__(self) -> str:
+        return self.name.lower()
+
+
+class NodeType(IntEnum):
+    DIR = 1
+    LINK = 2
+    FILE = 3
+
+    def __str__(self) -> str:
+        return self.name.lower()
+
+
 class Task:
-    def __init__(self, action, type_, link="", path="", source="", dest="") -> None:
+    __slots__ = ("action", "type_", "path", "source", "dest")
+
+    def __init__(
+        self,
+        action: Action,
+        type_: NodeType,
+        path: str = "",
+        source: str = "",
+        dest: str = "",
+    ) -> None:
         self.action = action
         self.type_ = type_
-        self.link = link
         self.path = path
         self.source = source
         self.dest = dest
 
-    def process(self) -> None:
+    def __repr__(self) -> str:
+        return (
+            f"Task({self.action}, {self.type_}, path={self.path!r},"
+            f" source={self.source!r}, dest={self.dest!r})"
+        )
+
+    def process(self, mode: LinkMode = LinkMode.SYMLINK) -> None:
         """
         Process the task.
 
-        .. todo:: match case? prbly not
+        :param mode: How links are created.
+
         .. todo:: error handling
         .. todo:: testing
         """
-        if self.action == "create":
-            if self.type_ == "dir":
+        if self.action == Action.CREATE:
+            if self.type_ == NodeType.DIR:
                 os.mkdir(self.path)
-            elif self.type_ == "link":
-                os.symlink(self.source, self.path)
+            elif self.type_ == NodeType.LINK:
+                self._create_link(self.path, mode)
 
-        elif self.action == "remove":
-            if self.type_ == "dir":
+        elif self.action == Action.REMOVE:
+            if self.type_ == NodeType.DIR:
                 os.rmdir(self.path)
-            elif self.type_ == "link":
+            elif self.type_ == NodeType.LINK:
                 os.unlink(self.path)
 
-        elif self.action == "move":
-            if self.type_ == "file":
+        elif self.action == Action.MOVE:
+            if self.type_ == NodeType.FILE:
                 shutil.move(self.source, self.dest)
 
+        elif self.action == Action.REPLACE:
+            if self.type_ == NodeType.LINK:
+                parent, name = os.path.split(self.path)
+                temp = os.path.join(parent, temp_name(name))
+                self._replace_link(
+                    lambda: self._create_link(temp, mode),
+                    lambda: os.replace(temp, self.path),
+                    lambda: os.unlink(temp),
+                )
+
         else:
             internal_error(f"bad task action: {self.action}")
+
+    def is_applied(self, mode: LinkMode = LinkMode.SYMLINK) -> bool:
+        """
+        Determine if the filesystem already is in the state the task creates.
+
+        Used when resuming an interrupted run, for tasks that may have been
+        processed without being recorded.
+
+        :param mode: How links are created.
+
+        :returns: True if processing the task would be redundant.
+        """
+        if self.action == Action.MOVE:
+            return not os.path.lexists(self.source) and os.path.lexists(self.dest)
+
+        if self.type_ == NodeType.DIR:
+            is_dir = os.path.isdir(self.path) and not os.path.islink(self.path)
+            return is_dir if self.action == Action.CREATE else not is_dir
+
+        if os.path.islink(self.path):
+            is_link = os.readlink(self.path) == self.source
+        elif mode == LinkMode.HARDLINK:
+            is_link = os.path.isfile(self.path) and os.path.samefile(
+                self.path, self.resolved_source()
+            )
+        else:
+            is_link = mode != LinkMode.SYMLINK and os.path.isfile(self.path)
+
+        return not is_link if self.action == Action.REMOVE else is_link
+
+    def process_at(
+        self, dir_fd: int, name: str, mode: LinkMode = LinkMode.SYMLINK
+    ) -> None:
+        """
+        Process the task relative to an open directory.
+
+        Moves and links which are not symlinks are not supported this way and
+        fall back to :meth:`process`.
+
+        :param dir_fd: The descriptor of the directory containing the path.
+        :param name: The name of the node inside that directory.
+        :param mode: How links are created.
+        """
+        if (
+            mode != LinkMode.SYMLINK
+            and self.type_ == NodeType.LINK
+            and self.action != Action.REMOVE
+        ):
+            self.process(mode)
+
+        elif self.action == Action.CREATE:
+            if self.type_ == NodeType.DIR:
+                os.mkdir(name, dir_fd=dir_fd)
+            elif self.type_ == NodeType.LINK:
+                os.symlink(self.source, name, dir_fd=dir_fd)
+
+        elif self.action == Action.REMOVE:
+            if self.type_ == NodeType.DIR:
+                os.rmdir(name, dir_fd=dir_fd)
+            elif self.type_ == NodeType.LINK:
+                os.unlink(name, dir_fd=dir_fd)
+
+        elif self.action == Action.REPLACE:
+            if self.type_ == NodeType.LINK:
+                temp = temp_name(name)
+                self._replace_link(
+                    lambda: os.symlink(self.source, temp, dir_fd=dir_fd),
+                    lambda: os.rename(temp, name, src_dir_fd=dir_fd, dst_dir_fd=dir_fd),
+                    lambda: os.unlink(temp, dir_fd=dir_fd),
+                )
+
+        else:
+            self.process()
+
+    def resolved_source(self) -> str:
+        """
+        Get the path the source of a link task refers to.
+
+        :returns: The source, relative to the working directory instead of
+            to the directory of the link.
+        """
+        return join(os.path.dirname(self.path), self.source)
+
+    def _create_link(self, path: str, mode: LinkMode) -> None:
+        if mode == LinkMode.SYMLINK:
+            os.symlink(self.source, path)
+        else:
+            materialize(self.resolved_source(), path, mode)
+
+    @staticmethod
+    def _replace_link(
+        create: Callable[[], None],
+        rename: Callable[[], None],
+        remove: Callable[[], None],
+    ) -> None:
+        """
+        Create a temporary link and rename it over the existing node.
+
+        The rename is atomic, so the path never disappears. A temporary link
+        left behind by an interrupted earlier run is removed first.
+
+        :param create: Creates the temporary link.
+        :param rename: Renames the temporary link over the node.
+        :param remove: Removes the temporary link.
+        """
+        try:
+            create()
+        except FileExistsError:
+            remove()
+            create()
+
+        try:
+            rename()
+        except OSError:
+            remove()
+            raise
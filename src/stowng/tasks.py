@@ -1,23 +1,31 @@
 import os
 import logging
-from typing import Dict, Optional
+from typing import Dict, Iterable, List, Optional
 
 from .utils import internal_error, join
-from .task import Task
+from .executor import Executor
+from .journal import Journal
+from .manifest import Manifest
+from .materialize import LinkMode
+from .task import Action, NodeType, Task
+from .trie import PathTrie
+from .paths import child, parts
+from .planstore import SPILL_THRESHOLD, PlanStore
 
 log = logging.getLogger(__name__)
 
 
 class Tasks:
-    def __init__(self):
-        self.tasks = []
-        self.dir_task_for = {}
-        self.link_task_for = {}
-        self.mv_task_for = {}
+    def __init__(self, spill_threshold: Optional[int] = SPILL_THRESHOLD):
+        self.tasks = PlanStore(spill_threshold)
+        self.removed_links = PathTrie()
+        self.kept_links: Dict[str, str] = {}
 
         self.conflicts = {}
         self.conflict_count = 0
 
+        self.filesystem = None
+
     def set_filesystem(self, filesystem) -> None:
         """
         Set the filesystem.
@@ -50,18 +58,184 @@ class Tasks:
         """
         return len(self.tasks)
 
-    def process_tasks(self) -> None:
+    def process_tasks(
+        self,
+        jobs: int = 1,
+        dir_fd: bool = False,
+        durable: bool = False,
+        journal: Optional[str] = None,
+        link_mode: LinkMode = LinkMode.SYMLINK,
+        manifest: Optional[Manifest] = None,
+        max_rate: Optional[float] = None,
+        max_inflight: Optional[int] = None,
+    ) -> None:
         """
         Process the tasks.
+
+        :param jobs: The number of tasks processed at the same time.
+        :param dir_fd: Process tasks relative to open directory descriptors.
+        :param durable: Sync the changes to disk before returning.
+        :param journal: The path of a journal recording the progress, so an
+            interrupted run can be continued with :meth:`resume_tasks`.
+        :param link_mode: How links are created.
+        :param manifest: The manifest to record the created links and
+            directories in.
+        :param max_rate: The maximum number of operations per second.
+        :param max_inflight: The maximum number of operations at the same time.
         """
         log.debug("Processing tasks...")
 
-        for task in self.tasks:
-            if task.action != "skip":
-                task.process()
+        tasks = self.tasks
+        record = None
+
+        if journal is not None and len(tasks) > 0:
+            if os.path.exists(journal):
+                log.warning("Discarding the journal of an interrupted run: %s", journal)
+
+            record = Journal(journal)
+
+            try:
+                record.start(tasks, link_mode)
+            except OSError as e:
+                log.warning("Could not write journal %s: %s", journal, e)
+                record = None
+
+        executor = Executor(
+            jobs,
+            dir_fd,
+            durable=durable,
+            link_mode=link_mode,
+            max_rate=max_rate,
+            max_inflight=max_inflight,
+        )
+
+        try:
+            self._run(tasks, executor, record, manifest, link_mode)
+        finally:
+            tasks.close()
+
+            if self.filesystem is not None:
+                self.filesystem.clear_cache()
 
         log.debug("Processing tasks... done")
 
+    def resume_tasks(
+        self,
+        journal: str,
+        jobs: int = 1,
+        dir_fd: bool = False,
+        durable: bool = False,
+        manifest: Optional[Manifest] = None,
+        max_rate: Optional[float] = None,
+        max_inflight: Optional[int] = None,
+    ) -> None:
+        """
+        Continue processing the tasks of an interrupted run.
+
+        The plan is read from the journal instead of planning again. Tasks
+        not recorded as processed are skipped if the filesystem already
+        reflects them. Links are created the same way as in the interrupted
+        run.
+
+        :param journal: The path of the journal.
+        :param jobs: The number of tasks processed at the same time.
+        :param dir_fd: Process tasks relative to open directory descriptors.
+        :param durable: Sync the changes to disk before returning.
+        :param manifest: The manifest to record the created links and
+            directories in.
+        :param max_rate: The maximum number of operations per second.
+        :param max_inflight: The maximum number of operations at the same time.
+        """
+        record = Journal(journal)
+        tasks, done = record.resume()
+        link_mode = record.link_mode
+
+        remaining = []
+        positions = []
+
+        for index, task in enumerate(tasks):
+            if index not in done and not task.is_applied(link_mode):
+                remaining.append(task)
+                positions.append(index)
+
+        log.debug("Resuming: %d of %d tasks left to process", len(remaining), len(tasks))
+
+        executor = Executor(
+            jobs,
+            dir_fd,
+            durable=durable,
+            link_mode=link_mode,
+            max_rate=max_rate,
+            max_inflight=max_inflight,
+        )
+        self._run(remaining, executor, record, manifest, link_mode, positions)
+
+    def _run(
+        self,
+        tasks: Iterable[Task],
+        executor: Executor,
+        journal: Optional[Journal],
+        manifest: Optional[Manifest],
+        link_mode: LinkMode,
+        positions: Optional[List[int]] = None,
+    ) -> None:
+        """
+        Process tasks, recording the progress in a journal and the created
+        files in a manifest if given.
+
+        The journal is deleted once all tasks were processed and kept if
+        processing fails. The manifest is updated in both cases, including
+        the links that were kept as they are.
+
+        :param positions: The index in the journal of every task, if the
+            tasks are not the complete plan.
+        """
+        if journal is None and manifest is None:
+            executor.run(tasks)
+            return
+
+        done: List[Task] = []
+
+        def on_done(index: int, task: Task) -> None:
+            if manifest is not None and task.type_ != NodeType.FILE:
+                done.append(task)
+
+            if journal is not None:
+                journal.record(positions[index] if positions is not None else index)
+
+        try:
+            executor.run(tasks, on_done)
+        finally:
+            if journal is not None:
+                journal.close()
+
+            if manifest is not None:
+                manifest.update(done, link_mode, self._owner, self.kept_links)
+
+        if journal is not None:
+            journal.finish()
+
+    def _owner(self, path: str, source: str) -> Optional[str]:
+        """
+        Get the package owning a link.
+
+        :param path: The path of the link.
+        :param source: The text of the link.
+
+        :returns: The package, or None if the link is not owned by stow.
+        """
+        _, _, package = self.filesystem.find_stowed_path(path, source)
+        return package or None
+
+    def keep_link(self, path: str, source: str) -> None:
+        """
+        Note a link that is already in place and left as it is.
+
+        :param path: The path of the link.
+        :param source: The text of the link.
+        """
+        self.kept_links[path] = source
+
     def do_link(self, oldfile: str, newfile: str) -> None:
         """
         Create a link.
@@ -69,47 +243,73 @@ class Tasks:
         :param oldfile: The source of the link.
         :param newfile: The destination of the link.
         """
-        if newfile in self.dir_task_for:
-            task_ref = self.dir_task_for[newfile]
+        task_ref = self.tasks.dir_task(newfile)
 
-            if task_ref.action == "create":
-                if task_ref.type_ == "dir":
+        if task_ref is not None:
+            if task_ref.action == Action.CREATE:
+                if task_ref.type_ == NodeType.DIR:
                     internal_error(
                         f"new link ({newfile} => {oldfile}) clashes with planned new"
                         " directory"
                     )
-            elif task_ref.action == "remove":
+            elif task_ref.action == Action.REMOVE:
                 pass  # TODO: see GNU Stow
             else:
                 internal_error(f"bad task action: {task_ref.action}")
 
-        if newfile in self.link_task_for:
-            task_ref = self.link_task_for[newfile]
+        task_ref = self.tasks.link_task(newfile)
 
-            if task_ref.action == "create":
-                if task_ref.source == oldfile:
+        if task_ref is not None:
+            if task_ref.action in (Action.CREATE, Action.REPLACE):
+                if task_ref.source != oldfile:
                     internal_error(
                         f"new link clashes with planned new link: {task_ref.path} =>"
                         f" {task_ref.source}"
                     )
                 else:
                     log.debug(
-                        f"LINK: {newfile} => {oldfile} (duplicates previous action)"
+                        "LINK: %s => %s (duplicates previous action)", newfile, oldfile
                     )
                     return
-            elif task_ref.action == "remove":
+            elif task_ref.action == Action.REMOVE:
+                self.tasks.remove(task_ref)
+
                 if task_ref.source == oldfile:
-                    log.debug(f"LINK: {newfile} => {oldfile} (reverts previous action)")
-                    self.link_task_for[newfile].action = "skip"
-                    self.link_task_for.pop(newfile)
+                    log.debug(
+                        "LINK: %s => %s (reverts previous action)", newfile, oldfile
+                    )
+                    self.removed_links.discard(parts(newfile))
+                    self.keep_link(newfile, oldfile)
                     return
+
+                # swap the old link for the new one in a single rename
+                log.debug("LINK: %s => %s (replaces previous link)", newfile, oldfile)
+                self.removed_links.discard(parts(newfile))
+                task = Task(Action.REPLACE, NodeType.LINK, path=newfile, source=oldfile)
+                self.tasks.add(task)
+                return
             else:
                 internal_error(f"bad task action: {task_ref.action}")
 
-        log.debug(f"LINK: {newfile} => {oldfile}")
-        task = Task("create", "link", path=newfile, source=oldfile)
-        self.tasks.append(task)
-        self.link_task_for[newfile] = task
+        log.debug("LINK: %s => %s", newfile, oldfile)
+        task = Task(Action.CREATE, NodeType.LINK, path=newfile, source=oldfile)
+        self.tasks.add(task)
+
+    def do_refresh(self, oldfile: str, newfile: str) -> None:
+        """
+        Create a link that is already in place again, e.g. a copy of a
+        package file that changed since.
+
+        :param oldfile: The source of the link.
+        :param newfile: The destination of the link.
+        """
+        if self.tasks.link_task(newfile) is not None:
+            log.debug("REFRESH: %s => %s (already planned)", newfile, oldfile)
+            return
+
+        log.debug("REFRESH: %s => %s", newfile, oldfile)
+        task = Task(Action.REPLACE, NodeType.LINK, path=newfile, source=oldfile)
+        self.tasks.add(task)
 
     def do_unlink(self, file: str) -> None:
         """
@@ -117,37 +317,42 @@ class Tasks:
 
         :param file: The link to remove.
         """
-        if file in self.link_task_for:
-            task_ref = self.link_task_for[file]
+        task_ref = self.tasks.link_task(file)
 
-            if task_ref.action == "remove":
-                log.debug(f"UNLINK: {file} (duplicates previous action)")
+        if task_ref is not None:
+            if task_ref.action == Action.REMOVE:
+                log.debug("UNLINK: %s (duplicates previous action)", file)
                 return
-            elif task_ref.action == "create":
-                log.debug(f"UNLINK: {file} (reverts previous action)")
-                self.link_task_for[file].action = "skip"
-                self.link_task_for.pop(file)
+            elif task_ref.action == Action.CREATE:
+                log.debug("UNLINK: %s (reverts previous action)", file)
+                self.tasks.remove(task_ref)
                 return
+            elif task_ref.action == Action.REPLACE:
+                # plan removing the existing link again
+                log.debug("UNLINK: %s (reverts previous replacement)", file)
+                self.tasks.remove(task_ref)
             else:
                 internal_error(f"bad task action: {task_ref.action}")
 
-        if file in self.dir_task_for and self.dir_task_for[file].action == "create":
+        dir_task = self.tasks.dir_task(file)
+
+        if dir_task is not None and dir_task.action == Action.CREATE:
             internal_error(
                 "new unlink operation clashes with planned operation:"
-                f" {self.dir_task_for[file].action} dir {file}"
+                f" {dir_task.action} dir {file}"
             )
 
-        log.debug(f"UNLINK: {file}")
+        log.debug("UNLINK: %s", file)
 
-        source = os.readlink(file)
+        source = self.filesystem.readlink(file)
 
         if source is None:
             log.error(f"could not read link: {file}")
             raise Exception(f"could not read link: {file}")
 
-        task = Task("remove", "link", path=file, source=source)
-        self.tasks.append(task)
-        self.link_task_for[file] = task
+        task = Task(Action.REMOVE, NodeType.LINK, path=file, source=source)
+        self.tasks.add(task)
+        self.removed_links.add(parts(file))
 
     def do_mkdir(self, dir: str) -> None:
         """
@@ -155,38 +360,36 @@ class Tasks:
 
         :param dir: The directory to create.
         """
-        if dir in self.link_task_for:
-            task_ref = self.link_task_for[dir]
+        task_ref = self.tasks.link_task(dir)
 
-            if task_ref.action == "create":
-                if task_ref.type_ == "link":
+        if task_ref is not None:
+            if task_ref.action in (Action.CREATE, Action.REPLACE):
+                if task_ref.type_ == NodeType.LINK:
                     internal_error(
                         f"new dir clashes with planned new link ({task_ref.path} =>"
                         f" {task_ref.source})"
                     )
-            elif task_ref.action == "remove":
+            elif task_ref.action == Action.REMOVE:
                 pass  # TODO: see GNU Stow
             else:
                 internal_error(f"bad task action: {task_ref.action}")
 
-        if dir in self.dir_task_for:
-            task_ref = self.dir_task_for[dir]
+        task_ref = self.tasks.dir_task(dir)
 
-            if task_ref.action == "create":
-                log.debug(f"MKDIR: {dir} (duplicates previous action)")
+        if task_ref is not None:
+            if task_ref.action == Action.CREATE:
+                log.debug("MKDIR: %s (duplicates previous action)", dir)
                 return
-            elif task_ref.action == "remove":
-                log.debug(f"MKDIR: {dir} (reverts previous action)")
-                self.dir_task_for[dir].action = "skip"
-                self.dir_task_for.pop(dir)
+            elif task_ref.action == Action.REMOVE:
+                log.debug("MKDIR: %s (reverts previous action)", dir)
+                self.tasks.remove(task_ref)
                 return
             else:
                 internal_error(f"bad task action: {task_ref.action}")
 
-        log.debug(f"MKDIR: {dir}")
-        task = Task("create", "dir", path=dir)
-        self.tasks.append(task)
-        self.dir_task_for[dir] = task
+        log.debug("MKDIR: %s", dir)
+        task = Task(Action.CREATE, NodeType.DIR, path=dir)
+        self.tasks.add(task)
 
     def do_rmdir(self, dir: str) -> None:
         """
@@ -194,33 +397,31 @@ class Tasks:
 
         :param dir: The directory to remove.
         """
-        if dir in self.link_task_for:
-            task_ref = self.link_task_for[dir]
+        task_ref = self.tasks.link_task(dir)
+
+        if task_ref is not None:
             internal_error(
                 f"rmdir clashes with planned operation: {task_ref.action} link"
                 f" {task_ref.path} => {task_ref.source}"
             )
 
-        if dir in self.dir_task_for:
-            task_ref = self.dir_task_for[dir]
+        task_ref = self.tasks.dir_task(dir)
 
-            if task_ref.action == "remove":
-                log.debug(f"RMDIR: {dir} (duplicates previous action)")
+        if task_ref is not None:
+            if task_ref.action == Action.REMOVE:
+                log.debug("RMDIR: %s (duplicates previous action)", dir)
                 return
-            elif task_ref.action == "create":
-                log.debug(f"RMDIR: {dir} (reverts previous action)")
-                self.dir_task_for[dir].action = (
-                    "skip"  # NOTE: GNU Stow has link_task_for here
-                )
-                self.dir_task_for.pop(dir)
+            elif task_ref.action == Action.CREATE:
+                log.debug("RMDIR: %s (reverts previous action)", dir)
+                # NOTE: GNU Stow has link_task_for here
+                self.tasks.remove(task_ref)
                 return
             else:
                 internal_error(f"bad task action: {task_ref.action}")
 
-        log.debug(f"RMDIR: {dir}")
-        task = Task("remove", "dir", path=dir)
-        self.tasks.append(task)
-        self.dir_task_for[dir] = task
+        log.debug("RMDIR: %s", dir)
+        task = Task(Action.REMOVE, NodeType.DIR, path=dir)
+        self.tasks.add(task)
 
     def do_mv(self, src: str, dst: str) -> None:
         """
@@ -229,27 +430,28 @@ class Tasks:
         :param src: The source.
         :param dst: The destination.
         """
-        if src in self.link_task_for:
+        link_task = self.tasks.link_task(src)
+        dir_task = self.tasks.dir_task(src)
+
+        if link_task is not None:
             # NOTE: GNU Stow: Should not ever happen, but not 100% sure
-            task_ref = self.link_task_for[src]
+            task_ref = link_task
             internal_error(
                 f"do_mv: pre-existing link task for {src}; action: {task_ref.action};"
                 f" source: {task_ref.source}"
             )
-        elif src in self.dir_task_for:
-            task_ref = self.dir_task_for[src]
+        elif dir_task is not None:
+            task_ref = dir_task
             internal_error(
                 f"do_mv: pre-existing dir task for {src}?!; action: {task_ref.action}"
             )
 
-        log.debug(f"MV: {src} => {dst}")
+        log.debug("MV: %s => %s", src, dst)
 
-        task = Task("move", "file", source=src, dest=dst)
-        self.tasks.append(task)
-        # FIXME: GNU Stow: do we need this for anything?
-        # self.mv_task_for[src] = task
+        task = Task(Action.MOVE, NodeType.FILE, source=src, dest=dst)
+        self.tasks.add(task)
 
-    def link_task_action(self, path) -> Optional[str]:
+    def link_task_action(self, path) -> Optional[Action]:
         """
         Determine the action for a link task.
 
@@ -257,19 +459,26 @@ class Tasks:
 
         :returns: The action.
         """
-        if path not in self.link_task_for:
-            log.debug(f"  link_task_action({path}): no task")
+        task = self.tasks.link_task(path)
+
+        if task is None:
+            log.debug("  link_task_action(%s): no task", path)
             return None
 
-        action = self.link_task_for[path].action
+        action = task.action
 
-        if action not in ["create", "remove"]:
+        if action == Action.REPLACE:
+            action = Action.CREATE  # the path holds a link either way
+
+        if action not in (Action.CREATE, Action.REMOVE):
             internal_error(f"bad task action: {action}")
 
-        log.debug(f"  link_task_action({path}): link task exists with action {action}")
+        log.debug(
+            "  link_task_action(%s): link task exists with action %s", path, action
+        )
         return action
 
-    def dir_task_action(self, path: str) -> Optional[str]:
+    def dir_task_action(self, path: str) -> Optional[Action]:
         """
         Determine the action for a dir task.
 
@@ -277,16 +486,18 @@ class Tasks:
 
         :returns: The action.
         """
-        if path not in self.dir_task_for:
-            log.debug(f"  dir_task_action({path}): no task")
+        task = self.tasks.dir_task(path)
+
+        if task is None:
+            log.debug("  dir_task_action(%s): no task", path)
             return None
 
-        action = self.dir_task_for[path].action
+        action = task.action
 
-        if action not in ["create", "remove"]:
+        if action not in (Action.CREATE, Action.REMOVE):
             internal_error(f"bad task action: {action}")
 
-        log.debug(f"  dir_task_action({path}): dir task exists with action {action}")
+        log.debug("  dir_task_action(%s): dir task exists with action %s", path, action)
         return action
 
     def read_a_link(self, path: str) -> Optional[str]:
@@ -298,19 +509,20 @@ class Tasks:
         :returns: The link target.
         """
 
-        action = self.link_task_action(path)
+        task = self.tasks.link_task(path)
 
-        if action is not None:
-            log.debug(f"  read_a_link({path}): task exists with action {action}")
+        if task is not None:
+            action = task.action
+            log.debug("  read_a_link(%s): task exists with action %s", path, action)
 
-            if action == "create":
-                return self.link_task_for[path].source
-            elif action == "remove":
+            if action in (Action.CREATE, Action.REPLACE):
+                return task.source
+            elif action == Action.REMOVE:
                 internal_error(f"link {path}: task exists with action {action}")
 
-        elif os.path.islink(path):
-            log.debug(f"  read_a_link({path}): real link")
-            target = os.readlink(path)
+        elif self.filesystem.islink(path):
+            log.debug("  read_a_link(%s): real link", path)
+            target = self.filesystem.readlink(path)
 
             if target is None or target == "":
                 log.error(f"Could not read link: {path} ()")  # TODO: error code?
@@ -328,23 +540,14 @@ class Tasks:
 
         :returns: True if a parent link is scheduled for removal, False otherwise.
         """
-        prefix = ""
-
-        for part in path.split("/"):  # NOTE: Hopefully this is correct
-            prefix = join(prefix, part)
-            log.debug(f"    parent_link_scheduled_for_removal({path}): prefix {prefix}")
-
-            if (
-                prefix in self.link_task_for
-                and self.link_task_for[prefix].action == "remove"
-            ):
-                log.debug(
-                    f"    parent_link_scheduled_for_removal({path}): link scheduled for"
-                    " removal"
-                )
-                return True
+        if self.removed_links.contains_prefix_of(parts(path)):
+            log.debug(
+                "    parent_link_scheduled_for_removal(%s): link scheduled for removal",
+                path,
+            )
+            return True
 
-        log.debug(f"    parent_link_scheduled_for_removal({path}): returning false")
+        log.debug("    parent_link_scheduled_for_removal(%s): returning false", path)
         return False
 
     def cleanup_invalid_links(self, dir: str) -> None:
@@ -353,7 +556,7 @@ class Tasks:
 
         :param dir: The directory to clean up.
         """
-        if not os.path.isdir(dir):
+        if not self.filesystem.isdir(dir):
             log.error(f"cleanup_invalid_links() called with a non-directory: {dir}")
             raise Exception(
                 f"cleanup_invalid_links() called with a non-directory: {dir}"
@@ -361,21 +564,26 @@ class Tasks:
 
         # TODO: check if dir is readable
 
-        for node in os.listdir(dir):
-            node_path = join(dir, node)
+        for node in self.filesystem.scandir(dir):
+            node_path = child(dir, node)
 
-            if os.path.islink(node_path) and node_path not in self.link_task_for:
+            if (
+                self.filesystem.islink(node_path)
+                and self.tasks.link_task(node_path) is None
+            ):
                 source = self.read_a_link(node_path)
 
                 if source is None:
                     log.error(f"Could not read link: {node_path}")
                     raise Exception(f"Could not read link: {node_path}")
 
-                if not os.path.exists(
+                if not self.filesystem.exists(
                     join(dir, source)
                 ) and self.filesystem.path_owned_by_package(node_path, source):
                     log.debug(
-                        f"--- removing stale link: {node_path} => {join(dir, source)}"
+                        "--- removing stale link: %s => %s",
+                        node_path,
+                        join(dir, source),
                     )
                     self.do_unlink(node_path)
 
@@ -388,7 +596,7 @@ class Tasks:
         :param message: The message.
         """
 
-        log.debug(f"CONFLICT when {action}ing {package}: {message}")
+        log.debug("CONFLICT when %sing %s: %s", action, package, message)
         if action not in self.conflicts:
             self.conflicts[action] = {}
         if package not in self.conflicts[action]:
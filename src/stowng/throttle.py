@@ -0,0 +1,67 @@
+import time
+import logging
+import threading
+from typing import Callable
+
+log = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Limit how many operations are started per second.
+
+    Operations are spaced evenly, ``1 / rate`` seconds apart; up to ``burst``
+    operations may start back to back after an idle period.
+
+    :param rate: The maximum number of operations per second.
+    :param burst: The number of operations allowed without waiting.
+    :param clock: Returns the current time in seconds.
+    :param sleep: Waits for the given number of seconds.
+
+    :Example:
+    >>> now = [0.0]
+    >>> limiter = RateLimiter(2, clock=lambda: now[0], sleep=lambda s: None)
+    >>> [limiter.acquire() for _ in range(3)]
+    [0.0, 0.5, 1.0]
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        if rate <= 0:
+            raise ValueError(f"invalid rate: {rate}")
+
+        if burst < 1:
+            raise ValueError(f"invalid burst: {burst}")
+
+        self._interval = 1.0 / rate
+        self._burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._next = float("-inf")
+        self.waited = 0.0
+
+    def acquire(self) -> float:
+        """
+        Wait until the next operation may start.
+
+        :returns: The number of seconds waited.
+        """
+        with self._lock:
+            now = self._clock()
+            earliest = now - (self._burst - 1) * self._interval
+            start = max(self._next, earliest)
+            self._next = start + self._interval
+
+            wait = max(0.0, start - now)
+            self.waited += wait
+
+        if wait > 0:
+            self._sleep(wait)
+
+        return wait
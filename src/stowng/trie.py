@@ -0,0 +1,76 @@
+from typing import Dict, Iterable
+
+
+class PathTrie:
+    """
+    A set of paths stored by their components.
+
+    Used to answer "is this path or one of its parents in the set?" in as
+    many dict lookups as the path has components.
+
+    :Example:
+    >>> trie = PathTrie()
+    >>> trie.add("a/b".split("/"))
+    >>> trie.contains_prefix_of("a/b/c".split("/"))
+    True
+    >>> trie.contains_prefix_of("a/bc".split("/"))
+    False
+    >>> trie.discard("a/b".split("/"))
+    >>> trie.contains_prefix_of("a/b/c".split("/"))
+    False
+    """
+
+    _MEMBER = None
+
+    def __init__(self) -> None:
+        self._root: Dict = {}
+
+    def add(self, parts: Iterable[str]) -> None:
+        """
+        Add a path.
+
+        :param parts: The components of the path.
+        """
+        node = self._root
+
+        for part in parts:
+            node = node.setdefault(part, {})
+
+        node[self._MEMBER] = True
+
+    def discard(self, parts: Iterable[str]) -> None:
+        """
+        Remove a path, if present.
+
+        :param parts: The components of the path.
+        """
+        node = self._root
+
+        for part in parts:
+            node = node.get(part)
+
+            if node is None:
+                return
+
+        node.pop(self._MEMBER, None)
+
+    def contains_prefix_of(self, parts: Iterable[str]) -> bool:
+        """
+        Determine if the path or one of its parents is in the set.
+
+        :param parts: The components of the path.
+
+        :returns: True if a prefix of the path is in the set, False otherwise.
+        """
+        node = self._root
+
+        for part in parts:
+            node = node.get(part)
+
+            if node is None:
+                return False
+
+            if self._MEMBER in node:
+                return True
+
+        return False
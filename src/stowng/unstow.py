@@ -1,11 +1,14 @@
 import os
 import logging
-from typing import List
+from typing import Callable, Dict, List, Optional, Tuple
 
 from .tasks import Tasks
 from .filesystem import Filesystem
+from .paths import child, package_path
 from .utils import adjust_dotfile, join
-from .ignore import Ignore
+from .ignore import Ignore, PackageIgnore
+from .manifest import Manifest
+from .worklist import Frame, Worklist
 
 log = logging.getLogger(__name__)
 
@@ -19,6 +22,7 @@ class Unstow:
         stow_path: str,
         dotfiles: bool = False,
         adopt: bool = False,
+        no_folding: bool = False,
         compat: bool = False,
     ):
         self._tasks = tasks
@@ -28,23 +32,46 @@ class Unstow:
         self._compat = compat
         self._dotfiles = dotfiles
         self._adopt = adopt
+        self._no_folding = no_folding
 
         self._action_count = 0
+        self._manifest: Optional[Manifest] = None
+
+        # position of every package unstowed in a single pass, and the last
+        # of them that had links removed from a directory
+        self._order: Dict[str, int] = {}
+        self._last_owner: Dict[str, int] = {}
+
+        self.worklist = Worklist()
+
+    def set_manifest(self, manifest: Optional[Manifest]) -> None:
+        """
+        Set the manifest to plan the unstow of tracked packages from.
+
+        :param manifest: The manifest, or None to always scan the packages.
+        """
+        self._manifest = manifest
 
     def plan_unstow(self, packages: List[str]) -> None:
         """
         Plan the unstow operation.
 
+        Packages tracked in the manifest are unstowed from it. If several of
+        the others have to be scanned, they are scanned together in a single
+        pass (see :meth:`_unstow_shared`).
+
         :param unstow: The list of packages to unstow.
 
         :raises Exception: If the stow directory does not contain a package named
 
         .. todo:: testing
         """
+        remaining = []
+
         for package in packages:
             path = join(self._stow_path, package)
 
-            if not os.path.isdir(path):
+            if not self._filesystem.isdir(path):
                 log.error(
                     f"The stow directory {self._stow_path} does not contain package"
                     f" {package}"
@@ -54,37 +81,314 @@ class Unstow:
                     f" {package}"
                 )
 
-            log.debug(f"Planning unstow of package {package}...")
+            if self._compat or not self._unstow_owned(package):
+                remaining.append(package)
+            else:
+                self._action_count += 1
+
+        if len(remaining) > 1 and not self._compat:
+            log.debug("Planning unstow of packages %s...", ", ".join(remaining))
+
+            self._order = {package: i for i, package in enumerate(remaining)}
+            self._last_owner = {}
+            self._unstow_shared(
+                ".",
+                remaining,
+                {p: self._ignore.for_package(self._stow_path, p) for p in remaining},
+            )
+            self.worklist.run()
+
+            log.debug("Planning unstow of packages %s... done", ", ".join(remaining))
+            self._action_count += len(remaining)
+            return
+
+        for package in remaining:
+            log.debug("Planning unstow of package %s...", package)
 
             if self._compat:
                 self._unstow_contents_orig(self._stow_path, package, ".")
             else:
-                self._unstow_contents(self._stow_path, package, ".")
+                self._unstow_contents(
+                    self._stow_path,
+                    package,
+                    ".",
+                    self._ignore.for_package(self._stow_path, package),
+                )
+            self.worklist.run()
 
-            log.debug(f"Planning unstow of package {package}... done")
+            log.debug("Planning unstow of package %s... done", package)
             self._action_count += 1
 
-    def _unstow_contents(self, stow_path: str, package: str, target: str) -> None:
+    def _unstow_owned(self, package: str) -> bool:
         """
-        Unstow the contents of a package.
+        Unstow a package by removing the links the manifest records for it,
+        without scanning the package.
+
+        Every recorded link is checked first; if any of them was changed or
+        removed since, the manifest is stale and nothing is planned.
 
         :param package: The name of the package to unstow.
+
+        :returns: True if the unstow was planned, False if the package has
+            to be scanned instead.
         """
-        path = join(stow_path, package, target)
+        if self._manifest is None or not self._manifest.tracked(package):
+            return False
+
+        links = self._manifest.owned(package)
+
+        for target, source in links:
+            if (
+                not self._filesystem.is_a_link(target)
+                or self._tasks.read_a_link(target) != source
+            ):
+                log.debug(
+                    "Manifest is stale at %s, scanning package %s", target, package
+                )
+                return False
+
+        log.debug("  unstowing %d links recorded in the manifest", len(links))
+
+        dirs = set()
+
+        for target, _ in links:
+            self._tasks.do_unlink(target)
+
+            parent = os.path.dirname(target)
+
+            while parent not in ("", ".") and parent not in dirs:
+                dirs.add(parent)
+                parent = os.path.dirname(parent)
+
+        # children first, like after a scan
+        for dir in sorted(dirs, key=lambda d: d.count("/"), reverse=True):
+            if self._filesystem.is_a_dir(dir):
+                self._refold(dir)
+
+        return True
 
+    def _unstow_shared(
+        self,
+        target: str,
+        packages: List[str],
+        ignores: Dict[str, PackageIgnore],
+    ) -> Optional[Frame]:
+        """
+        Unstow the contents of a directory shared by several packages.
+
+        Like :meth:`_unstow_contents` for each of the packages, but every
+        node of the target is probed once for all of them: the package
+        owning a link is looked up through
+        :meth:`stowng.filesystem.Filesystem.find_stowed_path`, and invalid
+        links are cleaned up and directories refolded once, after all
+        packages were unstowed from them (see :meth:`_refold_shared`).
+
+        :param target: The target directory.
+        :param packages: The packages containing the directory.
+        :param ignores: The ignore rules of every package.
+
+        :returns: The frame of the directory, or None if it is skipped.
+        """
         if self._filesystem.should_skip_target_which_is_stow_dir(target):
+            return None
+
+        if not self._filesystem.is_a_node(target):
+            log.error(f"unstow_contents() called with invalid target: {target}")
+            raise Exception(f"unstow_contents() called with invalid target: {target}")
+
+        ignores = {p: ignore.scope(target) for p, ignore in ignores.items()}
+        owners: Dict[str, List[str]] = {}
+
+        for package in packages:
+            path = package_path(self._stow_path, package, target)
+
+            if not self._filesystem.isdir(path):
+                log.error(f"unstow_contents() called with non-directory path: {path}")
+                raise Exception(
+                    f"unstow_contents() called with non-directory path: {path}"
+                )
+
+            for node in self._filesystem.scandir(path):
+                node_target = child(target, node)
+
+                if ignores[package].ignore(node_target):
+                    continue
+
+                if self._dotfiles:
+                    node_target = adjust_dotfile(node_target)
+
+                owners.setdefault(node_target, []).append(package)
+
+        log.debug("Unstowing %s from %s", ", ".join(packages), target)
+
+        def visit(item: Tuple[str, List[str]]) -> None:
+            node_target, node_packages = item
+            self._unstow_shared_node(node_target, node_packages, ignores)
+
+        def finish() -> None:
+            if self._filesystem.is_a_dir(target):
+                self._tasks.cleanup_invalid_links(target)
+
+        frame = self.worklist.push(owners.items(), visit)
+        frame.after(finish)
+        return frame
+
+    def _unstow_shared_node(
+        self,
+        target: str,
+        packages: List[str],
+        ignores: Dict[str, PackageIgnore],
+    ) -> None:
+        """
+        Unstow a node contained in several packages.
+
+        :param target: The target to unstow.
+        :param packages: The packages containing the node.
+        :param ignores: The ignore rules of every package.
+        """
+        if self._filesystem.is_a_link(target):
+            existing_source = self._tasks.read_a_link(target)
+
+            if existing_source is None:
+                log.error(f"Could not read link: {target}")
+                raise Exception(f"Could not read link: {target}")
+
+            if existing_source.startswith("/"):
+                log.warn(f"Ignoring an absolute symlink: {target} => {existing_source}")
+                return
+
+            (
+                existing_path,
+                _,
+                existing_package,
+            ) = self._filesystem.find_stowed_path(target, existing_source)
+
+            if existing_path == "":
+                for package in packages:
+                    self._tasks.conflict(
+                        "unstow",
+                        package,
+                        f"existing target is not owned by stow: {target} =>"
+                        f" {existing_source}",
+                    )
+                return
+
+            if not self._filesystem.exists(existing_path):
+                log.debug("--- removing invalid link into a stow directory: %s", target)
+                self._tasks.do_unlink(target)
+                return
+
+            if self._dotfiles:
+                existing_path = adjust_dotfile(existing_path)
+
+            if existing_package in packages and existing_path == package_path(
+                self._stow_path, existing_package, target
+            ):
+                self._tasks.do_unlink(target)
+                self._owned(target, self._order[existing_package])
+        elif self._filesystem.exists(target):
+            if self._filesystem.isdir(target):
+                frame = self._unstow_shared(
+                    target, packages, {p: ignores[p] for p in packages}
+                )
+                self._after(frame, lambda: self._refold_shared(target, packages))
+            else:
+                for package in packages:
+                    self._tasks.conflict(
+                        "unstow",
+                        package,
+                        f"existing target is neither a link nor a directory: {target}",
+                    )
+        else:
+            log.debug("%s did not exist to be unstowed", target)
+
+    def _owned(self, target: str, position: int) -> None:
+        """
+        Note that a node was removed from its directory while unstowing the
+        package at the given position.
+
+        :param target: The removed node.
+        :param position: The position of the package owning it.
+        """
+        parent = os.path.dirname(target) or "."
+        self._last_owner[parent] = max(self._last_owner.get(parent, -1), position)
+
+    def _refold_shared(self, target: str, packages: List[str]) -> None:
+        """
+        Refold a directory after unstowing several packages from it, or
+        remove it if unstowing them one by one would have.
+
+        Unstowing the packages one by one refolds the directory whenever only
+        links of a single package are left in it. If that package comes
+        later, unstowing it removes the folded link, and with it the
+        directory. That happens if the directory ends up empty, and one of
+        the packages containing it comes before the last package that had
+        links removed from it.
+
+        :param target: The directory.
+        :param packages: The packages containing the directory.
+        """
+        self._refold(target)
+
+        last = self._last_owner.get(target)
+
+        if (
+            self._no_folding
+            or last is None
+            or min(self._order[package] for package in packages) >= last
+            or not self._filesystem.is_a_dir(target)
+        ):
             return
 
-        cwd = os.getcwd()
-        msg = (  # NOTE: GNU Stow: uses self.stow_path here
-            f"Unstowing from {target} (cwd={cwd}, stow dir={stow_path})"
-        )
-        msg = msg.replace(f"{os.environ['HOME']}/", "~/")
+        for node in self._filesystem.scandir(target):
+            if self._filesystem.is_a_node(child(target, node)):
+                return
+
+        log.debug("--- Removing %s, as unstowing one by one would", target)
+        self._tasks.do_rmdir(target)
+        self._owned(target, last)
 
-        log.debug(msg)
-        log.debug(f"  source path is {path}")
+    def _unstow_contents(
+        self,
+        stow_path: str,
+        package: str,
+        target: str,
+        ignore: Optional[PackageIgnore] = None,
+    ) -> Optional[Frame]:
+        """
+        Unstow the contents of a package.
 
-        if not os.path.isdir(path):
+        The checks happen immediately, the entries are pushed onto the
+        worklist and visited when it is run.
+
+        :param package: The name of the package to unstow.
+        :param ignore: The ignore rules of the package, if already known.
+
+        :returns: The frame of the directory, or None if it is skipped.
+        """
+        path = package_path(stow_path, package, target)
+
+        if ignore is None:
+            ignore = self._ignore.for_package(stow_path, package)
+
+        ignore = ignore.scope(target)
+
+        if self._filesystem.should_skip_target_which_is_stow_dir(target):
+            return None
+
+        if log.isEnabledFor(logging.DEBUG):
+            msg = (  # NOTE: GNU Stow: uses self.stow_path here
+                f"Unstowing from {target} (cwd={os.getcwd()}, stow dir={stow_path})"
+            )
+            home = os.environ.get("HOME")
+
+            if home is not None:
+                msg = msg.replace(f"{home}/", "~/")
+
+            log.debug(msg)
+            log.debug("  source path is %s", path)
+
+        if not self._filesystem.isdir(path):
             log.error(f"unstow_contents() called with non-directory path: {path}")
             raise Exception(f"unstow_contents() called with non-directory path: {path}")
 
@@ -94,41 +398,54 @@ class Unstow:
 
         # TODO: check if dir is readable
 
-        for node in os.listdir(path):
-            node_target = join(target, node)
+        def visit(node: str) -> None:
+            node_target = child(target, node)
 
-            if self._ignore.ignore(stow_path, package, node_target):
-                continue
+            if ignore.ignore(node_target):
+                return
 
             if self._dotfiles:
                 adj_node_target = adjust_dotfile(node_target)
-                log.debug(f"  Adjusting: {node_target} => {adj_node_target}")
+                log.debug("  Adjusting: %s => %s", node_target, adj_node_target)
                 node_target = adj_node_target
 
             self._unstow_node(
                 stow_path,
                 package,
                 node_target,
+                ignore,
             )
 
-        if self._filesystem.is_a_dir(target):
-            self._tasks.cleanup_invalid_links(target)
+        def finish() -> None:
+            if self._filesystem.is_a_dir(target):
+                self._tasks.cleanup_invalid_links(target)
+
+        frame = self.worklist.push(self._filesystem.scandir(path), visit)
+        frame.after(finish)
+        return frame
 
-    def _unstow_node(self, stow_path: str, package: str, target: str) -> None:
+    def _unstow_node(
+        self,
+        stow_path: str,
+        package: str,
+        target: str,
+        ignore: Optional[PackageIgnore] = None,
+    ) -> None:
         """
         Unstow a node.
 
         :param stow_path: The path to the stow directory.
         :param package: The name of the package.
         :param target: The target to unstow.
+        :param ignore: The ignore rules of the package, if already known.
         """
-        path = join(stow_path, package, target)
+        path = package_path(stow_path, package, target)
 
-        log.debug(f"Unstowing {path}")
-        log.debug(f"  target is {target}")
+        log.debug("Unstowing %s", path)
+        log.debug("  target is %s", target)
 
         if self._filesystem.is_a_link(target):
-            log.debug(f"  Evaluate existing link: {target}")
+            log.debug("  Evaluate existing link: %s", target)
 
             existing_source = self._tasks.read_a_link(target)
 
@@ -153,30 +470,26 @@ class Unstow:
                 )
                 return
 
-            if os.path.exists(existing_path):
+            if self._filesystem.exists(existing_path):
                 if self._dotfiles:
                     existing_path = adjust_dotfile(existing_path)
 
                 if existing_path == path:
                     self._tasks.do_unlink(target)
             else:
-                log.debug(f"--- removing invalid link into a stow directory: {path}")
+                log.debug("--- removing invalid link into a stow directory: %s", path)
                 self._tasks.do_unlink(target)
-        elif os.path.exists(target):
-            log.debug(f"  Evaluate existing node: {target}")
+        elif self._filesystem.exists(target):
+            log.debug("  Evaluate existing node: %s", target)
 
-            if os.path.isdir(target):
-                self._unstow_contents(
+            if self._filesystem.isdir(target):
+                frame = self._unstow_contents(
                     self._stow_path,
                     package,
                     target,
+                    ignore,
                 )
-
-                parent = self._filesystem.foldable(target)
-
-                if parent is not None:
-                    self._filesystem.fold_tree(target, parent)
-
+                self._after(frame, lambda: self._refold(target))
             else:
                 self._tasks.conflict(
                     "unstow",
@@ -184,21 +497,90 @@ class Unstow:
                     f"existing target is neither a link nor a directory: {target}",
                 )
         else:
-            log.debug(f"{target} did not exist to be unstowed")
+            log.debug("%s did not exist to be unstowed", target)
 
-    def _unstow_contents_orig(self, stow_path: str, package: str, target: str) -> None:
+    def _refold(self, target: str) -> None:
         """
-        Unstow the contents of a package.
+        Fold a directory back into a link if unstowing made that possible.
+
+        :param target: The directory to check.
+        """
+        parent = self._filesystem.foldable(target)
+
+        if parent is not None:
+            self._filesystem.fold_tree(target, parent)
+
+    @staticmethod
+    def _after(frame: Optional[Frame], callback: Callable[[], None]) -> None:
+        """
+        Run a callback once a frame is done, or now if there is no frame.
+
+        :param frame: The frame, or None.
+        :param callback: The callback.
+        """
+        if frame is None:
+            callback()
+        else:
+            frame.after(callback)
+
+    def _unstow_contents_orig(
+        self, stow_path: str, package: str, target: str
+    ) -> Optional[Frame]:
+        """
+        Unstow the contents of a target directory (compat mode).
 
+        Unlike :meth:`_unstow_contents`, this walks the target tree instead
+        of the package tree.
+
+        :param stow_path: The path to the stow directory.
         :param package: The name of the package to unstow.
+        :param target: The target directory.
+
+        :returns: The frame of the directory, or None if it is skipped.
         """
-        path = join(stow_path, package, target)
+        path = package_path(stow_path, package, target)
+
+        if self._filesystem.should_skip_target_which_is_stow_dir(target):
+            return None
 
-        log.debug(f"Unstowing {target} (compat mode)")
-        log.debug(f"  source path is {path}")
+        log.debug("Unstowing %s (compat mode)", target)
+        log.debug("  source path is %s", path)
+
+        if not self._filesystem.is_a_dir(target):
+            log.error(f"unstow_contents_orig() called on a non-directory: {target}")
+            raise Exception(
+                f"unstow_contents_orig() called on a non-directory: {target}"
+            )
+
+        # TODO: check if dir is readable
+
+        ignore = self._ignore.for_package(stow_path, package).scope(target)
+
+        def visit(node: str) -> None:
+            node_target = child(target, node)
+
+            if ignore.ignore(node_target):
+                return
+
+            self._unstow_node_orig(stow_path, package, node_target)
+
+        return self.worklist.push(self._filesystem.scandir(target), visit)
+
+    def _unstow_node_orig(self, stow_path: str, package: str, target: str) -> None:
+        """
+        Unstow a node (compat mode).
+
+        :param stow_path: The path to the stow directory.
+        :param package: The name of the package.
+        :param target: The target to unstow.
+        """
+        path = package_path(stow_path, package, target)
+
+        log.debug("Unstowing %s (compat mode)", target)
+        log.debug("  source path is %s", path)
 
         if self._filesystem.is_a_link(target):
-            log.debug(f"  Evaluate existing link: {target}")
+            log.debug("  Evaluate existing link: %s", target)
 
             existing_source = self._tasks.read_a_link(target)
 
@@ -213,32 +595,27 @@ class Unstow:
             if existing_path == "":
                 return
 
-            if os.path.exists(existing_path):
+            if self._filesystem.exists(existing_path):
                 if existing_path == path:
                     self._tasks.do_unlink(target)
                 elif self._filesystem.override(target):
-                    log.debug(f"--- overriding installation of: {target}")
+                    log.debug("--- overriding installation of: %s", target)
                     self._tasks.do_unlink(target)
             else:
-                log.debug(f"--- removing invalid link into stow directory: {path}")
+                log.debug("--- removing invalid link into stow directory: %s", path)
                 self._tasks.do_unlink(target)
-        elif os.path.isdir(target):
-            self._unstow_contents_orig(
+        elif self._filesystem.is_a_dir(target):
+            frame = self._unstow_contents_orig(
                 stow_path,
                 package,
                 target,
             )
-
-            parent = self._filesystem.foldable(target)
-
-            if parent is not None:
-                self._filesystem.fold_tree(target, parent)
-
-        elif os.path.exists(target):
+            self._after(frame, lambda: self._refold(target))
+        elif self._filesystem.is_a_node(target):
             self._tasks.conflict(
                 "unstow",
                 package,
                 f"existing target is neither a link nor a directory: {target}",
             )
         else:
-            log.debug(f"{target} did not exist to be unstowed")
+            log.debug("%s did not exist to be unstowed", target)
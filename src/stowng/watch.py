@@ -0,0 +1,373 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from .paths import child
+
+log = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# only changes of the entries matter, links do not care about file contents
+WATCH_MASK = (
+    IN_CREATE
+    | IN_DELETE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+)
+
+DEBOUNCE = 0.2
+MAX_DELAY = 2.0
+
+_EVENT = struct.Struct("iIII")
+
+_libc = None
+
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+    global _libc
+
+    if _libc is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            libc.inotify_init1
+        except (OSError, AttributeError):
+            return None
+
+        _libc = libc
+
+    return _libc
+
+
+def inotify_supported() -> bool:
+    """
+    Determine if inotify is available.
+
+    :returns: True if inotify can be used, False otherwise.
+    """
+    return _load_libc() is not None
+
+
+class Inotify:
+    """
+    A minimal inotify instance, using the C library through :mod:`ctypes`.
+
+    :raises OSError: If inotify is not available.
+    """
+
+    def __init__(self) -> None:
+        libc = _load_libc()
+
+        if libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        """
+        Watch a directory.
+
+        Watching a directory that is already watched, e.g. after it was
+        moved, returns the same descriptor.
+
+        :param path: The directory.
+        :param mask: The events to watch for.
+
+        :returns: The watch descriptor.
+
+        :raises OSError: If the directory cannot be watched.
+        """
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        """
+        Stop watching a directory.
+
+        :param wd: The watch descriptor.
+        """
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout: Optional[float] = None) -> Iterator[Tuple[int, int, str]]:
+        """
+        Wait for events.
+
+        :param timeout: The maximum number of seconds to wait, or None to
+            wait until there are events.
+
+        :returns: The watch descriptor, mask and name of every event.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+
+        if not readable:
+            return
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        offset = 0
+
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            yield wd, mask, name
+
+    def close(self) -> None:
+        """
+        Close the inotify instance.
+        """
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def topmost(dirs: Set[str]) -> List[str]:
+    """
+    Remove the directories that are below another one.
+
+    :param dirs: The directories, relative paths with ``.`` for the root.
+
+    :returns: The remaining directories, sorted.
+
+    :Example:
+    >>> topmost({"a/b", "a", "c/d", "c/e"})
+    ['a', 'c/d', 'c/e']
+    >>> topmost({"a", "."})
+    ['.']
+    """
+    if "." in dirs:
+        return ["."]
+
+    result: List[str] = []
+
+    for dir in sorted(dirs):
+        if not result or not dir.startswith(result[-1] + "/"):
+            result.append(dir)
+
+    return result
+
+
+class Watcher:
+    """
+    Watch packages and restow the directories that change.
+
+    Every directory of the packages is watched for entries being created,
+    removed or renamed. Events are coalesced into the set of changed
+    directories per package, and a batch is applied once no event arrived
+    for ``debounce`` seconds, or at the latest ``max_delay`` seconds after
+    the first event of the batch, so bursts like a ``git checkout`` become
+    one plan. Files written to are only reported with ``contents``, for
+    targets holding copies of the package files instead of symlinks.
+
+    :param stow_dir: The path of the stow directory.
+    :param packages: The packages to watch.
+    :param apply: Called with the changed directories of every changed
+        package, relative to the package.
+    :param debounce: The number of quiet seconds ending a batch.
+    :param max_delay: The maximum number of seconds a batch is delayed.
+    :param clock: Returns the current time in seconds.
+    :param contents: Whether files written to change their directory.
+    """
+
+    def __init__(
+        self,
+        stow_dir: str,
+        packages: List[str],
+        apply: Callable[[Dict[str, List[str]]], None],
+        debounce: float = DEBOUNCE,
+        max_delay: float = MAX_DELAY,
+        clock: Callable[[], float] = time.monotonic,
+        contents: bool = False,
+    ) -> None:
+        self._stow_dir = stow_dir
+        self._packages = packages
+        self._apply = apply
+        self._debounce = debounce
+        self._max_delay = max_delay
+        self._clock = clock
+        self._mask = WATCH_MASK | IN_CLOSE_WRITE if contents else WATCH_MASK
+
+        self._inotify = Inotify()
+        self._watches: Dict[int, Tuple[str, str]] = {}
+        self._pending: Dict[str, Set[str]] = {}
+
+        for package in packages:
+            self._watch_tree(package, ".")
+
+        log.debug("Watching %d directories", len(self._watches))
+
+    def _path(self, package: str, dir: str) -> str:
+        path = os.path.join(self._stow_dir, package)
+        return path if dir == "." else os.path.join(path, dir)
+
+    def _watch_tree(self, package: str, dir: str) -> None:
+        """
+        Watch a package directory and all directories below it.
+
+        :param package: The package.
+        :param dir: The directory, relative to the package.
+        """
+        stack = [dir]
+
+        while stack:
+            dir = stack.pop()
+
+            try:
+                wd = self._inotify.add_watch(self._path(package, dir), self._mask)
+            except OSError as e:
+                # removed again, or not a directory
+                log.debug("Cannot watch %s in %s: %s", dir, package, e)
+                continue
+
+            self._watches[wd] = (package, dir)
+
+            try:
+                with os.scandir(self._path(package, dir)) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(child(dir, entry.name))
+            except OSError:
+                continue
+
+    def _unwatch_tree(self, package: str, dir: str) -> None:
+        """
+        Stop watching a package directory and all directories below it.
+
+        :param package: The package.
+        :param dir: The directory, relative to the package.
+        """
+        for wd, (p, d) in list(self._watches.items()):
+            if p == package and (d == dir or d.startswith(dir + "/")):
+                self._inotify.rm_watch(wd)
+                del self._watches[wd]
+
+    def _changed(self, package: str, dir: str) -> None:
+        self._pending.setdefault(package, set()).add(dir)
+
+    def handle(self, wd: int, mask: int, name: str) -> None:
+        """
+        Record a single event.
+
+        :param wd: The watch descriptor.
+        :param mask: The event mask.
+        :param name: The name of the entry, if the event is about one.
+        """
+        if mask & IN_Q_OVERFLOW:
+            log.warning("Missed events, restowing all watched packages")
+
+            for package in self._packages:
+                self._changed(package, ".")
+            return
+
+        if wd not in self._watches:
+            return
+
+        package, dir = self._watches[wd]
+
+        if mask & IN_IGNORED:
+            del self._watches[wd]
+            return
+
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            # reported by the parent as well
+            return
+
+        log.debug("Changed %s in %s of %s", name, dir, package)
+        self._changed(package, dir)
+
+        if mask & IN_ISDIR:
+            # a moved directory keeps its watches, which have to be mapped
+            # to the new path, if it is still inside a package
+            if mask & IN_MOVED_FROM:
+                self._unwatch_tree(package, child(dir, name))
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(package, child(dir, name))
+
+    def run(self, batches: Optional[int] = None) -> None:
+        """
+        Watch and apply the changes until interrupted.
+
+        :param batches: The number of batches to apply before returning, or
+            None to run forever.
+        """
+        first = last = 0.0
+
+        while batches is None or batches > 0:
+            timeout = None
+
+            if self._pending:
+                deadline = min(last + self._debounce, first + self._max_delay)
+                timeout = max(0.0, deadline - self._clock())
+
+            for wd, mask, name in self._inotify.read(timeout):
+                now = self._clock()
+
+                if not self._pending:
+                    first = now
+
+                last = now
+                self.handle(wd, mask, name)
+
+            if not self._pending:
+                continue
+
+            now = self._clock()
+
+            if now < last + self._debounce and now < first + self._max_delay:
+                continue
+
+            changes = {
+                package: topmost(dirs) for package, dirs in self._pending.items()
+            }
+            self._pending = {}
+
+            log.debug("Restowing changes in %s", ", ".join(sorted(changes.keys())))
+            self._apply(changes)
+
+            if batches is not None:
+                batches -= 1
+
+    def close(self) -> None:
+        """
+        Stop watching.
+        """
+        self._inotify.close()
@@ -0,0 +1,130 @@
+import logging
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+log = logging.getLogger(__name__)
+
+MAX_STREAMING_FRAMES = 64
+
+_END = object()
+
+
+class Frame:
+    """
+    A directory whose entries are waiting to be visited.
+
+    :param entries: The entries of the directory.
+    :param visit: Called with every entry.
+    """
+
+    __slots__ = ("entries", "visit", "finish")
+
+    def __init__(self, entries: Iterator[Any], visit: Callable[[Any], None]) -> None:
+        self.entries = entries
+        self.visit = visit
+        self.finish: List[Callable[[], None]] = []
+
+    def after(self, callback: Callable[[], None]) -> None:
+        """
+        Register a callback to run once all entries have been visited.
+
+        Callbacks run in the order they were registered.
+
+        :param callback: The callback.
+        """
+        self.finish.append(callback)
+
+
+class Worklist:
+    """
+    An explicit stack driving a depth-first planner traversal.
+
+    Visiting an entry may push new frames. Frames pushed while visiting one
+    entry are processed in the order they were pushed and before the
+    remaining entries of the current frame, which gives exactly the order a
+    recursive traversal would have, without using Python frames per level.
+
+    Only the innermost ``max_streaming`` frames stream their entries; deeper
+    frames read them eagerly, so the number of open directory handles stays
+    bounded no matter how deep the tree is.
+
+    :param max_streaming: The number of frames allowed to stream entries.
+
+    :Example:
+    >>> order = []
+    >>> worklist = Worklist()
+    >>> def visit(item):
+    ...     order.append(item)
+    ...     if item == "a":
+    ...         worklist.push(["a/1", "a/2"], visit).after(lambda: order.append("a!"))
+    >>> _ = worklist.push(["a", "b"], visit)
+    >>> worklist.run()
+    >>> order
+    ['a', 'a/1', 'a/2', 'a!', 'b']
+    """
+
+    def __init__(self, max_streaming: int = MAX_STREAMING_FRAMES) -> None:
+        self._max_streaming = max_streaming
+        self.frames: List[Frame] = []
+        self._pushed: List[Frame] = []
+
+    def __len__(self) -> int:
+        return len(self.frames) + len(self._pushed)
+
+    def push(self, entries: Iterable[Any], visit: Callable[[Any], None]) -> Frame:
+        """
+        Schedule the entries of a directory for visiting.
+
+        :param entries: The entries of the directory.
+        :param visit: Called with every entry.
+
+        :returns: The new frame.
+        """
+        if len(self) >= self._max_streaming:
+            entries = list(entries)
+
+        frame = Frame(iter(entries), visit)
+        self._pushed.append(frame)
+        return frame
+
+    def step(self) -> bool:
+        """
+        Visit the next entry, or finish the current frame.
+
+        :returns: True if there may be more work, False if the list is empty.
+        """
+        self._schedule_pushed()
+
+        if not self.frames:
+            return False
+
+        frame = self.frames[-1]
+        entry = next(frame.entries, _END)
+
+        if entry is _END:
+            self.frames.pop()
+
+            for callback in frame.finish:
+                callback()
+        else:
+            frame.visit(entry)
+
+        return True
+
+    def run(self, limit: Optional[int] = None) -> None:
+        """
+        Process the worklist.
+
+        :param limit: The maximum number of steps to take, or None to run
+            until the list is empty.
+        """
+        steps = 0
+
+        while (limit is None or steps < limit) and self.step():
+            steps += 1
+
+        self._schedule_pushed()
+
+    def _schedule_pushed(self) -> None:
+        if self._pushed:
+            self.frames.extend(reversed(self._pushed))
+            self._pushed.clear()
@@ -0,0 +1,27 @@
+import pytest
+
+from utils import (
+    delete_dir,
+    path_exists,
+    change_dir,
+    get_cwd,
+    make_path,
+)
+
+TEST_DIR = "stowng_test"
+
+
+@pytest.fixture(autouse=True)
+def test_wrapper():
+    new_cwd = f"{TEST_DIR}/target"
+    old_cwd = get_cwd()
+
+    make_path(new_cwd)
+    assert path_exists(new_cwd)
+    change_dir(new_cwd)
+
+    yield
+
+    change_dir(old_cwd)
+    delete_dir(TEST_DIR)
+    assert not path_exists(TEST_DIR)
@@ -0,0 +1,73 @@
+import os
+import errno
+
+import pytest
+
+from stowng.adopt import Adopter, copy_file
+from stowng.farmer import Farmer
+
+from utils import (
+    cat_file,
+    make_file,
+    make_path,
+    path_exists,
+    readlink,
+)
+
+
+def test_copy_file_keeps_content_and_mode():
+    make_file("file1", "x" * 100000)
+    os.chmod("file1", 0o640)
+    os.utime("file1", (1000000000, 1000000000))
+    make_file("copy1", "old")
+
+    copy_file("file1", "copy1")
+
+    assert cat_file("copy1") == "x" * 100000
+    assert os.stat("copy1").st_mode & 0o777 == 0o640
+    assert os.stat("copy1").st_mtime == 1000000000
+    assert sorted(os.listdir(".")) == ["copy1", "file1"]
+
+
+@pytest.mark.parametrize("dir_fd", [False, True])
+def test_adopt_across_devices(monkeypatch, dir_fd):
+    renames = []
+
+    def rename(src, dst, **kwargs):
+        renames.append(src)
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    make_path("bin2")
+    make_path("../stow/pkg2/bin2")
+
+    for i in range(3):
+        make_file(f"bin2/file{i}", f"target{i}")
+        make_file(f"../stow/pkg2/bin2/file{i}", "stow")
+
+    farmer = Farmer(
+        dir="../stow", target=".", test_mode=True, adopt=True, dir_fd=dir_fd
+    )
+    farmer.plan_stow(["pkg2"])
+
+    monkeypatch.setattr(os, "rename", rename)
+    farmer.process_tasks()
+
+    assert len(renames) == 1
+
+    for i in range(3):
+        assert readlink(f"bin2/file{i}") == f"../../stow/pkg2/bin2/file{i}"
+        assert cat_file(f"../stow/pkg2/bin2/file{i}") == f"target{i}"
+
+    assert sorted(os.listdir("../stow/pkg2/bin2")) == ["file0", "file1", "file2"]
+
+
+def test_adopter_renames_on_same_device():
+    make_path("a")
+    make_path("b")
+    make_file("a/file3", "target")
+    inode = os.stat("a/file3").st_ino
+
+    Adopter().move("a/file3", "b/file3")
+
+    assert not path_exists("a/file3")
+    assert os.stat("b/file3").st_ino == inode
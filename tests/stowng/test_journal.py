@@ -0,0 +1,100 @@
+import pytest
+
+from stowng.executor import Executor
+from stowng.farmer import Farmer
+from stowng.journal import Journal
+from stowng.task import Action, NodeType, Task
+
+from utils import (
+    make_file,
+    make_path,
+    path_exists,
+    readlink,
+)
+
+
+def test_resume_interrupted_run(monkeypatch):
+    make_path("../stow/pkg1")
+
+    for i in range(10):
+        make_file(f"../stow/pkg1/file{i}")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, journal=True)
+    farmer.plan_stow(["pkg1"])
+
+    process = Executor._process
+
+    def interrupt(self, index, task):
+        if index == 6:
+            raise KeyboardInterrupt()
+        process(self, index, task)
+
+    monkeypatch.setattr(Executor, "_process", interrupt)
+
+    with pytest.raises(KeyboardInterrupt):
+        farmer.process_tasks()
+
+    assert path_exists("../stow/.stowng-journal")
+    assert not path_exists("file9")
+
+    monkeypatch.setattr(Executor, "_process", process)
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, journal=True)
+    farmer.resume_tasks()
+
+    for i in range(10):
+        assert readlink(f"file{i}") == f"../stow/pkg1/file{i}"
+
+    assert not path_exists("../stow/.stowng-journal")
+
+
+def test_resume_skips_applied_tasks(monkeypatch):
+    make_path("../stow/pkg2")
+    make_file("../stow/pkg2/file")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, journal=True)
+    farmer.plan_stow(["pkg2"])
+
+    def interrupt(self, tasks, on_done=None):
+        next(iter(tasks)).process()  # applied, but never recorded
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(Executor, "run", interrupt)
+
+    with pytest.raises(KeyboardInterrupt):
+        farmer.process_tasks()
+
+    monkeypatch.undo()
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, journal=True)
+    farmer.resume_tasks()
+
+    assert readlink("file") == "../stow/pkg2/file"
+    assert not path_exists("../stow/.stowng-journal")
+
+
+def test_resume_over_torn_line():
+    tasks = [
+        Task(Action.CREATE, NodeType.LINK, path=f"file{i}", source=f"s/file{i}")
+        for i in range(20)
+    ]
+
+    journal = Journal("journal")
+    journal.start(tasks)
+    journal.record(0)
+    journal.record(1)
+    journal.close()
+
+    # the interruption cut off the index 12
+    with open("journal", "a") as f:
+        f.write("1")
+
+    journal = Journal("journal")
+    _, done = journal.resume()
+    assert done == {0, 1}
+
+    journal.record(5)
+    journal.close()
+
+    _, done = Journal("journal").resume()
+    assert done == {0, 1, 5}
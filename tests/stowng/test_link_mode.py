@@ -0,0 +1,104 @@
+import os
+
+import pytest
+
+from stowng.farmer import Farmer
+from stowng.manifest import Manifest
+from stowng.materialize import LinkMode
+from stowng.task import Action
+
+from utils import (
+    cat_file,
+    dir_exists,
+    link_exists,
+    make_file,
+    make_path,
+    path_exists,
+)
+
+
+@pytest.mark.parametrize(
+    "link_mode", [LinkMode.HARDLINK, LinkMode.REFLINK, LinkMode.COPY]
+)
+def test_stow_and_unstow_without_symlinks(link_mode):
+    make_path("../stow/pkg1/bin1")
+    make_file("../stow/pkg1/bin1/file1", "content1")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, link_mode=link_mode)
+    farmer.plan_stow(["pkg1"])
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert dir_exists("bin1")
+    assert not link_exists("bin1")
+    assert not link_exists("bin1/file1")
+    assert cat_file("bin1/file1") == "content1"
+
+    same = os.path.samefile("bin1/file1", "../stow/pkg1/bin1/file1")
+    assert same == (link_mode == LinkMode.HARDLINK)
+
+    # the manifest is picked up without asking for a link mode again
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer.plan_unstow(["pkg1"])
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert dir_exists("bin1")
+    assert not path_exists("bin1/file1")
+    assert path_exists("../stow/pkg1/bin1/file1")
+    assert Manifest("../stow/.stowng-manifest", os.getcwd()).links() == {}
+
+
+def test_restow_without_symlinks_is_a_no_op():
+    make_path("../stow/pkg2")
+    make_file("../stow/pkg2/file2")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, link_mode=LinkMode.COPY)
+    farmer.plan_stow(["pkg2"])
+    farmer.process_tasks()
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, link_mode=LinkMode.COPY)
+    farmer.plan_unstow(["pkg2"])
+    farmer.plan_stow(["pkg2"])
+
+    assert farmer.get_conflict_count() == 0
+    assert farmer.get_task_count() == 0
+
+
+def test_unowned_file_still_conflicts():
+    make_path("../stow/pkg3")
+    make_file("../stow/pkg3/file3")
+    make_file("file3")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, link_mode=LinkMode.COPY)
+    farmer.plan_stow(["pkg3"])
+
+    assert farmer.get_conflict_count() == 1
+
+
+@pytest.mark.parametrize("link_mode", [LinkMode.HARDLINK, LinkMode.COPY])
+def test_restow_refreshes_changed_files(link_mode):
+    make_path("../stow/pkg4")
+    make_file("../stow/pkg4/file4", "old")
+    make_file("../stow/pkg4/same4", "same")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, link_mode=link_mode)
+    farmer.plan_restow(["pkg4"])
+    farmer.process_tasks()
+
+    # replaced rather than edited, so hard links are stale as well
+    os.unlink("../stow/pkg4/file4")
+    make_file("../stow/pkg4/file4", "changed")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, link_mode=link_mode)
+    farmer.plan_restow(["pkg4"])
+
+    assert [(t.action, t.path) for t in farmer._tasks.tasks] == [
+        (Action.REPLACE, "file4")
+    ]
+
+    farmer.process_tasks()
+
+    assert cat_file("file4") == "changed"
+    assert cat_file("same4") == "same"
+    assert not link_exists("file4")
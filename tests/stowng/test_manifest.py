@@ -0,0 +1,120 @@
+import os
+
+from stowng.farmer import Farmer
+from stowng.filesystem import Filesystem
+from stowng.manifest import Manifest
+
+from utils import (
+    dir_exists,
+    link_exists,
+    make_file,
+    make_path,
+    path_exists,
+    readlink,
+    record_calls,
+)
+
+
+def test_unstow_from_manifest_without_scanning(monkeypatch):
+    make_path("../stow/pkg1/bin1")
+    make_file("../stow/pkg1/bin1/file1")
+    make_path("bin1")
+    make_file("bin1/own")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, manifest=True)
+    farmer.plan_stow(["pkg1"])
+    farmer.process_tasks()
+
+    manifest = Manifest("../stow/.stowng-manifest", os.getcwd())
+    assert manifest.tracked("pkg1")
+    assert manifest.owned("pkg1") == [("bin1/file1", "../../stow/pkg1/bin1/file1")]
+
+    scanned = record_calls(monkeypatch, Filesystem, "scandir")
+
+    # the manifest is picked up without asking for it again
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer.plan_unstow(["pkg1"])
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert not any(path.startswith("../stow/pkg1") for path in scanned)
+    assert not link_exists("bin1/file1")
+    assert path_exists("bin1/own")
+    assert manifest.owned("pkg1") == []
+
+
+def test_unstow_falls_back_to_scan_if_manifest_is_stale(monkeypatch):
+    make_path("../stow/pkg2/bin2")
+    make_file("../stow/pkg2/bin2/file2")
+    make_file("../stow/pkg2/bin2/file3")
+    make_path("bin2")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, manifest=True)
+    farmer.plan_stow(["pkg2"])
+    farmer.process_tasks()
+
+    # removed behind stowng's back
+    os.unlink("bin2/file2")
+
+    scanned = record_calls(monkeypatch, Filesystem, "scandir")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer.plan_unstow(["pkg2"])
+    farmer.process_tasks()
+
+    assert "../stow/pkg2" in scanned
+    assert farmer.get_conflict_count() == 0
+    assert not link_exists("bin2/file3")
+
+
+def test_restow_tracks_existing_links(monkeypatch):
+    make_path("../stow/pkg3/bin3")
+    make_file("../stow/pkg3/bin3/file3")
+    make_path("bin3")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer.plan_stow(["pkg3"])
+    farmer.process_tasks()
+
+    assert not path_exists("../stow/.stowng-manifest")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, manifest=True)
+    farmer.plan_unstow(["pkg3"])
+    farmer.plan_stow(["pkg3"])
+    farmer.process_tasks()
+
+    assert farmer.get_task_count() == 0
+    assert readlink("bin3/file3") == "../../stow/pkg3/bin3/file3"
+
+    scanned = record_calls(monkeypatch, Filesystem, "scandir")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer.plan_unstow(["pkg3"])
+    farmer.process_tasks()
+
+    assert not any(path.startswith("../stow/pkg3") for path in scanned)
+    assert not link_exists("bin3/file3")
+
+
+def test_unstow_from_manifest_refolds_directories():
+    make_path("../stow/pkg4a/share4")
+    make_file("../stow/pkg4a/share4/a")
+    make_path("../stow/pkg4b/share4")
+    make_file("../stow/pkg4b/share4/b")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, manifest=True)
+    farmer.plan_stow(["pkg4a", "pkg4b"])
+    farmer.process_tasks()
+
+    assert dir_exists("share4")
+    assert not link_exists("share4")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer.plan_unstow(["pkg4b"])
+    farmer.process_tasks()
+
+    assert readlink("share4") == "../stow/pkg4a/share4"
+
+    manifest = Manifest("../stow/.stowng-manifest", os.getcwd())
+    assert manifest.owned("pkg4a") == [("share4", "../stow/pkg4a/share4")]
+    assert manifest.owned("pkg4b") == []
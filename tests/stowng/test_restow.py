@@ -0,0 +1,170 @@
+import os
+
+import pytest
+
+from stowng.farmer import Farmer
+from stowng.filesystem import Filesystem
+
+from utils import (
+    link_exists,
+    make_file,
+    make_link,
+    make_path,
+    readlink,
+    record_calls,
+)
+
+
+def restow(packages):
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, manifest=True)
+    farmer.plan_restow(packages)
+    farmer.process_tasks()
+    return farmer
+
+
+def test_restow_of_unchanged_package_is_skipped(monkeypatch):
+    make_path("../stow/pkg1/bin1/sub1")
+    make_file("../stow/pkg1/bin1/sub1/file1")
+    make_path("bin1")
+
+    restow(["pkg1"])
+
+    assert readlink("bin1/sub1") == "../../stow/pkg1/bin1/sub1"
+
+    scanned = record_calls(monkeypatch, Filesystem, "scandir")
+    farmer = restow(["pkg1"])
+
+    assert farmer.get_task_count() == 0
+    assert scanned == []
+
+
+def test_restow_only_replans_changed_directories(monkeypatch):
+    make_path("../stow/pkg2/bin2/a")
+    make_path("../stow/pkg2/bin2/b")
+    make_file("../stow/pkg2/bin2/a/file")
+    make_file("../stow/pkg2/bin2/b/file")
+    make_path("bin2/a")
+    make_path("bin2/b")
+
+    restow(["pkg2"])
+
+    make_file("../stow/pkg2/bin2/b/new")
+
+    scanned = record_calls(monkeypatch, Filesystem, "scandir")
+    farmer = restow(["pkg2"])
+
+    assert farmer.get_conflict_count() == 0
+    assert readlink("bin2/b/new") == "../../../stow/pkg2/bin2/b/new"
+    assert readlink("bin2/a/file") == "../../../stow/pkg2/bin2/a/file"
+    assert scanned and all(path.endswith("bin2/b") for path in scanned)
+
+
+def test_restow_after_unstow_is_not_skipped():
+    make_path("../stow/pkg3/bin3")
+    make_file("../stow/pkg3/bin3/file3")
+    make_path("bin3")
+
+    restow(["pkg3"])
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer.plan_unstow(["pkg3"])
+    farmer.process_tasks()
+
+    assert not link_exists("bin3/file3")
+
+    restow(["pkg3"])
+
+    assert readlink("bin3/file3") == "../../stow/pkg3/bin3/file3"
+
+
+def test_restow_plans_only_the_delta():
+    make_path("../stow/pkg4/bin4")
+    make_file("../stow/pkg4/bin4/keep")
+    make_file("../stow/pkg4/bin4/old")
+    make_file("../stow/pkg4/bin4/other")
+    make_path("bin4")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer.plan_stow(["pkg4"])
+    farmer.process_tasks()
+
+    os.rename("../stow/pkg4/bin4/old", "../stow/pkg4/bin4/new")
+    os.unlink("bin4/other")
+    make_link("bin4/other", "../../stow/pkg4/bin4/keep")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer.plan_restow(["pkg4"])
+
+    actions = sorted((str(t.action), t.path) for t in farmer._tasks.tasks)
+    assert actions == [
+        ("create", "bin4/new"),
+        ("remove", "bin4/old"),
+        ("replace", "bin4/other"),
+    ]
+
+    farmer.process_tasks()
+
+    # the directory is not folded, although only pkg4 uses it
+    assert not link_exists("bin4")
+    assert readlink("bin4/keep") == "../../stow/pkg4/bin4/keep"
+    assert readlink("bin4/new") == "../../stow/pkg4/bin4/new"
+    assert readlink("bin4/other") == "../../stow/pkg4/bin4/other"
+    assert not link_exists("bin4/old")
+
+
+@pytest.mark.parametrize("no_folding", [False, True])
+def test_restow_of_packages_sharing_a_directory_into_empty_target(no_folding):
+    packages = ["pkg5", "pkg6", "pkg7"]
+
+    for package in packages:
+        make_path(f"../stow/{package}/bin5")
+        make_file(f"../stow/{package}/bin5/{package}")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, no_folding=no_folding)
+    farmer.plan_restow(packages)
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert not link_exists("bin5")
+
+    for package in packages:
+        assert readlink(f"bin5/{package}") == f"../../stow/{package}/bin5/{package}"
+
+
+def test_restow_with_changed_options_is_not_skipped():
+    make_path("../stow/pkg8/dot-config8")
+    make_file("../stow/pkg8/dot-config8/file8")
+
+    restow(["pkg8"])
+
+    assert readlink("dot-config8") == "../stow/pkg8/dot-config8"
+
+    farmer = Farmer(
+        dir="../stow", target=".", test_mode=True, manifest=True, dotfiles=True
+    )
+    farmer.plan_restow(["pkg8"])
+    farmer.process_tasks()
+
+    assert not link_exists("dot-config8")
+    assert readlink(".config8") == "../stow/pkg8/dot-config8"
+
+
+def test_restow_after_editing_ignore_file_is_not_skipped():
+    make_path("../stow/pkg9/bin9")
+    make_file("../stow/pkg9/bin9/keep")
+    make_file("../stow/pkg9/bin9/skip")
+    make_file("../stow/pkg9/.stow-local-ignore", "nothing\n")
+    make_path("bin9")
+
+    restow(["pkg9"])
+
+    assert readlink("bin9/skip") == "../../stow/pkg9/bin9/skip"
+
+    # editing the file in place leaves the package directory unchanged
+    with open("../stow/pkg9/.stow-local-ignore", "w") as f:
+        f.write("skip\n")
+
+    restow(["pkg9"])
+
+    assert readlink("bin9/keep") == "../../stow/pkg9/bin9/keep"
+    assert not link_exists("bin9/skip")
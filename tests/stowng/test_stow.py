@@ -1,5 +1,11 @@
-import pytest
+import os
+import re
+import sys
+
+from stowng import executor
 from stowng.farmer import Farmer
+from stowng.filesystem import Filesystem
+from stowng.planstore import PlanStore
 
 from utils import (
     cat_file,
@@ -8,32 +14,11 @@ from utils import (
     make_invalid_link,
     make_link,
     make_path,
-    delete_dir,
-    path_exists,
-    change_dir,
-    get_cwd,
     make_file,
     readlink,
+    record_calls,
 )
 
-TEST_DIR = "stowng_test"
-
-
-@pytest.fixture(autouse=True)
-def test_wrapper():
-    new_cwd = f"{TEST_DIR}/target"
-    old_cwd = get_cwd()
-
-    make_path(new_cwd)
-    assert path_exists(new_cwd)
-    change_dir(new_cwd)
-
-    yield
-
-    change_dir(old_cwd)
-    delete_dir(TEST_DIR)
-    assert not path_exists(TEST_DIR)
-
 
 def test_stow_a_simple_tree_minimally():
     farmer = Farmer(dir="../stow", target=".", test_mode=True)
@@ -189,3 +174,292 @@ def test_replace_existing_but_invalid_link():
     farmer.process_tasks()
 
     assert readlink("file6") == "../stow/pkg6/file6"
+
+
+def test_stow_then_unstow():
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+
+    make_path("../stow/pkg7/bin7")
+    make_file("../stow/pkg7/bin7/file7")
+
+    farmer.plan_stow(["pkg7"])
+    farmer.process_tasks()
+
+    assert readlink("bin7") == "../stow/pkg7/bin7"
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer.plan_unstow(["pkg7"])
+    farmer.process_tasks()
+
+    assert not link_exists("bin7")
+
+
+def test_stow_with_local_ignore_file():
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+
+    make_path("../stow/pkg8/lib8")
+    make_file("../stow/pkg8/.stow-local-ignore", "file8b\n")
+    make_file("../stow/pkg8/lib8/file8a")
+    make_file("../stow/pkg8/lib8/file8b")
+    make_path("lib8")
+
+    farmer.plan_stow(["pkg8"])
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert readlink("lib8/file8a") == "../../stow/pkg8/lib8/file8a"
+    assert not link_exists("lib8/file8b")
+
+
+def test_stow_with_ignore_options():
+    farmer = Farmer(
+        dir="../stow",
+        target=".",
+        test_mode=True,
+        ignore=[re.compile("lib9/file9b"), re.compile("other/")],
+    )
+
+    make_path("../stow/pkg9/lib9")
+    make_file("../stow/pkg9/lib9/file9a")
+    make_file("../stow/pkg9/lib9/file9b")
+    make_path("lib9")
+
+    farmer.plan_stow(["pkg9"])
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert readlink("lib9/file9a") == "../../stow/pkg9/lib9/file9a"
+    assert not link_exists("lib9/file9b")
+
+
+def test_defer_to_already_stowed_package():
+    farmer = Farmer(
+        dir="../stow", target=".", test_mode=True, defer=[re.compile("bin10")]
+    )
+
+    make_path("../stow/pkg10a/bin10")
+    make_file("../stow/pkg10a/bin10/file10")
+    make_path("../stow/pkg10b/bin10")
+    make_file("../stow/pkg10b/bin10/file10")
+    make_path("bin10")
+    make_link("bin10/file10", "../../stow/pkg10a/bin10/file10")
+
+    farmer.plan_stow(["pkg10b"])
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert readlink("bin10/file10") == "../../stow/pkg10a/bin10/file10"
+
+
+def test_unfold_tree_owned_by_other_marked_stow_dir():
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+
+    make_path("../stow2/pkg11a/bin11")
+    make_file("../stow2/.stow")
+    make_file("../stow2/pkg11a/bin11/file11a")
+    make_link("bin11", "../stow2/pkg11a/bin11")
+
+    make_path("../stow/pkg11b/bin11")
+    make_file("../stow/pkg11b/bin11/file11b")
+
+    farmer.plan_stow(["pkg11b"])
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert dir_exists("bin11")
+    assert readlink("bin11/file11a") == "../../stow2/pkg11a/bin11/file11a"
+    assert readlink("bin11/file11b") == "../../stow/pkg11b/bin11/file11b"
+
+
+def test_restow_cancels_redundant_tasks():
+    make_path("../stow/pkg12/lib12")
+    make_file("../stow/pkg12/lib12/file12")
+    make_path("lib12")
+    make_link("lib12/file12", "../../stow/pkg12/lib12/file12")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer.plan_unstow(["pkg12"])
+    farmer.plan_stow(["pkg12"])
+
+    assert farmer.get_conflict_count() == 0
+    assert farmer.get_task_count() == 0
+
+
+def test_plan_tree_deeper_than_recursion_limit():
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, no_folding=True)
+
+    depth = 400
+    make_path("../stow/pkg13/" + "/".join(["d"] * depth))
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(250)
+
+    try:
+        farmer.plan_stow(["pkg13"])
+    finally:
+        sys.setrecursionlimit(limit)
+
+    assert farmer.get_conflict_count() == 0
+    assert farmer.get_task_count() == depth
+
+
+def test_stow_with_parallel_jobs():
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, no_folding=True, jobs=4)
+
+    for d in ("a", "a/b", "c"):
+        make_path(f"../stow/pkg14/{d}")
+        for i in range(5):
+            make_file(f"../stow/pkg14/{d}/file{i}")
+
+    make_path("../stow/pkg14b/a")
+    make_file("../stow/pkg14b/a/other")
+    make_link("a", "../stow/pkg14b/a")
+
+    farmer.plan_stow(["pkg14"])
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert dir_exists("a")
+    assert dir_exists("a/b")
+    assert readlink("a/other") == "../../stow/pkg14b/a/other"
+
+    for d in ("a", "a/b", "c"):
+        up = "../" * (d.count("/") + 1)
+        for i in range(5):
+            assert readlink(f"{d}/file{i}") == f"{up}../stow/pkg14/{d}/file{i}"
+
+
+def test_stow_with_dir_fd():
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, dir_fd=True, jobs=2)
+
+    make_path("../stow/pkg15a/lib15/sub")
+    make_file("../stow/pkg15a/lib15/sub/file15a")
+    make_path("../stow/pkg15b/lib15/sub")
+    make_file("../stow/pkg15b/lib15/sub/file15b")
+    make_link("lib15", "../stow/pkg15a/lib15")
+
+    farmer.plan_stow(["pkg15b"])
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert dir_exists("lib15/sub")
+    assert readlink("lib15/sub/file15a") == "../../../stow/pkg15a/lib15/sub/file15a"
+    assert readlink("lib15/sub/file15b") == "../../../stow/pkg15b/lib15/sub/file15b"
+
+
+def test_replace_invalid_link_atomically():
+    make_path("../stow/pkg16")
+    make_file("../stow/pkg16/file16")
+
+    for dir_fd in (False, True):
+        farmer = Farmer(dir="../stow", target=".", test_mode=True, dir_fd=dir_fd)
+        make_invalid_link("file16", "../stow/path-does-not-exist")
+
+        farmer.plan_stow(["pkg16"])
+
+        tasks = list(farmer._tasks.tasks)
+        assert len(tasks) == 1
+        assert str(tasks[0].action) == "replace"
+
+        farmer.process_tasks()
+
+        assert readlink("file16") == "../stow/pkg16/file16"
+        assert os.listdir(".") == ["file16"]
+
+        os.unlink("file16")
+
+
+def test_durable_syncs_each_changed_directory_once(monkeypatch):
+    synced = record_calls(monkeypatch, executor, "sync_paths")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, durable=True, jobs=2)
+
+    make_path("../stow/pkg17/lib17/a")
+    make_path("../stow/pkg17/lib17/b")
+    make_file("../stow/pkg17/lib17/a/x")
+    make_file("../stow/pkg17/lib17/b/y")
+    make_path("lib17")
+
+    farmer.plan_stow(["pkg17"])
+    farmer.process_tasks()
+
+    assert readlink("lib17/a") == "../../stow/pkg17/lib17/a"
+    assert [path for paths in synced for path in paths] == ["lib17"]
+
+
+def test_stow_into_absent_subtree_without_probing(monkeypatch):
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, no_folding=True)
+
+    for d in ("share18", "share18/a", "share18/a/b"):
+        make_path(f"../stow/pkg18/{d}")
+        make_file(f"../stow/pkg18/{d}/file")
+
+    make_link("../stow/pkg18/share18/a/abs", "/etc/hostname")
+
+    probed = record_calls(monkeypatch, Filesystem, "is_a_node")
+
+    farmer.plan_stow(["pkg18"])
+
+    assert probed == [".", "share18"]
+    assert farmer.get_conflict_count() == 1
+    assert "absolute symlink" in farmer.get_conflicts()["stow"]["pkg18"][0]
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, no_folding=True)
+    os.unlink("../stow/pkg18/share18/a/abs")
+    farmer.plan_stow(["pkg18"])
+    farmer.process_tasks()
+
+    assert dir_exists("share18/a/b")
+    assert readlink("share18/file") == "../../stow/pkg18/share18/file"
+    assert readlink("share18/a/b/file") == "../../../../stow/pkg18/share18/a/b/file"
+
+
+def test_stow_with_spilled_plan():
+    make_path("../spill")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, jobs=2)
+    farmer._tasks.tasks = PlanStore(spill_threshold=2, spill_dir="../spill")
+
+    make_path("../stow/pkg19/bin19")
+
+    for i in range(5):
+        make_file(f"../stow/pkg19/bin19/file{i}")
+
+    make_path("bin19")
+    make_file("bin19/own")
+
+    farmer.plan_stow(["pkg19"])
+
+    assert farmer._tasks.tasks.spilled
+
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert os.listdir("../spill") == []
+
+    for i in range(5):
+        assert readlink(f"bin19/file{i}") == f"../../stow/pkg19/bin19/file{i}"
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer._tasks.tasks = PlanStore(spill_threshold=2)
+    farmer.plan_unstow(["pkg19"])
+    farmer.process_tasks()
+
+    assert os.listdir("bin19") == ["own"]
+
+
+def test_replaced_link_is_not_scheduled_for_removal():
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+
+    make_path("../stow/pkg20/lib20")
+    make_path("../stow/pkg20/other20")
+    make_link("lib20", "../stow/pkg20/lib20")
+
+    tasks = farmer._tasks
+    tasks.do_unlink("lib20")
+
+    assert tasks.parent_link_scheduled_for_removal("lib20/file")
+
+    tasks.do_link("../stow/pkg20/other20", "lib20")
+
+    assert not tasks.parent_link_scheduled_for_removal("lib20/file")
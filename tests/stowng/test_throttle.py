@@ -0,0 +1,36 @@
+import pytest
+
+from stowng.executor import Executor
+from stowng.task import Action, NodeType, Task
+from stowng.throttle import RateLimiter
+
+from utils import dir_exists
+
+
+def test_rate_limiter_allows_bursts():
+    now = [0.0]
+    waits = []
+    limiter = RateLimiter(10, burst=3, clock=lambda: now[0], sleep=waits.append)
+
+    for _ in range(5):
+        limiter.acquire()
+
+    assert waits == pytest.approx([0.1, 0.2])
+
+    now[0] = 10.0
+    assert limiter.acquire() == 0.0
+
+
+def test_throttled_executor_keeps_plan_order():
+    order = []
+    tasks = [Task(Action.CREATE, NodeType.DIR, path=f"dir{i}") for i in range(6)]
+
+    class Recording(Executor):
+        def _process(self, index, task):
+            order.append(index)
+            super()._process(index, task)
+
+    Recording(jobs=4, max_rate=1000, max_inflight=1).run(tasks)
+
+    assert order == list(range(6))
+    assert all(dir_exists(f"dir{i}") for i in range(6))
@@ -0,0 +1,161 @@
+import os
+
+from stowng.farmer import Farmer
+from stowng.tasks import Tasks
+
+from utils import (
+    dir_exists,
+    link_exists,
+    make_file,
+    make_link,
+    make_path,
+    path_exists,
+    readlink,
+    record_calls,
+)
+
+
+def test_unstow_a_simple_tree():
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+
+    make_path("../stow/pkg1/bin1")
+    make_file("../stow/pkg1/bin1/file1")
+    make_link("bin1", "../stow/pkg1/bin1")
+
+    farmer.plan_unstow(["pkg1"])
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert not path_exists("bin1")
+
+
+def test_unstow_from_an_existing_directory():
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+
+    make_path("../stow/pkg2/lib2")
+    make_file("../stow/pkg2/lib2/file2")
+    make_path("lib2")
+    make_link("lib2/file2", "../../stow/pkg2/lib2/file2")
+
+    farmer.plan_unstow(["pkg2"])
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert dir_exists("lib2")
+    assert not path_exists("lib2/file2")
+
+
+def test_refold_tree_after_unstow():
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+
+    make_path("../stow/pkg3a/bin3")
+    make_file("../stow/pkg3a/bin3/file3a")
+    make_path("../stow/pkg3b/bin3")
+    make_file("../stow/pkg3b/bin3/file3b")
+    make_path("bin3")
+    make_link("bin3/file3a", "../../stow/pkg3a/bin3/file3a")
+    make_link("bin3/file3b", "../../stow/pkg3b/bin3/file3b")
+
+    farmer.plan_unstow(["pkg3b"])
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert link_exists("bin3")
+    assert readlink("bin3") == "../stow/pkg3a/bin3"
+
+
+def test_unstow_compat_mode():
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, compat=True)
+
+    make_path("../stow/pkg4/lib4")
+    make_file("../stow/pkg4/lib4/file4")
+    make_path("lib4")
+    make_link("lib4/file4", "../../stow/pkg4/lib4/file4")
+    make_link("bin4", "../stow/pkg4/lib4")
+
+    farmer.plan_unstow(["pkg4"])
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert dir_exists("lib4")
+    assert not path_exists("lib4/file4")
+    assert link_exists("bin4")
+
+
+def test_unstow_many_packages_in_a_single_pass(monkeypatch):
+    cleaned = record_calls(monkeypatch, Tasks, "cleanup_invalid_links")
+
+    for package in ("pkg5a", "pkg5b", "pkg5c"):
+        make_path(f"../stow/{package}/bin5")
+        make_file(f"../stow/{package}/bin5/{package}")
+
+    make_path("bin5")
+    make_file("bin5/own")
+
+    make_link("bin5/pkg5a", "../../stow/pkg5a/bin5/pkg5a")
+    make_link("bin5/pkg5b", "../../stow/pkg5c/bin5/pkg5c")
+    make_link("bin5/pkg5c", "../../stow/pkg5c/bin5/pkg5c")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer.plan_unstow(["pkg5a", "pkg5b"])
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert not path_exists("bin5/pkg5a")
+    assert readlink("bin5/pkg5b") == "../../stow/pkg5c/bin5/pkg5c"
+    assert readlink("bin5/pkg5c") == "../../stow/pkg5c/bin5/pkg5c"
+    assert dir_exists("bin5")
+    assert cleaned.count("bin5") == 1
+
+
+def test_refold_tree_after_unstow_of_many_packages():
+    for package in ("pkg6a", "pkg6b", "pkg6c"):
+        make_path(f"../stow/{package}/bin6")
+        make_file(f"../stow/{package}/bin6/{package}")
+
+    make_path("bin6")
+
+    for package in ("pkg6a", "pkg6b", "pkg6c"):
+        make_link(f"bin6/{package}", f"../../stow/{package}/bin6/{package}")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer.plan_unstow(["pkg6b", "pkg6c"])
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert readlink("bin6") == "../stow/pkg6a/bin6"
+
+
+def test_unstow_many_packages_removes_unfolded_directories():
+    for package in ("pkg7a", "pkg7b"):
+        make_path(f"../stow/{package}/bin7")
+        make_file(f"../stow/{package}/bin7/{package}")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer.plan_stow(["pkg7a", "pkg7b"])
+    farmer.process_tasks()
+
+    assert dir_exists("bin7") and not link_exists("bin7")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer.plan_unstow(["pkg7a", "pkg7b"])
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert os.listdir(".") == []
+
+
+def test_unstow_compat_mode_skips_link_planned_for_removal():
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, compat=True)
+
+    make_path("../stow/pkg8a/etc8")
+    make_file("../stow/pkg8a/etc8/file8a")
+    make_path("../stow/pkg8b/etc8")
+    make_file("../stow/pkg8b/etc8/file8b")
+    make_link("etc8", "../stow/pkg8a/etc8")
+
+    farmer.plan_unstow(["pkg8a", "pkg8b"])
+    farmer.process_tasks()
+
+    assert farmer.get_conflict_count() == 0
+    assert not path_exists("etc8")
@@ -0,0 +1,118 @@
+import os
+
+import pytest
+
+from stowng.farmer import Farmer
+from stowng.materialize import LinkMode
+from stowng.watch import Watcher, inotify_supported
+
+from utils import (
+    cat_file,
+    link_exists,
+    make_file,
+    make_path,
+    readlink,
+)
+
+pytestmark = pytest.mark.skipif(
+    not inotify_supported(), reason="inotify is not available"
+)
+
+
+def watch(packages):
+    batches = []
+
+    def apply(changes):
+        batches.append(changes)
+
+        farmer = Farmer(dir="../stow", target=".", test_mode=True)
+
+        for package, dirs in changes.items():
+            farmer.plan_restow_dirs(package, dirs)
+
+        farmer.process_tasks()
+
+    return Watcher("../stow", packages, apply, debounce=0.05), batches
+
+
+def test_watch_coalesces_a_burst_into_one_batch():
+    make_path("../stow/pkg1/bin1/sub1")
+    make_file("../stow/pkg1/bin1/old")
+    make_path("bin1")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer.plan_stow(["pkg1"])
+    farmer.process_tasks()
+
+    watcher, batches = watch(["pkg1"])
+
+    os.unlink("../stow/pkg1/bin1/old")
+
+    for i in range(5):
+        make_file(f"../stow/pkg1/bin1/new{i}")
+
+    make_file("../stow/pkg1/bin1/sub1/deep")
+
+    watcher.run(batches=1)
+    watcher.close()
+
+    assert batches == [{"pkg1": ["bin1"]}]
+    assert not link_exists("bin1/old")
+    assert readlink("bin1/new4") == "../../stow/pkg1/bin1/new4"
+    assert readlink("bin1/sub1") == "../../stow/pkg1/bin1/sub1"
+
+
+def test_watch_follows_new_directories():
+    make_path("../stow/pkg2/bin2")
+    make_path("bin2")
+    make_path("bin2/sub2")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True)
+    farmer.plan_stow(["pkg2"])
+    farmer.process_tasks()
+
+    watcher, batches = watch(["pkg2"])
+
+    make_path("../stow/pkg2/bin2/sub2")
+    watcher.run(batches=1)
+
+    make_file("../stow/pkg2/bin2/sub2/file")
+    watcher.run(batches=1)
+    watcher.close()
+
+    assert batches == [{"pkg2": ["bin2"]}, {"pkg2": ["bin2/sub2"]}]
+    assert readlink("bin2/sub2/file") == "../../../stow/pkg2/bin2/sub2/file"
+
+
+def test_watch_refreshes_copies_of_changed_files():
+    make_path("../stow/pkg3/bin3")
+    make_file("../stow/pkg3/bin3/file", "old")
+
+    farmer = Farmer(dir="../stow", target=".", test_mode=True, link_mode=LinkMode.COPY)
+    farmer.plan_stow(["pkg3"])
+    farmer.process_tasks()
+
+    batches = []
+
+    def apply(changes):
+        batches.append(changes)
+
+        farmer = Farmer(
+            dir="../stow", target=".", test_mode=True, link_mode=LinkMode.COPY
+        )
+
+        for package, dirs in changes.items():
+            farmer.plan_restow_dirs(package, dirs)
+
+        farmer.process_tasks()
+
+    watcher = Watcher("../stow", ["pkg3"], apply, debounce=0.05, contents=True)
+
+    with open("../stow/pkg3/bin3/file", "w") as f:
+        f.write("changed")
+
+    watcher.run(batches=1)
+    watcher.close()
+
+    assert batches == [{"pkg3": ["bin3"]}]
+    assert cat_file("bin3/file") == "changed"
@@ -1,5 +1,6 @@
 import os
 import shutil
+import inspect
 
 
 def path_exists(path: str):
@@ -24,7 +25,7 @@ def make_file(path: str, content: str = ""):
 
 
 def make_link(link: str, target: str, invalid: bool = False):
-    if not path_exists(target):
+    if not path_exists(os.path.join(os.path.dirname(link), target)):
         if invalid:
             os.symlink(target, link)
         else:
@@ -56,3 +57,17 @@ def readlink(link: str):
 def cat_file(file: str):
     with open(file, "r") as f:
         return f.read()
+
+
+def record_calls(monkeypatch, owner, name: str):
+    # the first argument of every call, besides self for methods
+    calls = []
+    original = getattr(owner, name)
+    skip = 1 if inspect.isclass(owner) else 0
+
+    def record(*args, **kwargs):
+        calls.append(args[skip])
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(owner, name, record)
+    return calls